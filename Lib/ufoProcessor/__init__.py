@@ -3,10 +3,16 @@
 
 from __future__ import print_function, division, absolute_import
 
-import plistlib
 import os
+import sys
 import logging, traceback
 import collections
+import copy
+import time
+import gc
+import threading
+import contextlib
+import multiprocessing
 from pprint import pprint
 
 from fontTools.designspaceLib import DesignSpaceDocument, SourceDescriptor, InstanceDescriptor, AxisDescriptor, RuleDescriptor, processRules
@@ -18,13 +24,53 @@ import defcon
 from defcon.objects.font import Font
 from defcon.pens.transformPointPen import TransformPointPen
 from defcon.objects.component import _defaultTransformation
-from fontMath.mathGlyph import MathGlyph
+from fontMath.mathGlyph import MathGlyph, FilterRedundantPointPen
+from fontMath.mathFunctions import _roundNumber
 from fontMath.mathInfo import MathInfo
 from fontMath.mathKerning import MathKerning
 
 # if you only intend to use varLib.model then importing mutatorMath is not necessary.
 from mutatorMath.objects.mutator import buildMutator
-from ufoProcessor.varModels import VariationModelMutator
+from ufoProcessor.varModels import VariationModelMutator, StaticMutator
+from ufoProcessor.atomicSave import saveFontIncremental
+from ufoProcessor.glifReader import GlyphReader, ReaderFont, readUFOPlist, preloadGlyphs
+
+try:
+    import resource
+except ImportError:
+    # windows has no resource module
+    resource = None
+
+# In low memory mode: roughly how many bytes a built glyph mutator takes
+# for each byte of packed master data, and how much memory the glyph
+# mutators can use at one time if there is no memoryTarget.
+_mutatorMemoryFactor = 10
+_defaultGlyphBatchMemory = 64 * 1024 * 1024
+# nested components can take a couple of rounds to release
+_releaseRounds = 8
+
+
+def _getPeakMemory():
+    # The peak resident memory of this process since it started, plus the
+    # peak of the largest worker process that finished, in bytes.
+    # These are lifetime high water marks, not the peak of one run.
+    # None if we can't tell.
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss + resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    if sys.platform == "darwin":
+        return peak
+    # kilobytes everywhere else
+    return peak * 1024
+
+
+def _getCurrentMemory():
+    # The resident memory of this process in bytes. None if we can't tell.
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (IOError, OSError, ValueError, AttributeError):
+        return None
 
 
 class UFOProcessorError(Exception):
@@ -59,6 +105,9 @@ class UFOProcessorError(Exception):
         documentPath: path to the designspace file.
         outputUFOFormatVersion: integer, 2, 3. Format for generated UFOs. Note: can be different from source UFO format.
         useVarlib: True if you want the geometry to be generated with varLib.model instead of mutatorMath.
+        workers: number of processes to interpolate the glyphs with.
+
+    The same is available from the command line, see ufoProcessor.commandLine.
 """
 
 def build(
@@ -71,6 +120,7 @@ def build(
         processRules=True,
         logger=None,
         useVarlib=False,
+        workers=1,
         ):
     """
         Simple builder for UFO designspaces.
@@ -87,6 +137,7 @@ def build(
         document = DesignSpaceProcessor(ufoVersion=outputUFOFormatVersion)
         document.useVarlib = useVarlib
         document.roundGeometry = roundGeometry
+        document.workers = workers
         document.read(path)
         try:
             r = document.generateUFO(processRules=processRules)
@@ -111,8 +162,8 @@ def getUFOVersion(ufoPath):
             #   <integer>2</integer>
             # </dict>
             # </plist>
-    metaInfoPath = os.path.join(ufoPath, u"metainfo.plist")
-    p = plistlib.readPlist(metaInfoPath)
+    # This also works for .ufoz files.
+    p = readUFOPlist(ufoPath, u"metainfo.plist", {})
     return p.get('formatVersion')
 
 
@@ -195,6 +246,81 @@ def swapGlyphNames(font, oldName, newName, swapNameExtension = "_______________s
         del font[r]
 
 
+def compactKerning(kerning, groups, threshold=0):
+    # Remove the pairs from kerning that do not change the kerning of the font.
+    #     - pairs that are 0 and have no class pair to override
+    #     - exceptions that have the same value as the class pair
+    #     - optionally: pairs that differ less than threshold from what the
+    #       font would get without them.
+    # The pairs are evaluated from the least to the most specific:
+    # group-group, group-glyph and glyph-group, glyph-glyph.
+    # Returns a dict with the number of pairs that were removed for each reason.
+    side1Groups = {}
+    side2Groups = {}
+    for groupName, members in groups.items():
+        if groupName.startswith("public.kern1."):
+            for name in members:
+                side1Groups[name] = groupName
+        elif groupName.startswith("public.kern2."):
+            for name in members:
+                side2Groups[name] = groupName
+    def fallbacks(first, second):
+        firstGroup = side1Groups.get(first) if first not in groups else None
+        secondGroup = side2Groups.get(second) if second not in groups else None
+        candidates = []
+        if secondGroup is not None:
+            candidates.append((first, secondGroup))
+        if firstGroup is not None:
+            candidates.append((firstGroup, second))
+            if secondGroup is not None:
+                candidates.append((firstGroup, secondGroup))
+        return candidates
+    def specificity(pair):
+        return (pair[0] not in groups) + (pair[1] not in groups)
+    report = dict(before=len(kerning), zeroPairs=0, redundantExceptions=0, thresholdPairs=0)
+    for pair in sorted(kerning.keys(), key=specificity):
+        value = kerning[pair]
+        fallbackValue = 0
+        for candidate in fallbacks(*pair):
+            if candidate in kerning:
+                fallbackValue = kerning[candidate]
+                break
+        if value == fallbackValue:
+            if value == 0:
+                report['zeroPairs'] += 1
+            else:
+                report['redundantExceptions'] += 1
+        elif threshold and abs(value - fallbackValue) < threshold:
+            report['thresholdPairs'] += 1
+        else:
+            continue
+        del kerning[pair]
+    report['after'] = len(kerning)
+    return report
+
+
+class _MasterDataGlyphSet(object):
+    # Looks enough like a layer for the DecomposePointPen,
+    # gets the glyphs of one source from packed master data.
+
+    def __init__(self, masterData, sourceName):
+        self._masterData = masterData
+        self._sourceName = sourceName
+        self._glyphs = {}
+
+    def __contains__(self, glyphName):
+        return self[glyphName] is not None
+
+    def __getitem__(self, glyphName):
+        if glyphName not in self._glyphs:
+            self._glyphs[glyphName] = None
+            for loc, mathGlyph, sourceInfo in self._masterData.getGlyphItems(glyphName):
+                if sourceInfo['sourceName'] == self._sourceName:
+                    self._glyphs[glyphName] = mathGlyph
+                    break
+        return self._glyphs[glyphName]
+
+
 class DecomposePointPen(object):
     
     def __init__(self, glyphSet, outPointPen):
@@ -204,7 +330,7 @@ class DecomposePointPen(object):
         self.endPath = outPointPen.endPath
         self.addPoint = outPointPen.addPoint
         
-    def addComponent(self, baseGlyphName, transformation):
+    def addComponent(self, baseGlyphName, transformation, identifier=None, **kwargs):
         if baseGlyphName in self._glyphSet:
             baseGlyph = self._glyphSet[baseGlyphName]
             if transformation == _defaultTransformation:
@@ -215,6 +341,113 @@ class DecomposePointPen(object):
 
 
 
+class RoundingPointPen(object):
+    # Rounds the points and component offsets on the way to outPointPen,
+    # the same as MathGlyph.round() but without making a copy first.
+
+    def __init__(self, outPointPen):
+        self._outPointPen = outPointPen
+        self.beginPath = outPointPen.beginPath
+        self.endPath = outPointPen.endPath
+
+    def addPoint(self, pt, segmentType=None, smooth=False, name=None, identifier=None, **kwargs):
+        self._outPointPen.addPoint((_roundNumber(pt[0]), _roundNumber(pt[1])), segmentType=segmentType, smooth=smooth, name=name, identifier=identifier, **kwargs)
+
+    def addComponent(self, baseGlyphName, transformation, identifier=None, **kwargs):
+        self._outPointPen.addComponent(baseGlyphName, _roundTransformation(transformation), identifier=identifier, **kwargs)
+
+
+# Small helpers to round and write the parts of a MathGlyph that are not drawn,
+# the same as MathGlyph.round() and MathGlyph.extractGlyph() do.
+
+_imageTransformationKeys = ["xScale", "xyScale", "yxScale", "yScale", "xOffset", "yOffset"]
+
+def _roundTransformation(transformation):
+    xScale, xyScale, yxScale, yScale, xOffset, yOffset = transformation
+    return (xScale, xyScale, yxScale, yScale, _roundNumber(xOffset), _roundNumber(yOffset))
+
+def _roundAnchors(anchors):
+    result = []
+    for anchor in anchors:
+        anchor = dict(anchor)
+        anchor["x"], anchor["y"] = _roundNumber(anchor["x"]), _roundNumber(anchor["y"])
+        result.append(anchor)
+    return result
+
+def _roundGuidelines(guidelines):
+    result = []
+    for guideline in guidelines:
+        guideline = dict(guideline)
+        guideline["x"], guideline["y"] = _roundNumber(guideline["x"]), _roundNumber(guideline["y"])
+        result.append(guideline)
+    return result
+
+def _roundImage(image):
+    return dict(fileName=image["fileName"], transformation=_roundTransformation(image["transformation"]), color=image["color"])
+
+def _compressGuideline(guideline):
+    # leave out the coordinate and angle that a horizontal or vertical guideline does not need
+    guideline = dict(guideline)
+    x = guideline["x"]
+    y = guideline["y"]
+    angle = guideline["angle"]
+    if x == 0 and angle in (0, 180):
+        guideline["x"] = None
+        guideline["angle"] = None
+    elif y == 0 and angle in (90, 270):
+        guideline["y"] = None
+        guideline["angle"] = None
+    return guideline
+
+def _compressImage(image):
+    if image["fileName"] is None:
+        return None
+    compressed = dict(fileName=image["fileName"], color=image["color"])
+    for key, value in zip(_imageTransformationKeys, image["transformation"]):
+        compressed[key] = value
+    return compressed
+
+
+
+# the processor in a glyph worker process
+_glyphWorkerProcessor = None
+
+def _initGlyphWorker(processor):
+    global _glyphWorkerProcessor
+    _glyphWorkerProcessor = processor
+
+def _initSharedGlyphWorker(processor, sharedMastersKind, sharedMastersName):
+    from ufoProcessor.sharedMasters import SharedMasterData
+    processor.useMasterData(SharedMasterData.attach(sharedMastersKind, sharedMastersName))
+    _initGlyphWorker(processor)
+
+def _makeGlyphInstanceChunk(args):
+    # Interpolate a chunk of glyphs in a worker process.
+    # Return the results and the problems we ran into.
+    instanceDescriptor, glyphNames = args
+    processor = _glyphWorkerProcessor
+    problemCount = len(processor.problems)
+    results = {}
+    batchCost = 0
+    for glyphName in glyphNames:
+        results[glyphName] = processor._makeGlyphInstance(instanceDescriptor, glyphName)
+        batchCost = processor._releaseGlyphBatch(batchCost, glyphName)
+    problems = processor.problems[problemCount:]
+    del processor.problems[problemCount:]
+    return results, problems
+
+def _makeGlyphColumnChunk(args):
+    # Interpolate a chunk of glyphs for all instances in a worker process.
+    # Return a list of (glyphName, results) and the problems we ran into.
+    instances, glyphNames = args
+    processor = _glyphWorkerProcessor
+    problemCount = len(processor.problems)
+    results = [(glyphName, processor._makeGlyphColumn(instances, glyphName)) for glyphName in glyphNames]
+    problems = processor.problems[problemCount:]
+    del processor.problems[problemCount:]
+    return results, problems
+
+
 class DesignSpaceProcessor(DesignSpaceDocument):
     """
         A subclassed DesignSpaceDocument that can
@@ -248,39 +481,365 @@ class DesignSpaceProcessor(DesignSpaceDocument):
         self._glyphMutators = {}
         self._infoMutator = None
         self._kerningMutator = None
+        self._variationModels = {}  # master locations: (VariationModel, SupportIndex) shared by the varlib mutators
         self.fonts = {}
         self._fontsLoaded = False
+        self._glyphIndex = None   # glyphName: [(sourceDescriptor, layerName), ...]
+        self._designSpaceState = None   # the axes and sources the fonts were loaded for, see updateDesignSpace
+        self._masterData = None     # packed master data, see ufoProcessor.sharedMasters
+        self._sharedMasters = None
+        self._masterSnapshot = None     # mapped master snapshot file, see useMasterSnapshot
+        self.fastMasterReading = False  # read the master glyphs straight from the glif files, see ufoProcessor.glifReader
+        self._glyphReaders = {}     # sourceName: GlyphReader
         self.glyphNames = []     # list of all glyphnames
         self.processRules = True
+        self.workers = 1        # number of processes for interpolating glyphs in makeInstance
+        self.kerningCompaction = False  # remove kerning pairs that do not change the instance kerning
+        self.kerningThreshold = 0       # and optionally the pairs that change it less than this
+        self.incrementalSave = False    # only write the files of existing instances that changed
+        self.outputFormat = "ufo"       # or "ttf" or "otf" to save the instances as binary fonts, see ufoProcessor.fontCompiler
+        self.saveWorkers = 0            # threads that save the instances in generateUFO while the next ones are made, see ufoProcessor.instanceWriter
+        self.saveQueueSize = 2          # the number of finished instances that can wait for a writer
+        self.glyphMajor = False         # make each glyph for all instances, then the next glyph, instead of one instance at a time
+        self.glyphMajorGroupSize = 8    # with glyphMajor, the number of instances made together, and in memory, at one time. None for all of them.
+        self.lowMemory = False          # let go of the master glyphs once they are packed, build the glyph mutators in batches
+        self.memoryTarget = None        # in low memory mode, the peak memory in bytes to aim for. Sets the size of the batches.
+        self.peakMemory = None          # peak memory in bytes of the process and its finished workers so far, taken after the last iterInstances or generateUFO
+        self._glyphBatchCost = None     # in low memory mode, the estimated cost of the glyph mutators kept at one time
+        self._glyphPool = None
+        self._glyphInstanceCache = None     # locationKey: {glyphName: result} for instances at the same location
+        self.instanceTimings = []   # seconds spent on each instance in the last generateUFO
+        self._makeLocks()
         self.problems = []  # receptacle for problem notifications. Not big enough to break, but also not small enough to ignore.
+        self.messages = []  # receptacle for informational messages, what was loaded, generated, and how. Not problems.
         if readerClass is not None:
             print("ufoProcessor.ruleDescriptorClass", readerClass.ruleDescriptorClass)
 
-    def generateUFO(self, processRules=True):
+    def _makeLocks(self):
+        # Locks for the things that are built lazily, so that one processor
+        # can serve several threads. Each mutator has its own lock, see _getMutatorLock.
+        self._locksLock = threading.Lock()
+        self._mutatorLocks = {}
+        self._fontsLock = threading.RLock()
+        self._local = threading.local()
+
+    def __getstate__(self):
+        # locks can't be pickled or copied, the copy gets new ones
+        state = self.__dict__.copy()
+        for key in ['_locksLock', '_mutatorLocks', '_fontsLock', '_local']:
+            state.pop(key, None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._makeLocks()
+
+    def _getMutatorLock(self, key):
+        # Return the lock for building the mutator with this key.
+        with self._locksLock:
+            lock = self._mutatorLocks.get(key)
+            if lock is None:
+                lock = self._mutatorLocks[key] = threading.Lock()
+            return lock
+
+    def _get_problems(self):
+        problems = getattr(self._local, "problems", None)
+        if problems is not None:
+            return problems
+        return self._problems
+
+    def _set_problems(self, problems):
+        self._problems = problems
+
+    problems = property(_get_problems, _set_problems, doc="list of problem notifications, see collectProblems")
+
+    def _get_messages(self):
+        messages = getattr(self._local, "messages", None)
+        if messages is not None:
+            return messages
+        return self._messages
+
+    def _set_messages(self, messages):
+        self._messages = messages
+
+    messages = property(_get_messages, _set_messages, doc="list of informational messages, see collectProblems")
+
+    @contextlib.contextmanager
+    def collectProblems(self, messages=None):
+        """ Collect the problems of the current thread in a separate list.
+            For serving several requests from threads at the same time:
+
+                with processor.collectProblems() as problems:
+                    font = processor.makeInstance(instanceDescriptor)
+
+            The messages of the current thread go to the messages list
+            if one is given, otherwise they are dropped.
+        """
+        previousProblems = getattr(self._local, "problems", None)
+        previousMessages = getattr(self._local, "messages", None)
+        problems = []
+        if messages is None:
+            messages = []
+        self._local.problems = problems
+        self._local.messages = messages
+        try:
+            yield problems
+        finally:
+            self._local.problems = previousProblems
+            self._local.messages = previousMessages
+
+    def generateUFO(self, processRules=True, glyphNames=None):
         # makes the instances
         # option to execute the rules
+        # option to only make some glyphs
         # make sure we're not trying to overwrite a newer UFO format
+        self.instanceTimings = []
+        instances = [instanceDescriptor for instanceDescriptor in self.instances if instanceDescriptor.path is not None]
+        if self.saveWorkers > 0:
+            self._generatePipelined(instances, processRules, glyphNames)
+        else:
+            start = time.time()
+            for instanceDescriptor, font in self.iterInstances(processRules, glyphNames=glyphNames, instances=instances):
+                makeTime = time.time() - start
+                start = time.time()
+                saved = self.saveInstanceFont(font, instanceDescriptor.path)
+                if saved:
+                    self.instanceTimings.append(dict(name=instanceDescriptor.name, path=instanceDescriptor.path, makeInstance=makeTime, save=time.time()-start))
+                start = time.time()
+        if self.lowMemory and self.peakMemory is not None:
+            self.messages.append("Peak memory %.1f MB" % (self.peakMemory / 2**20))
+        return True
+
+    def _generatePipelined(self, instances, processRules, glyphNames):
+        # Make the instances here and save them on writer threads, see ufoProcessor.instanceWriter.
+        # An error in a writer stops the build, and is raised here.
+        from ufoProcessor.instanceWriter import InstanceWriter
+        writer = InstanceWriter(self, workers=self.saveWorkers, queueSize=self.saveQueueSize)
+        made = self.iterInstances(processRules, glyphNames=glyphNames, instances=instances)
+        try:
+            start = time.time()
+            for instanceDescriptor, font in made:
+                writer.put(instanceDescriptor, font, time.time() - start)
+                font = None
+                start = time.time()
+        except:
+            made.close()
+            writer.close(raiseError=False)
+            raise
+        writer.close()
+        self.instanceTimings = writer.timings
+        # the writers may have needed more than the instances
+        self.peakMemory = _getPeakMemory()
+
+    def iterInstances(self, processRules=True, glyphNames=None, kerning=True, info=True, instances=None, releaseMemory=True):
+        """ Make the instances one at a time and yield (instanceDescriptor, font) pairs,
+            without saving them. Each instance is made when it is asked for.
+                processRules: swap the glyphs according to the rules.
+                glyphNames: only make these glyphs.
+                kerning, info: False to leave out the kerning or the font info.
+                instances: the instance descriptors to make, default is all instances.
+                releaseMemory: let go of the previous font, and collect the garbage,
+                    before the next instance is made. Hold on to the fonts yourself
+                    if you need them longer.
+            Workers for interpolating the glyphs are kept until the last instance is done,
+            or the iteration is stopped.
+            With glyphMajor the instances are made in groups of glyphMajorGroupSize,
+            a group is done before its first instance is yielded: each glyph mutator
+            is made once per group, evaluated at all its instance locations, and
+            thrown away again. Only the fonts of one group are kept here, the
+            fonts of the previous group are let go of.
+            With lowMemory the masters are packed into a memory mapped file and
+            the parsed master glyphs are released, see _startLowMemory.
+            When the iteration is done self.peakMemory has the peak memory of
+            the process so far, plus that of the largest finished worker.
+        """
+        if instances is None:
+            instances = self.instances
         self.loadFonts()
         self.findDefault()
         if self.default is None:
             # we need one to genenerate
             raise UFOProcessorError("Can't generate UFO from this designspace: no default font.", self)
-        v = 0
-        for instanceDescriptor in self.instances:
-            if instanceDescriptor.path is None:
-                continue
-            font = self.makeInstance(instanceDescriptor, processRules)
-            folder = os.path.dirname(instanceDescriptor.path)
-            path = instanceDescriptor.path
-            if not os.path.exists(folder):
-                os.makedirs(folder)
-            if os.path.exists(path):
-                existingUFOFormatVersion = getUFOVersion(path)
-                if existingUFOFormatVersion > self.ufoVersion:
-                    self.problems.append(u"Can’t overwrite existing UFO%d with UFO%d." % (existingUFOFormatVersion, self.ufoVersion))
+        missing = self.getGlyphsMissingFromDefault()
+        if missing:
+            self.problems.append("%d glyphs missing from default source %s: %s" % (len(missing), self.default.name, ", ".join(missing)))
+        # glyphs for instances that share a location are only interpolated once
+        locationCounts = collections.Counter([self._locationKey(instanceDescriptor.location) for instanceDescriptor in instances])
+        self._glyphInstanceCache = dict([(key, {}) for key, count in locationCounts.items() if count > 1])
+        lowMemoryState = None
+        if self.lowMemory:
+            lowMemoryState = self._startLowMemory()
+        if self.workers > 1:
+            # keep the workers, and the mutators they build, for all instances
+            self._glyphPool = self._openGlyphPool(self.workers)
+        try:
+            if self.glyphMajor:
+                instances = list(instances)
+                groupSize = self.glyphMajorGroupSize or len(instances)
+                for groupStart in range(0, len(instances), max(1, groupSize)):
+                    group = instances[groupStart:groupStart + groupSize]
+                    fonts = self._makeInstancesGlyphMajor(group, processRules, glyphNames=glyphNames, kerning=kerning, info=info)
+                    for instanceDescriptor in group:
+                        # don't hold on to the fonts that were yielded
+                        font = fonts.pop(0)
+                        yield instanceDescriptor, font
+                        if releaseMemory:
+                            font = None
+                            gc.collect()
+                return
+            for instanceDescriptor in instances:
+                font = self.makeInstance(instanceDescriptor, processRules, glyphNames=glyphNames, kerning=kerning, info=info)
+                locationKey = self._locationKey(instanceDescriptor.location)
+                locationCounts[locationKey] -= 1
+                if locationCounts[locationKey] == 0:
+                    # no more instances at this location
+                    self._glyphInstanceCache.pop(locationKey, None)
+                yield instanceDescriptor, font
+                if releaseMemory:
+                    font = None
+                    gc.collect()
+        finally:
+            self._glyphInstanceCache = None
+            if self._glyphPool is not None:
+                self._glyphPool.close()
+                self._glyphPool.join()
+                self._glyphPool = None
+            if lowMemoryState is not None:
+                self._endLowMemory(lowMemoryState)
+            self.peakMemory = _getPeakMemory()
+
+    def _startLowMemory(self):
+        # Get the masters from packed master data in a memory mapped file,
+        # so that they are paged in when they are needed, and release the
+        # master glyphs defcon has parsed. The fonts keep their info, groups,
+        # kerning, lib and features for the copy operations.
+        # Work out how many glyph mutators can be kept at one time.
+        packed = self._masterData is None
+        created = None
+        if packed:
+            if self._sharedMasters is None:
+                from ufoProcessor.sharedMasters import SharedMasterData
+                created = self._sharedMasters = SharedMasterData.create(self, useFile=True, releaseGlyphs=True)
+            self.useMasterData(self._sharedMasters)
+        self._releaseMasterGlyphs()
+        gc.collect()
+        budget = _defaultGlyphBatchMemory
+        if self.memoryTarget is not None:
+            budget = self.memoryTarget
+            current = _getCurrentMemory()
+            if current is not None:
+                budget = self.memoryTarget - current
+                if budget <= 0:
+                    self.problems.append("Memory target of %d MB is below the %d MB in use before the glyphs are made." % (self.memoryTarget // 2**20, current // 2**20))
+        # the glyph cost of packed master data is the size of its blob
+        self._glyphBatchCost = max(1, budget // _mutatorMemoryFactor)
+        return packed, created
+
+    def _endLowMemory(self, state):
+        # Go back to the masters we had before _startLowMemory.
+        packed, created = state
+        self._glyphBatchCost = None
+        if packed:
+            self.useMasterData(None)
+        if created is not None:
+            self._sharedMasters = None
+            created.unlink()
+
+    def _releaseMasterGlyphs(self):
+        # Let go of the glyphs defcon loaded from the sources.
+        # The glyphnames stay, a glyph is read again when it is asked for.
+        # Glyphs with unsaved changes are kept.
+        unsupported = False
+        with self._fontsLock:
+            for font in self.fonts.values():
+                if font is None:
                     continue
+                for layer in getattr(font, "layers", []):
+                    release = self._getGlyphRelease(layer)
+                    if release is None:
+                        unsupported = unsupported or hasattr(layer, "newGlyph")
+                        continue
+                    loaded, unload = release
+                    # Releasing a composite looks up its base glyphs, and loads
+                    # them if they're gone. So composites go first, and
+                    # bases that were loaded again go in the next round.
+                    for attempt in range(_releaseRounds):
+                        todo = [glyph for glyph in loaded.values() if not glyph.dirty]
+                        if not todo:
+                            break
+                        todo.sort(key=lambda glyph: not glyph.components)
+                        for glyph in todo:
+                            unload(glyph.name)
+        if unsupported:
+            self.problems.append("Can't release the master glyphs with defcon %s, they stay in memory." % getattr(defcon, "__version__", "?"))
+
+    def _getGlyphRelease(self, layer):
+        # Return (loaded, unload) for this defcon layer: a dict with the glyphs
+        # it has loaded, and a function that unloads a glyph by name.
+        # Uses layer.unloadGlyph where defcon has it. Older versions
+        # don't, there we end the observation and drop the glyph ourselves,
+        # if the layer has the internals for that. None if it hasn't.
+        loaded = getattr(layer, "_glyphs", None)
+        if not isinstance(loaded, dict):
+            return None
+        unload = getattr(layer, "unloadGlyph", None)
+        if unload is None:
+            if not hasattr(layer, "endSelfGlyphNotificationObservation"):
+                return None
+            def unload(glyphName):
+                layer.endSelfGlyphNotificationObservation(loaded[glyphName])
+                loaded.pop(glyphName, None)
+        return loaded, unload
+
+    def _releaseGlyphBatch(self, batchCost, glyphName):
+        # In low memory mode, add the cost of this glyph to the batch.
+        # If the batch is full, throw away the glyph mutators and start a new one.
+        # Returns the cost of the batch so far.
+        if self._glyphBatchCost is None:
+            return 0
+        batchCost += self._estimateGlyphCost(glyphName)
+        if batchCost < self._glyphBatchCost:
+            return batchCost
+        self._glyphMutators.clear()
+        return 0
+
+    def saveInstanceFont(self, font, path):
+        # Save a generated instance font to path in the target UFO version.
+        # Returns False if there is a newer UFO at path that we can't overwrite.
+        # With a binary outputFormat the font is compiled and saved next to path instead.
+        folder = os.path.dirname(path)
+        if not os.path.exists(folder):
+            try:
+                os.makedirs(folder)
+            except OSError:
+                # another writer thread made it first
+                if not os.path.isdir(folder):
+                    raise
+        if self.outputFormat != "ufo":
+            return self._saveBinaryFont(font, path)
+        if os.path.exists(path):
+            existingUFOFormatVersion = getUFOVersion(path)
+            if existingUFOFormatVersion > self.ufoVersion:
+                self.problems.append(u"Can’t overwrite existing UFO%d with UFO%d." % (existingUFOFormatVersion, self.ufoVersion))
+                return False
+        if self.incrementalSave:
+            report = saveFontIncremental(font, path, self.ufoVersion)
+            self.messages.append("Generated %s as UFO%d, %d files written, %d unchanged, %d removed"%(os.path.basename(path), self.ufoVersion, len(report['written']), len(report['unchanged']), len(report['removed'])))
+        else:
             font.save(path, self.ufoVersion)
-            self.problems.append("Generated %s as UFO%d"%(os.path.basename(path), self.ufoVersion))
+            self.messages.append("Generated %s as UFO%d"%(os.path.basename(path), self.ufoVersion))
+        return True
+
+    def _saveBinaryFont(self, font, path):
+        # Compile the instance font and save it as a .ttf or .otf next to path.
+        from ufoProcessor.fontCompiler import compileInstanceFont
+        featuresPath = None
+        if self.default is not None:
+            featuresPath = os.path.join(self.default.path, "features.fea")
+        ttFont = compileInstanceFont(font, format=self.outputFormat, featuresPath=featuresPath, problems=self.problems)
+        binaryPath = os.path.splitext(path)[0] + "." + self.outputFormat
+        ttFont.save(binaryPath)
+        self.messages.append("Generated %s" % os.path.basename(binaryPath))
         return True
 
     def getSerializedAxes(self):
@@ -299,8 +858,16 @@ class DesignSpaceProcessor(DesignSpaceDocument):
         # Return either a mutatorMath or a varlib.model object for calculating. 
         try:
             if self.useVarlib:
-                # use the varlib variation model
-                return dict(), VariationModelMutator(items, self.axes)
+                # use the varlib variation model.
+                # Mutators with masters at the same locations share the model and its support index.
+                key = tuple([self._locationKey(loc) for loc, value in items])
+                shared = self._variationModels.get(key)
+                if shared is None:
+                    mutator = VariationModelMutator(items, self.axes)
+                    self._variationModels[key] = mutator.model, mutator.supportIndex
+                else:
+                    mutator = VariationModelMutator(items, self.axes, model=shared[0], supportIndex=shared[1])
+                return dict(), mutator
             else:
                 # use mutatormath model
                 axesForMutator = self.getMutatorAxes()
@@ -314,75 +881,199 @@ class DesignSpaceProcessor(DesignSpaceDocument):
         """ Returns a info mutator """
         if self._infoMutator:
             return self._infoMutator
-        infoItems = []
-        for sourceDescriptor in self.sources:
-            loc = sourceDescriptor.location
-            sourceFont = self.fonts[sourceDescriptor.name]
-            infoItems.append((loc, self.mathInfoClass(sourceFont)))
-        bias, self._infoMutator = self.getVariationModel(infoItems, axes=self.serializedAxes, bias=self.defaultLoc)
+        with self._getMutatorLock("info"):
+            if not self._infoMutator:
+                infoItems = self.collectMastersForInfo()
+                bias, self._infoMutator = self.getVariationModel(infoItems, axes=self.serializedAxes, bias=self.defaultLoc)
+                if self._masterData is None:
+                    self._setMutatorMasters(self._infoMutator, [(sd.name, None, mathInfo) for sd, (loc, mathInfo) in zip(self.sources, infoItems)])
         return self._infoMutator
 
+    def collectMastersForInfo(self):
+        """ Return a list of (location, mathInfo) items for the info mutator."""
+        if self._masterData is not None:
+            return self._masterData.getInfoItems()
+        infoItems = []
+        with self._fontsLock:
+            for sourceDescriptor in self.sources:
+                loc = sourceDescriptor.location
+                sourceFont = self.fonts[sourceDescriptor.name]
+                infoItems.append((loc, self.mathInfoClass(sourceFont)))
+        return infoItems
+
     def getKerningMutator(self):
         """ Return a kerning mutator, collect the sources, build mathGlyphs. """
         if self._kerningMutator:
             return self._kerningMutator
-        kerningItems = []
-        for sourceDescriptor in self.sources:
-            loc = sourceDescriptor.location
-            sourceFont = self.fonts[sourceDescriptor.name]
-            # this makes assumptions about the groups of all sources being the same. 
-            kerningItems.append((loc, self.mathKerningClass(sourceFont.kerning, sourceFont.groups)))
-        bias, self._kerningMutator = self.getVariationModel(kerningItems, axes=self.serializedAxes, bias=self.defaultLoc)
+        with self._getMutatorLock("kerning"):
+            if not self._kerningMutator:
+                kerningItems = self.collectMastersForKerning()
+                bias, self._kerningMutator = self.getVariationModel(kerningItems, axes=self.serializedAxes, bias=self.defaultLoc)
+                if self._masterData is None:
+                    self._setMutatorMasters(self._kerningMutator, [(sd.name, None, mathKerning) for sd, (loc, mathKerning) in zip(self.sources, kerningItems)])
         return self._kerningMutator
 
+    def collectMastersForKerning(self):
+        """ Return a list of (location, mathKerning) items for the kerning mutator."""
+        if self._masterData is not None:
+            return self._masterData.getKerningItems()
+        kerningItems = []
+        with self._fontsLock:
+            for sourceDescriptor in self.sources:
+                loc = sourceDescriptor.location
+                sourceFont = self.fonts[sourceDescriptor.name]
+                # this makes assumptions about the groups of all sources being the same. 
+                kerningItems.append((loc, self.mathKerningClass(sourceFont.kerning, sourceFont.groups)))
+        return kerningItems
+
     def getGlyphMutator(self, glyphName, decomposeComponents=False, fromCache=True):
         cacheKey = (glyphName, decomposeComponents)
         if cacheKey in self._glyphMutators and fromCache:
             return self._glyphMutators[cacheKey]
+        with self._getMutatorLock(cacheKey):
+            # another thread may have made it while we waited
+            if cacheKey in self._glyphMutators and fromCache:
+                return self._glyphMutators[cacheKey]
+            return self._makeGlyphMutator(glyphName, decomposeComponents)
+
+    def _makeGlyphMutator(self, glyphName, decomposeComponents):
+        cacheKey = (glyphName, decomposeComponents)
         items = self.collectMastersForGlyph(glyphName, decomposeComponents=decomposeComponents)
-        new = []
-        for a, b, c in items:
-            if hasattr(b, "toMathGlyph"):
-                new.append((a,b.toMathGlyph()))
-            else:
-                new.append((a,self.mathGlyphClass(b)))
-        items = new
-        bias, thing = self.getVariationModel(items, axes=self.serializedAxes, bias=self.defaultLoc)
+        masters = [(sourceInfo['sourceName'], None, self._toMathGlyph(b)) for a, b, sourceInfo in items]
+        thing = self._buildGlyphMutator([(a, mathGlyph) for (a, b, c), (name, loc, mathGlyph) in zip(items, masters)], masters)
         self._glyphMutators[cacheKey] = thing
         return thing
 
+    def _toMathGlyph(self, glyph):
+        if hasattr(glyph, "toMathGlyph"):
+            return glyph.toMathGlyph()
+        return self.mathGlyphClass(glyph)
+
+    def _buildGlyphMutator(self, items, masters):
+        # Make a mutator for these (location, mathGlyph) items,
+        # and remember the masters it is made from, see updateDesignSpace.
+        if self._isStatic(items):
+            # all masters are the same, no need to interpolate
+            thing = self.getStaticMutator(items[0][1])
+        else:
+            bias, thing = self.getVariationModel(items, axes=self.serializedAxes, bias=self.defaultLoc)
+        self._setMutatorMasters(thing, masters)
+        return thing
+
+    def _setMutatorMasters(self, mutator, masters):
+        # Keep the (sourceName, location, mathObject) masters a mutator is made from
+        # with the mutator, so that updateDesignSpace can build it again without
+        # reading and converting them. location is None for masters at the location of their source.
+        # Not in low memory mode, there the mutators are thrown away anyway.
+        if mutator is not None and not self.lowMemory:
+            mutator._sourceMasters = masters
+
+    def getGlyphMastersMutator(self, glyphName, masters):
+        """ Return a mutator for the masters an instance lists for this glyph:
+            a list of dicts with font, glyphName and location.
+            These are cached with the glyph mutators, keyed by the glyphname
+            and the masters, so instances that list the same masters share one.
+        """
+        spec = tuple([(glyphMaster.get("font"), glyphMaster.get("glyphName", glyphName), self._locationKey(glyphMaster.get("location") or {})) for glyphMaster in masters])
+        cacheKey = (glyphName, spec)
+        if cacheKey in self._glyphMutators:
+            return self._glyphMutators[cacheKey]
+        with self._getMutatorLock(cacheKey):
+            if cacheKey in self._glyphMutators:
+                return self._glyphMutators[cacheKey]
+            items = []
+            masters = []
+            for sourceGlyphFont, sourceGlyphName, sourceGlyphLocation in spec:
+                if self._masterData is not None:
+                    m = _MasterDataGlyphSet(self._masterData, sourceGlyphFont)
+                else:
+                    m = self.fonts.get(sourceGlyphFont)
+                if not sourceGlyphName in m:
+                    continue
+                with self._fontsLock:
+                    if self._masterData is not None:
+                        sourceGlyph = m[sourceGlyphName].copy()
+                    elif hasattr(m[sourceGlyphName], "toMathGlyph"):
+                        sourceGlyph = m[sourceGlyphName].toMathGlyph()
+                    else:
+                        sourceGlyph = MathGlyph(m[sourceGlyphName])
+                items.append((dict(sourceGlyphLocation), sourceGlyph))
+                masters.append((sourceGlyphFont, dict(sourceGlyphLocation), sourceGlyph))
+            bias, thing = self.getVariationModel(items, axes=self.serializedAxes, bias=self.defaultLoc)
+            self._setMutatorMasters(thing, masters)
+            self._glyphMutators[cacheKey] = thing
+            return thing
+
+    def _getMutatorGlyphNames(self, cacheKey):
+        # The master glyphs the glyph mutator with this key is made from,
+        # None if it could depend on any glyph.
+        glyphName, variant = cacheKey
+        if isinstance(variant, tuple):
+            # the masters listed in an instance
+            return set([sourceGlyphName for sourceGlyphFont, sourceGlyphName, sourceGlyphLocation in variant])
+        if variant:
+            # decomposed
+            return None
+        return set([glyphName])
+
+    def _isStatic(self, items):
+        # True if all masters in these (location, mathObject) items are the same.
+        if not items:
+            return False
+        first = items[0][1]
+        for loc, mathObject in items[1:]:
+            if not mathObject == first:
+                return False
+        return True
+
+    def getStaticMutator(self, value):
+        # Return a mutator that returns copies of value at every location.
+        # get(()) answers like the mutator for this model would.
+        if self.useVarlib:
+            return StaticMutator(value)
+        return StaticMutator(value, neutral=(value, "origin"))
+
     def collectMastersForGlyph(self, glyphName, decomposeComponents=False):
         """ Return a glyph mutator.defaultLoc
             decomposeComponents = True causes the source glyphs to be decomposed first
             before building the mutator. That gives you instances that do not depend
             on a complete font. If you're calculating previews for instance.
 
-            XXX check glyphs in layers
+            The contributing sources are looked up in the glyph index,
+            muted glyphs and sparse layers are already resolved there.
+            If we use packed master data, the items come from there.
+            With fastMasterReading the glyphs are parsed from the glif files.
         """
+        if self._masterData is not None:
+            return self._collectMastersFromMasterData(glyphName, decomposeComponents)
         items = []
-        for sourceDescriptor in self.sources:
-            loc = sourceDescriptor.location
-            f = self.fonts[sourceDescriptor.name]
-            sourceLayer = f
-            if glyphName in sourceDescriptor.mutedGlyphNames:
-                continue
-            if not glyphName in f:
-                # log this>
-                continue
-            layerName = "foreground"
-            # handle source layers
-
-            if sourceDescriptor.layerName is not None:
-                # start looking for a layer
-                if sourceDescriptor.layerName in f.layers:
-                    sourceLayer = f.layers[sourceDescriptor.layerName]
-                    layerName = sourceDescriptor.layerName
-                    # start looking for a glyph
-                    if glyphName not in sourceLayer:
-                        # this might be a support in a sparse layer
-                        # so we're skipping!
-                        #print("XXXX", glyphName, "not in", sourceDescriptor.layerName)
-                        continue
+        for sourceDescriptor, layerName in self.getGlyphIndex().get(glyphName, []):
+            items.append(self._collectGlyphMaster(sourceDescriptor, layerName, glyphName, decomposeComponents))
+        return items
+
+    def _collectGlyphMaster(self, sourceDescriptor, layerName, glyphName, decomposeComponents=False):
+        # Return the (location, mathGlyph, sourceInfo) item for this glyph in one source.
+        loc = sourceDescriptor.location
+        f = self.fonts[sourceDescriptor.name]
+        reader = self._glyphReaders.get(sourceDescriptor.name)
+        if reader is not None:
+            processThis = reader.getMathGlyph(glyphName, layerName)
+            if decomposeComponents and processThis.components:
+                temp = self.mathGlyphClass(None)
+                dpp = DecomposePointPen(reader.getGlyphSet(layerName), temp.getPointPen())
+                processThis.drawPoints(dpp)
+                temp.width = processThis.width
+                temp.name = processThis.name
+                processThis = temp
+            sourceInfo = dict(source=sourceDescriptor.path, glyphName=glyphName, layerName=layerName or "foreground", location=sourceDescriptor.location, sourceName=sourceDescriptor.name)
+            return loc, processThis, sourceInfo
+        # defcon loads the glyphs when they're first asked for
+        with self._fontsLock:
+            if layerName is None:
+                sourceLayer = f
+                layerName = "foreground"
+            else:
+                sourceLayer = f.layers[layerName]
             sourceGlyphObject = sourceLayer[glyphName]
             if decomposeComponents:
                 # what about decomposing glyphs in a partial font?
@@ -401,8 +1092,168 @@ class DesignSpaceProcessor(DesignSpaceDocument):
                 processThis = processThis.toMathGlyph()
             else:
                 processThis = self.mathGlyphClass(processThis)
-            items.append((loc, processThis, sourceInfo))
-        return items
+        return loc, processThis, sourceInfo
+
+    def _collectMastersFromMasterData(self, glyphName, decomposeComponents=False):
+        # Collect the masters for this glyph from the packed master data.
+        items = self._masterData.getGlyphItems(glyphName)
+        if not decomposeComponents:
+            return items
+        decomposed = []
+        for loc, mathGlyph, sourceInfo in items:
+            if mathGlyph.components:
+                glyphSet = _MasterDataGlyphSet(self._masterData, sourceInfo['sourceName'])
+                temp = self.mathGlyphClass(None)
+                dpp = DecomposePointPen(glyphSet, temp.getPointPen())
+                mathGlyph.drawPoints(dpp)
+                temp.width = mathGlyph.width
+                temp.name = mathGlyph.name
+                mathGlyph = temp
+            decomposed.append((loc, mathGlyph, sourceInfo))
+        return decomposed
+
+    def useMasterData(self, masterData):
+        """ Get the master glyphs, kerning and info from packed master data
+            (see ufoProcessor.sharedMasters) instead of from the loaded fonts.
+            Use None to go back to the fonts.
+        """
+        self._masterData = masterData
+        self._glyphMutators = {}
+        self._infoMutator = None
+        self._kerningMutator = None
+        if masterData is not None:
+            self.glyphNames = masterData.glyphNames
+
+    def shareMasters(self, useFile=False):
+        """ Pack the masters into shared memory, or a memory mapped file if useFile is True.
+            From now on glyph worker processes attach to this data instead of
+            getting a copy of the fonts. Returns the SharedMasterData object,
+            call its unlink() method when done.
+        """
+        from ufoProcessor.sharedMasters import SharedMasterData
+        self.loadFonts()
+        self.findDefault()
+        if self.workers > 1:
+            self.preloadMasterGlyphs(workers=self.workers)
+        self._sharedMasters = SharedMasterData.create(self, useFile=useFile)
+        return self._sharedMasters
+
+    def useMasterSnapshot(self, path):
+        """ Read the masters from the snapshot file at path instead of parsing the sources.
+            If there is no snapshot yet, or the sources changed since it was made,
+            the masters are collected from the sources and a new snapshot is written.
+            The snapshot is memory mapped, glyph workers attach to the same file.
+            Call this before the fonts are loaded, the sources are fingerprinted
+            for a new snapshot before anything is read from them.
+            Returns True if an existing snapshot could be used.
+        """
+        from ufoProcessor.sharedMasters import openMasterSnapshot, writeMasterSnapshot, fingerprintSources, SharedMasterData
+        self.closeMasterSnapshot()
+        snapshot = openMasterSnapshot(path, self)
+        used = snapshot is not None
+        if not used:
+            fingerprint = fingerprintSources(self)
+        self.loadFonts()
+        self.findDefault()
+        if used:
+            self.messages.append("Using master snapshot %s" % path)
+        else:
+            if self.workers > 1:
+                self.preloadMasterGlyphs(workers=self.workers)
+            writeMasterSnapshot(self, path, fingerprint=fingerprint)
+            snapshot = SharedMasterData.attach("file", path)
+            self.messages.append("Wrote master snapshot %s" % path)
+        self._masterSnapshot = snapshot
+        self._sharedMasters = snapshot
+        self.useMasterData(snapshot)
+        return used
+
+    def closeMasterSnapshot(self):
+        """ Stop reading from the master snapshot, go back to the sources."""
+        if self._masterSnapshot is None:
+            return
+        if self._sharedMasters is self._masterSnapshot:
+            self._sharedMasters = None
+        if self._masterData is self._masterSnapshot:
+            self.useMasterData(None)
+        self._masterSnapshot.close()
+        self._masterSnapshot = None
+
+    def preloadMasterGlyphs(self, glyphNames=None, workers=None):
+        """ With fastMasterReading, parse the master glyphs in worker processes
+            before they are collected. Otherwise they're parsed one at a time.
+        """
+        if not self._glyphReaders:
+            return
+        if glyphNames is None:
+            glyphNames = self.glyphNames
+        todo = collections.OrderedDict()
+        for glyphName in glyphNames:
+            for sourceDescriptor, layerName in self.getGlyphIndex().get(glyphName, []):
+                todo.setdefault((sourceDescriptor.name, layerName), []).append(glyphName)
+        requests = [(self._glyphReaders[sourceName], names, layerName) for (sourceName, layerName), names in todo.items() if sourceName in self._glyphReaders]
+        preloadGlyphs(requests, workers=workers)
+
+    def scanInterpolation(self, locations=None, steps=5, glyphNames=None, **kwargs):
+        """ Check the glyphs for kinks, direction flips, self intersections
+            and width jumps on a grid of locations. See ufoProcessor.healthScan.
+        """
+        from ufoProcessor.healthScan import scanInterpolation
+        return scanInterpolation(self, locations=locations, steps=steps, glyphNames=glyphNames, **kwargs)
+
+    def makeMetrics(self, locations, glyphNames=None, kerning=True, info=True):
+        """ Interpolate the widths, sidebearings, kerning and vertical metrics
+            at many locations, without the outlines. Returns a dict of tables.
+            See ufoProcessor.metrics.
+        """
+        from ufoProcessor.metrics import makeMetrics
+        return makeMetrics(self, locations, glyphNames=glyphNames, kerning=kerning, info=info)
+
+    def getGlyphIndex(self):
+        # Return the glyph index, build it if we don't have one yet.
+        if self._glyphIndex is None:
+            with self._fontsLock:
+                if self._glyphIndex is None:
+                    self._buildGlyphIndex()
+        return self._glyphIndex
+
+    def _buildGlyphIndex(self):
+        # Map each glyphname to the (sourceDescriptor, layerName) entries that contribute to it.
+        # layerName is None for the default layer of the source font.
+        # Muted glyphs are left out. Sources with a sparse layer only
+        # contribute the glyphs that are actually in that layer.
+        index = {}
+        for sourceDescriptor in self.sources:
+            f = self.fonts.get(sourceDescriptor.name)
+            if f is None:
+                continue
+            layerName = None
+            glyphNames = f.keys()
+            if sourceDescriptor.layerName is not None and sourceDescriptor.layerName in f.layers:
+                layerName = sourceDescriptor.layerName
+                sourceLayer = f.layers[layerName]
+                glyphNames = [name for name in sourceLayer.keys() if name in f]
+            muted = sourceDescriptor.mutedGlyphNames
+            for glyphName in glyphNames:
+                if glyphName in muted:
+                    continue
+                if glyphName not in index:
+                    index[glyphName] = []
+                index[glyphName].append((sourceDescriptor, layerName))
+        self._glyphIndex = index
+
+    def getGlyphsMissingFromDefault(self):
+        # Return a sorted list of glyphnames that have masters, but none in the default source.
+        if self.default is None:
+            return []
+        missing = []
+        for glyphName, entries in self.getGlyphIndex().items():
+            for sourceDescriptor, layerName in entries:
+                if sourceDescriptor.name == self.default.name:
+                    break
+            else:
+                missing.append(glyphName)
+        return sorted(missing)
 
     def getNeutralFont(self):
         # Return a font object for the neutral font
@@ -418,18 +1269,202 @@ class DesignSpaceProcessor(DesignSpaceDocument):
         # Load the fonts and find the default candidate based on the info flag
         if self._fontsLoaded and not reload:
             return
-        names = set()
-        for sourceDescriptor in self.sources:
-            if not sourceDescriptor.name in self.fonts:
-                if os.path.exists(sourceDescriptor.path):
-                    self.fonts[sourceDescriptor.name] = self._instantiateFont(sourceDescriptor.path)
-                    self.problems.append("loaded master from %s, format %d" % (sourceDescriptor.path, getUFOVersion(sourceDescriptor.path)))
-                    names = names | set(self.fonts[sourceDescriptor.name].keys())
-                else:
-                    self.fonts[sourceDescriptor.name] = None
-                    self.problems.append("source ufo not found at %s" % (sourceDescriptor.path))
-        self.glyphNames = list(names)
-        self._fontsLoaded = True
+        with self._fontsLock:
+            if self._fontsLoaded and not reload:
+                # another thread loaded them while we waited
+                return
+            # keep the glyphnames in a predictable order:
+            # the glyph order of the sources, in the order of the sources.
+            names = collections.OrderedDict()
+            for sourceDescriptor in self.sources:
+                if not sourceDescriptor.name in self.fonts:
+                    if os.path.exists(sourceDescriptor.path):
+                        if os.path.isfile(sourceDescriptor.path):
+                            # a .ufoz, defcon can't open it. The reader does the glyphs.
+                            reader = self._glyphReaders[sourceDescriptor.name] = GlyphReader(sourceDescriptor.path)
+                            self.fonts[sourceDescriptor.name] = ReaderFont(reader, self._instantiateFont(None))
+                        else:
+                            self.fonts[sourceDescriptor.name] = self._instantiateFont(sourceDescriptor.path)
+                            if self.fastMasterReading:
+                                self._glyphReaders[sourceDescriptor.name] = GlyphReader(sourceDescriptor.path)
+                        self.messages.append("loaded master from %s, format %d" % (sourceDescriptor.path, getUFOVersion(sourceDescriptor.path)))
+                    else:
+                        self.fonts[sourceDescriptor.name] = None
+                        self.problems.append("source ufo not found at %s" % (sourceDescriptor.path))
+                if self.fonts[sourceDescriptor.name] is not None:
+                    for glyphName in self._getGlyphOrder(self.fonts[sourceDescriptor.name]):
+                        names[glyphName] = None
+            self.glyphNames = list(names.keys())
+            self._buildGlyphIndex()
+            self._designSpaceState = self._getDesignSpaceState()
+            self._fontsLoaded = True
+
+    def reloadSources(self, paths, glyphNames=None):
+        """ Read the source fonts at these paths again, after they were edited.
+            glyphNames: the glyphs that changed, or None if anything in
+            these sources could have changed. Only the mutators that depend
+            on what changed are thrown away, the others stay warm.
+        """
+        paths = set([os.path.abspath(path) for path in paths])
+        with self._fontsLock:
+            # the snapshot has the old masters
+            self.closeMasterSnapshot()
+            for sourceDescriptor in self.sources:
+                if os.path.abspath(sourceDescriptor.path) not in paths:
+                    continue
+                self.fonts.pop(sourceDescriptor.name, None)
+                reader = self._glyphReaders.pop(sourceDescriptor.name, None)
+                if reader is not None:
+                    reader.close()
+            if self._fontsLoaded:
+                self.loadFonts(reload=True)
+            if glyphNames is None:
+                self._glyphMutators = {}
+                self._infoMutator = None
+                self._kerningMutator = None
+                return
+            glyphNames = set(glyphNames)
+            for key in list(self._glyphMutators.keys()):
+                dependsOn = self._getMutatorGlyphNames(key)
+                if dependsOn is None or dependsOn & glyphNames:
+                    del self._glyphMutators[key]
+
+    def _getDesignSpaceState(self):
+        # What the mutators depend on in the axes and sources.
+        # For the sources: what makes the masters, and where they are.
+        axes = {}
+        for a in self.axes:
+            axes[a.name] = (a.minimum, a.default, a.maximum, tuple([tuple(m) for m in a.map]))
+        sources = {}
+        for sd in self.sources:
+            identity = (sd.path, sd.layerName, tuple(sorted(sd.mutedGlyphNames)))
+            sources[sd.name] = (identity, self._locationKey(sd.location))
+        return dict(axes=axes, sources=sources)
+
+    def updateDesignSpace(self):
+        """ Bring the loaded fonts and the mutators up to date after the designspace
+            was edited: axis values or maps changed, sources added, removed or moved,
+            source layers or muted glyphs changed. Edit the descriptors in place,
+            then call this.
+            Only the mutators that depend on what changed are built again, from the
+            master math objects they were made from. Only the masters of new or
+            changed sources are read. Packed master data can't follow the edits,
+            if it was used the processor goes back to the fonts.
+            Returns a dict with the names of the changed axes and the added,
+            removed and moved sources, and the number of rebuilt mutators.
+        """
+        report = dict(changedAxes=[], addedSources=[], removedSources=[], movedSources=[], rebuiltMutators=0)
+        if not self._fontsLoaded or self._designSpaceState is None:
+            # nothing is built yet
+            return report
+        old = self._designSpaceState
+        new = self._getDesignSpaceState()
+        changedAxes = [name for name in set(old['axes']) | set(new['axes']) if old['axes'].get(name) != new['axes'].get(name)]
+        # a source that makes different masters is removed and added again
+        removed = set([name for name, (identity, location) in old['sources'].items() if new['sources'].get(name, (None, None))[0] != identity])
+        added = set([name for name, (identity, location) in new['sources'].items() if old['sources'].get(name, (None, None))[0] != identity])
+        moved = set([name for name, (identity, location) in new['sources'].items() if name not in added and old['sources'][name][1] != location])
+        report['changedAxes'] = sorted(changedAxes)
+        report['addedSources'] = sorted(added - removed)
+        report['removedSources'] = sorted(removed - added)
+        report['movedSources'] = sorted(moved)
+        if not (changedAxes or removed or added or moved):
+            return report
+        with self._fontsLock:
+            if self._masterData is not None:
+                self.closeMasterSnapshot()
+                self._sharedMasters = None
+                self.useMasterData(None)
+            for name in removed:
+                self.fonts.pop(name, None)
+                reader = self._glyphReaders.pop(name, None)
+                if reader is not None:
+                    reader.close()
+            self.loadFonts(reload=True)
+            self.findDefault()
+            # the shared models are for the old locations
+            self._variationModels = {}
+            sources = dict([(sd.name, sd) for sd in self.sources])
+            update = dict(sources=sources, fresh=removed | added, changed=removed | added | moved, axesChanged=bool(changedAxes))
+            for cacheKey in list(self._glyphMutators.keys()):
+                mutator = self._glyphMutators[cacheKey]
+                newMutator = self._updateGlyphMutator(cacheKey, mutator, update)
+                if newMutator is None:
+                    del self._glyphMutators[cacheKey]
+                elif newMutator is not mutator:
+                    self._glyphMutators[cacheKey] = newMutator
+                    report['rebuiltMutators'] += 1
+            for attribute, makeMaster in [
+                    ('_infoMutator', lambda font: self.mathInfoClass(font)),
+                    ('_kerningMutator', lambda font: self.mathKerningClass(font.kerning, font.groups)),
+                    ]:
+                mutator = getattr(self, attribute)
+                if mutator is None:
+                    continue
+                known = self._getKnownMasters(mutator, update)
+                if known is None:
+                    setattr(self, attribute, None)
+                    continue
+                masters = []
+                for sd in self.sources:
+                    if sd.name in known:
+                        masters.append((sd.name, None, known[sd.name]))
+                    else:
+                        masters.append((sd.name, None, makeMaster(self.fonts[sd.name])))
+                bias, newMutator = self.getVariationModel([(sources[name].location, mathObject) for name, location, mathObject in masters], axes=self.serializedAxes, bias=self.defaultLoc)
+                self._setMutatorMasters(newMutator, masters)
+                setattr(self, attribute, newMutator)
+                report['rebuiltMutators'] += 1
+        return report
+
+    def _getKnownMasters(self, mutator, update):
+        # sourceName: mathObject for the masters of this mutator that can be used again.
+        # None if we don't know what the mutator was made from.
+        masters = getattr(mutator, "_sourceMasters", None)
+        if masters is None:
+            return None
+        return dict([(name, mathObject) for name, location, mathObject in masters if name not in update['fresh']])
+
+    def _updateGlyphMutator(self, cacheKey, mutator, update):
+        # Return the glyph mutator for the edited designspace: the same one if nothing
+        # it depends on changed, a new one made from the masters we have and
+        # the masters of the new sources, or None to build it again when it is asked for.
+        glyphName, variant = cacheKey
+        masters = getattr(mutator, "_sourceMasters", None)
+        if masters is None:
+            return None
+        if isinstance(variant, tuple):
+            # the masters listed in an instance, at their own locations
+            if [name for name, location, mathObject in masters if name in update['fresh']]:
+                return None
+            if not update['axesChanged']:
+                return mutator
+            bias, newMutator = self.getVariationModel([(location, mathObject) for name, location, mathObject in masters], axes=self.serializedAxes, bias=self.defaultLoc)
+            self._setMutatorMasters(newMutator, masters)
+            return newMutator
+        entries = self.getGlyphIndex().get(glyphName, [])
+        if not entries:
+            return None
+        names = [sd.name for sd, layerName in entries]
+        if not update['axesChanged'] and names == [name for name, location, mathObject in masters] and not set(names) & update['changed']:
+            return mutator
+        known = self._getKnownMasters(mutator, update)
+        newMasters = []
+        for sd, layerName in entries:
+            if sd.name in known:
+                mathGlyph = known[sd.name]
+            else:
+                loc, glyph, sourceInfo = self._collectGlyphMaster(sd, layerName, glyphName, variant)
+                mathGlyph = self._toMathGlyph(glyph)
+            newMasters.append((sd.name, None, mathGlyph))
+        return self._buildGlyphMutator([(update['sources'][name].location, mathGlyph) for name, location, mathGlyph in newMasters], newMasters)
+
+    def _getGlyphOrder(self, font):
+        # The glyphnames in this font: first the ones in the glyph order,
+        # then the others in alphabetical order.
+        order = [glyphName for glyphName in getattr(font, "glyphOrder", []) if glyphName in font]
+        inOrder = set(order)
+        return order + sorted([glyphName for glyphName in font.keys() if glyphName not in inOrder])
 
     def getFonts(self):
         # returnn a list of (font object, location) tuples
@@ -440,8 +1475,18 @@ class DesignSpaceProcessor(DesignSpaceDocument):
                 fonts.append((f, sourceDescriptor.location))
         return fonts
 
-    def makeInstance(self, instanceDescriptor, doRules=False, glyphNames=None):
-        """ Generate a font object for this instance """
+    def makeInstance(self, instanceDescriptor, doRules=False, glyphNames=None, workers=None, kerning=True, info=True):
+        """ Generate a font object for this instance
+            workers: number of processes to interpolate the glyphs with. Default is self.workers.
+            kerning, info: False to leave out the kerning, or the interpolated and copied font info.
+        """
+        font = self._makeInstanceFont(instanceDescriptor, kerning=kerning, info=info)
+        self._addGlyphInstances(font, instanceDescriptor, doRules, glyphNames=glyphNames, workers=workers)
+        return font
+
+    def _makeInstanceFont(self, instanceDescriptor, kerning=True, info=True):
+        # Make the font for this instance with everything but the glyphs:
+        # the kerning, the info and what is copied from the sources.
         font = self._instantiateFont(None)
         # make fonty things here
         loc = instanceDescriptor.location
@@ -458,24 +1503,28 @@ class DesignSpaceProcessor(DesignSpaceDocument):
         font.kerningGroupConversionRenameMaps = renameMap
         # make the kerning
         # this kerning is always horizontal. We can take the horizontal location
-        if instanceDescriptor.kerning:
+        if kerning and instanceDescriptor.kerning:
             try:
                 kerningMutator = self.getKerningMutator()
                 kerningObject = kerningMutator.makeInstance(locHorizontal)
                 kerningObject.extractKerning(font)
+                if self.kerningCompaction:
+                    report = compactKerning(font.kerning, font.groups, threshold=self.kerningThreshold)
+                    self.messages.append("Compacted kerning for %s: %d pairs, removed %d zero pairs, %d redundant exceptions, %d pairs below threshold." % (instanceDescriptor.name, report['before'], report['zeroPairs'], report['redundantExceptions'], report['thresholdPairs']))
             except:
                 self.problems.append("Could not make kerning for %s. %s" % (loc, traceback.format_exc()))
         # make the info
         try:
-            infoMutator = self.getInfoMutator()
-            if not anisotropic:
-                infoInstanceObject = infoMutator.makeInstance(loc)
-            else:
-                horizontalInfoInstanceObject = infoMutator.makeInstance(locHorizontal)
-                verticalInfoInstanceObject = infoMutator.makeInstance(locVertical)
-                # merge them again
-                infoInstanceObject = (1,0)*horizontalInfoInstanceObject + (0,1)*verticalInfoInstanceObject
-            infoInstanceObject.extractInfo(font.info)
+            if info:
+                infoMutator = self.getInfoMutator()
+                if not anisotropic:
+                    infoInstanceObject = infoMutator.makeInstance(loc)
+                else:
+                    horizontalInfoInstanceObject = infoMutator.makeInstance(locHorizontal)
+                    verticalInfoInstanceObject = infoMutator.makeInstance(locVertical)
+                    # merge them again
+                    infoInstanceObject = (1,0)*horizontalInfoInstanceObject + (0,1)*verticalInfoInstanceObject
+                infoInstanceObject.extractInfo(font.info)
             font.info.familyName = instanceDescriptor.familyName
             font.info.styleName = instanceDescriptor.styleName
             font.info.postScriptFontName = instanceDescriptor.postScriptFontName
@@ -491,21 +1540,26 @@ class DesignSpaceProcessor(DesignSpaceDocument):
             #    records.append((nameID, ))
         except:
             self.problems.append("Could not make fontinfo for %s. %s" % (loc, traceback.format_exc()))
-        for sourceDescriptor in self.sources:
-            if sourceDescriptor.copyInfo:
-                # this is the source
-                self._copyFontInfo(self.fonts[sourceDescriptor.name].info, font.info)
-            if sourceDescriptor.copyLib:
-                # excplicitly copy the font.lib items
-                for key, value in self.fonts[sourceDescriptor.name].lib.items():
-                    font.lib[key] = value
-            if sourceDescriptor.copyFeatures:
-                featuresText = self.fonts[sourceDescriptor.name].features.text
-                if isinstance(featuresText, str):
-                    font.features.text = u""+featuresText
-                elif isinstance(featuresText, unicode):
-                    font.features.text = featuresText
-        # glyphs
+        with self._fontsLock:
+            for sourceDescriptor in self.sources:
+                if sourceDescriptor.copyInfo and info:
+                    # this is the source
+                    self._copyFontInfo(self.fonts[sourceDescriptor.name].info, font.info)
+                if sourceDescriptor.copyLib:
+                    # excplicitly copy the font.lib items
+                    for key, value in self.fonts[sourceDescriptor.name].lib.items():
+                        font.lib[key] = value
+                if sourceDescriptor.copyFeatures:
+                    featuresText = self.fonts[sourceDescriptor.name].features.text
+                    if isinstance(featuresText, str):
+                        font.features.text = u""+featuresText
+                    elif isinstance(featuresText, unicode):
+                        font.features.text = featuresText
+        return font
+
+    def _addGlyphInstances(self, font, instanceDescriptor, doRules=False, glyphNames=None, workers=None):
+        # Interpolate the glyphs of this instance into the font, and process the rules.
+        loc = instanceDescriptor.location
         if glyphNames:
             selectedGlyphNames = glyphNames
         else:
@@ -513,106 +1567,39 @@ class DesignSpaceProcessor(DesignSpaceDocument):
         # add the glyphnames to the font.lib['public.glyphOrder']
         if not 'public.glyphOrder' in font.lib.keys():
             font.lib['public.glyphOrder'] = selectedGlyphNames
+        if workers is None:
+            workers = self.workers
+        # instances at the same location can share glyph results, but not
+        # the glyphs that have special instructions in the instance.
+        cachedResults = None
+        glyphResults = {}
+        if self._glyphInstanceCache is not None:
+            cachedResults = self._glyphInstanceCache.get(self._locationKey(instanceDescriptor.location))
+        if cachedResults is not None:
+            for glyphName in selectedGlyphNames:
+                if glyphName in cachedResults and glyphName not in instanceDescriptor.glyphs:
+                    glyphResults[glyphName] = cachedResults[glyphName]
+        todo = [glyphName for glyphName in selectedGlyphNames if glyphName not in glyphResults]
+        parallelResults = None
+        if workers > 1 and len(todo) > 1:
+            parallelResults = self._makeGlyphInstancesParallel(instanceDescriptor, todo, workers)
+        batchCost = 0
         for glyphName in selectedGlyphNames:
-            try:
-                glyphMutator = self.getGlyphMutator(glyphName)
-                if glyphMutator is None:
-                    continue
-            except:
-                self.problems.append("Could not make mutator for glyph %s %s" % (glyphName, traceback.format_exc()))
-                continue
-            if glyphName in instanceDescriptor.glyphs.keys():
-                # XXX this should be able to go now that we have full rule support. 
-                # reminder: this is what the glyphData can look like
-                # {'instanceLocation': {'custom': 0.0, 'weight': 824.0},
-                #  'masters': [{'font': 'master.Adobe VF Prototype.Master_0.0',
-                #               'glyphName': 'dollar.nostroke',
-                #               'location': {'custom': 0.0, 'weight': 0.0}},
-                #              {'font': 'master.Adobe VF Prototype.Master_1.1',
-                #               'glyphName': 'dollar.nostroke',
-                #               'location': {'custom': 0.0, 'weight': 368.0}},
-                #              {'font': 'master.Adobe VF Prototype.Master_2.2',
-                #               'glyphName': 'dollar.nostroke',
-                #               'location': {'custom': 0.0, 'weight': 1000.0}},
-                #              {'font': 'master.Adobe VF Prototype.Master_3.3',
-                #               'glyphName': 'dollar.nostroke',
-                #               'location': {'custom': 100.0, 'weight': 1000.0}},
-                #              {'font': 'master.Adobe VF Prototype.Master_0.4',
-                #               'glyphName': 'dollar.nostroke',
-                #               'location': {'custom': 100.0, 'weight': 0.0}},
-                #              {'font': 'master.Adobe VF Prototype.Master_4.5',
-                #               'glyphName': 'dollar.nostroke',
-                #               'location': {'custom': 100.0, 'weight': 368.0}}],
-                #  'unicodes': [36]}
-                glyphData = instanceDescriptor.glyphs[glyphName]
+            if glyphName in glyphResults:
+                result = glyphResults[glyphName]
             else:
-                glyphData = {}
-            font.newGlyph(glyphName)
-            font[glyphName].clear()
-            if glyphData.get('mute', False):
-                # mute this glyph, skip
-                continue
-            glyphInstanceLocation = glyphData.get("instanceLocation", instanceDescriptor.location)
-            uniValues = []
-            neutral = glyphMutator.get(())
-            if neutral is not None:
-                uniValues = neutral[0].unicodes
-            glyphInstanceUnicodes = glyphData.get("unicodes", uniValues)
-            note = glyphData.get("note")
-            if note:
-                font[glyphName] = note
-            masters = glyphData.get("masters", None)
-            if masters:
-                items = []
-                for glyphMaster in masters:
-                    sourceGlyphFont = glyphMaster.get("font")
-                    sourceGlyphName = glyphMaster.get("glyphName", glyphName)
-                    m = self.fonts.get(sourceGlyphFont)
-                    if not sourceGlyphName in m:
-                        continue
-                    if hasattr(m[sourceGlyphName], "toMathGlyph"):
-                        sourceGlyph = m[sourceGlyphName].toMathGlyph()
-                    else:
-                        sourceGlyph = MathGlyph(m[sourceGlyphName])
-                    sourceGlyphLocation = glyphMaster.get("location")
-                    items.append((sourceGlyphLocation, sourceGlyph))
-                bias, glyphMutator = self.getVariationModel(items, axes=self.serializedAxes, bias=self.defaultLoc)
-            try:
-                if not self.isAnisotropic(glyphInstanceLocation):
-                    glyphInstanceObject = glyphMutator.makeInstance(glyphInstanceLocation)
+                if parallelResults is not None:
+                    result = parallelResults.get(glyphName)
                 else:
-                    # split anisotropic location into horizontal and vertical components
-                    horizontal, vertical = self.splitAnisotropic(glyphInstanceLocation)
-                    horizontalGlyphInstanceObject = glyphMutator.makeInstance(horizontal)
-                    verticalGlyphInstanceObject = glyphMutator.makeInstance(vertical)
-                    # merge them again
-                    glyphInstanceObject = (0,1)*horizontalGlyphInstanceObject + (1,0)*verticalGlyphInstanceObject
-            except IndexError:
-                # alignment problem with the data?
-                print("Error making instance %s" % glyphName)
+                    result = self._makeGlyphInstance(instanceDescriptor, glyphName)
+                    batchCost = self._releaseGlyphBatch(batchCost, glyphName)
+                if cachedResults is not None and glyphName not in instanceDescriptor.glyphs:
+                    cachedResults[glyphName] = result
+            if result is None:
                 continue
-            font.newGlyph(glyphName)
-            font[glyphName].clear()
-            if self.roundGeometry:
-                try:
-                    glyphInstanceObject = glyphInstanceObject.round()
-                except AttributeError:
-                    pass
-            try:
-                glyphInstanceObject.extractGlyph(font[glyphName], onlyGeometry=True)
-            except TypeError:
-                # this causes ruled glyphs to end up in the wrong glyphname
-                # but defcon2 objects don't support it
-                pPen = font[glyphName].getPointPen()
-                font[glyphName].clear()
-                glyphInstanceObject.drawPoints(pPen)
-            font[glyphName].width = glyphInstanceObject.width
-            font[glyphName].unicodes = glyphInstanceUnicodes
+            self._extractGlyphInstance(font, glyphName, result)
         if doRules:
-            resultNames = processRules(self.rules, loc, self.glyphNames)
-            for oldName, newName in zip(self.glyphNames, resultNames):
-                if oldName != newName:
-                    swapGlyphNames(font, oldName, newName)
+            self.applyRules(font, loc)
         # copy the glyph lib?
         #for sourceDescriptor in self.sources:
         #    if sourceDescriptor.copyLib:
@@ -620,7 +1607,327 @@ class DesignSpaceProcessor(DesignSpaceDocument):
         #    pass
         # store designspace location in the font.lib
         font.lib['designspace'] = list(instanceDescriptor.location.items())
-        return font
+
+    def _makeInstancesGlyphMajor(self, instances, doRules=False, glyphNames=None, kerning=True, info=True):
+        # Make all these instances at once, one glyph at a time, see glyphMajor.
+        # Returns a list with a font for each instance.
+        fonts = [self._makeInstanceFont(instanceDescriptor, kerning=kerning, info=info) for instanceDescriptor in instances]
+        if glyphNames:
+            selectedGlyphNames = glyphNames
+        else:
+            selectedGlyphNames = self.glyphNames
+        for font in fonts:
+            if not 'public.glyphOrder' in font.lib.keys():
+                font.lib['public.glyphOrder'] = selectedGlyphNames
+        columns = None
+        if self.workers > 1 and len(selectedGlyphNames) > 1:
+            columns = self._makeGlyphColumnsParallel(instances, selectedGlyphNames)
+        if columns is None:
+            columns = ((glyphName, self._makeGlyphColumn(instances, glyphName)) for glyphName in selectedGlyphNames)
+        for glyphName, results in columns:
+            for font, result in zip(fonts, results):
+                if result is None:
+                    continue
+                self._extractGlyphInstance(font, glyphName, result)
+        for instanceDescriptor, font in zip(instances, fonts):
+            if doRules:
+                self.applyRules(font, instanceDescriptor.location)
+            font.lib['designspace'] = list(instanceDescriptor.location.items())
+        return fonts
+
+    def _makeGlyphColumn(self, instances, glyphName):
+        # Interpolate one glyph for all these instances.
+        # The mutator is made once and evaluated at all the instance locations in one go.
+        # If it was made for this, it is thrown away again.
+        # Returns a list with the result of _makeGlyphInstance for each instance.
+        results = [None] * len(instances)
+        cacheKey = (glyphName, False)
+        built = cacheKey not in self._glyphMutators
+        special = [index for index, instanceDescriptor in enumerate(instances) if glyphName in instanceDescriptor.glyphs]
+        if special:
+            # instances can list their own masters for this glyph
+            knownKeys = set([key for key in self._glyphMutators if key[0] == glyphName])
+        try:
+            glyphMutator = self.getGlyphMutator(glyphName)
+        except Exception:
+            self.problems.append("Could not make mutator for glyph %s %s" % (glyphName, traceback.format_exc()))
+            return results
+        if glyphMutator is None:
+            return results
+        # instances at the same location share the result
+        batch = collections.OrderedDict()
+        for index, instanceDescriptor in enumerate(instances):
+            location = instanceDescriptor.location
+            if index in special or self.isAnisotropic(location):
+                results[index] = self._makeGlyphInstance(instanceDescriptor, glyphName)
+            else:
+                batch.setdefault(self._locationKey(location), (location, []))[1].append(index)
+        if batch:
+            uniValues = []
+            neutral = glyphMutator.get(())
+            if neutral is not None:
+                uniValues = neutral[0].unicodes
+            locations = [location for location, indexes in batch.values()]
+            try:
+                if hasattr(glyphMutator, "makeInstances"):
+                    glyphInstanceObjects = glyphMutator.makeInstances(locations)
+                else:
+                    glyphInstanceObjects = [glyphMutator.makeInstance(location) for location in locations]
+            except IndexError:
+                # alignment problem with the data?
+                self.problems.append("Error making instances of glyph %s %s" % (glyphName, traceback.format_exc()))
+                glyphInstanceObjects = [None] * len(locations)
+            for glyphInstanceObject, (location, indexes) in zip(glyphInstanceObjects, batch.values()):
+                for index in indexes:
+                    if glyphInstanceObject is None:
+                        results[index] = None, None, None
+                    else:
+                        results[index] = glyphInstanceObject, uniValues, None
+        if built:
+            self._glyphMutators.pop(cacheKey, None)
+        if special:
+            for key in [key for key in self._glyphMutators if key[0] == glyphName and key not in knownKeys]:
+                del self._glyphMutators[key]
+        return results
+
+    def _makeGlyphColumnsParallel(self, instances, glyphNames):
+        # Interpolate the glyphs for all instances in chunks on the glyph pool.
+        # Yields (glyphName, results) pairs as the chunks come in,
+        # or returns None if there is no pool.
+        if self._glyphPool is None:
+            self.messages.append("Glyph workers need the fork start method, falling back to a single process.")
+            return None
+        chunks = [(instances, chunk) for chunk in self._chunkGlyphNames(glyphNames, self.workers)]
+        return self._iterGlyphColumnChunks(chunks)
+
+    def _iterGlyphColumnChunks(self, chunks):
+        for chunkResults, chunkProblems in self._glyphPool.imap_unordered(_makeGlyphColumnChunk, chunks):
+            self.problems.extend(chunkProblems)
+            for glyphName, results in chunkResults:
+                yield glyphName, results
+
+    def applyRules(self, font, location):
+        # Swap the glyphs in this instance font that the rules substitute at this location.
+        resultNames = processRules(self.rules, location, self.glyphNames)
+        for oldName, newName in zip(self.glyphNames, resultNames):
+            if oldName != newName:
+                swapGlyphNames(font, oldName, newName)
+
+    def _makeGlyphInstance(self, instanceDescriptor, glyphName):
+        # Interpolate a single glyph for this instance.
+        # Returns None if the glyph should not be in the instance at all,
+        # otherwise a (glyphInstanceObject, unicodes, note) tuple.
+        # glyphInstanceObject is None if the glyph should stay empty.
+        try:
+            glyphMutator = self.getGlyphMutator(glyphName)
+            if glyphMutator is None:
+                return None
+        except:
+            self.problems.append("Could not make mutator for glyph %s %s" % (glyphName, traceback.format_exc()))
+            return None
+        if glyphName in instanceDescriptor.glyphs.keys():
+            # XXX this should be able to go now that we have full rule support. 
+            # reminder: this is what the glyphData can look like
+            # {'instanceLocation': {'custom': 0.0, 'weight': 824.0},
+            #  'masters': [{'font': 'master.Adobe VF Prototype.Master_0.0',
+            #               'glyphName': 'dollar.nostroke',
+            #               'location': {'custom': 0.0, 'weight': 0.0}},
+            #              {'font': 'master.Adobe VF Prototype.Master_1.1',
+            #               'glyphName': 'dollar.nostroke',
+            #               'location': {'custom': 0.0, 'weight': 368.0}},
+            #              {'font': 'master.Adobe VF Prototype.Master_2.2',
+            #               'glyphName': 'dollar.nostroke',
+            #               'location': {'custom': 0.0, 'weight': 1000.0}},
+            #              {'font': 'master.Adobe VF Prototype.Master_3.3',
+            #               'glyphName': 'dollar.nostroke',
+            #               'location': {'custom': 100.0, 'weight': 1000.0}},
+            #              {'font': 'master.Adobe VF Prototype.Master_0.4',
+            #               'glyphName': 'dollar.nostroke',
+            #               'location': {'custom': 100.0, 'weight': 0.0}},
+            #              {'font': 'master.Adobe VF Prototype.Master_4.5',
+            #               'glyphName': 'dollar.nostroke',
+            #               'location': {'custom': 100.0, 'weight': 368.0}}],
+            #  'unicodes': [36]}
+            glyphData = instanceDescriptor.glyphs[glyphName]
+        else:
+            glyphData = {}
+        if glyphData.get('mute', False):
+            # mute this glyph, skip
+            return None, None, None
+        glyphInstanceLocation = glyphData.get("instanceLocation", instanceDescriptor.location)
+        uniValues = []
+        neutral = glyphMutator.get(())
+        if neutral is not None:
+            uniValues = neutral[0].unicodes
+        glyphInstanceUnicodes = glyphData.get("unicodes", uniValues)
+        note = glyphData.get("note")
+        masters = glyphData.get("masters", None)
+        if masters:
+            glyphMutator = self.getGlyphMastersMutator(glyphName, masters)
+        try:
+            if not self.isAnisotropic(glyphInstanceLocation):
+                glyphInstanceObject = glyphMutator.makeInstance(glyphInstanceLocation)
+            else:
+                # split anisotropic location into horizontal and vertical components
+                horizontal, vertical = self.splitAnisotropic(glyphInstanceLocation)
+                horizontalGlyphInstanceObject = glyphMutator.makeInstance(horizontal)
+                verticalGlyphInstanceObject = glyphMutator.makeInstance(vertical)
+                # merge them again
+                glyphInstanceObject = (0,1)*horizontalGlyphInstanceObject + (1,0)*verticalGlyphInstanceObject
+        except IndexError:
+            # alignment problem with the data?
+            print("Error making instance %s" % glyphName)
+            return None, None, None
+        # the geometry is rounded when it is written to the font, see _extractGlyphInstance
+        return glyphInstanceObject, glyphInstanceUnicodes, note
+
+    def _extractGlyphInstance(self, font, glyphName, result):
+        # Write the result of _makeGlyphInstance to a new glyph in the font.
+        # The glyph is made once and filled in while its notifications are held,
+        # if roundGeometry is set the geometry is rounded on the way in.
+        glyphInstanceObject, glyphInstanceUnicodes, note = result
+        glyph = font.newGlyph(glyphName)
+        if glyph is None:
+            glyph = font[glyphName]
+        if glyphInstanceObject is None:
+            return
+        holdNotifications = hasattr(glyph, "holdNotifications")
+        if holdNotifications:
+            glyph.holdNotifications()
+        try:
+            pointPen = FilterRedundantPointPen(glyph.getPointPen())
+            anchors = glyphInstanceObject.anchors
+            guidelines = glyphInstanceObject.guidelines
+            image = glyphInstanceObject.image
+            width = glyphInstanceObject.width
+            height = glyphInstanceObject.height
+            if self.roundGeometry:
+                pointPen = RoundingPointPen(pointPen)
+                anchors = _roundAnchors(anchors)
+                guidelines = _roundGuidelines(guidelines)
+                image = _roundImage(image)
+                width = _roundNumber(width)
+                height = _roundNumber(height)
+            glyphInstanceObject.drawPoints(pointPen)
+            glyph.anchors = [dict(anchor) for anchor in anchors]
+            glyph.guidelines = [_compressGuideline(guideline) for guideline in guidelines]
+            glyph.image = _compressImage(image)
+            glyph.lib = copy.deepcopy(dict(glyphInstanceObject.lib))
+            glyph.width = width
+            glyph.height = height
+            glyph.note = note or glyphInstanceObject.note
+            glyph.unicodes = glyphInstanceUnicodes
+        finally:
+            if holdNotifications:
+                glyph.releaseHeldNotifications()
+
+    def _estimateGlyphCost(self, glyphName):
+        # Rough estimate of the work needed to interpolate this glyph:
+        # the number of points and components, times the number of masters.
+        if self._masterData is not None:
+            return self._masterData.getGlyphCost(glyphName)
+        entries = self.getGlyphIndex().get(glyphName, [])
+        if not entries:
+            return 0
+        sourceDescriptor, layerName = entries[0]
+        reader = self._glyphReaders.get(sourceDescriptor.name)
+        if reader is not None:
+            # don't load the defcon glyph just for this
+            return reader.getGlyphCost(glyphName, layerName) * len(entries)
+        with self._fontsLock:
+            f = self.fonts[sourceDescriptor.name]
+            if layerName is None:
+                glyph = f[glyphName]
+            else:
+                glyph = f.layers[layerName][glyphName]
+            size = 1 + len(glyph.components)
+            for contour in glyph:
+                size += len(contour)
+        return size * len(entries)
+
+    def _makeGlyphInstancesParallel(self, instanceDescriptor, glyphNames, workers):
+        # Interpolate the glyphs in chunks on a process pool.
+        # The chunks are balanced by estimated cost and the largest
+        # glyphs are scheduled first. Returns a dict with the results of
+        # _makeGlyphInstance, keyed by glyphname.
+        pool = self._glyphPool
+        ownPool = pool is None
+        if ownPool:
+            pool = self._openGlyphPool(workers)
+            if pool is None:
+                self.messages.append("Glyph workers need the fork start method, falling back to a single process.")
+                return None
+        try:
+            chunks = [(instanceDescriptor, chunk) for chunk in self._chunkGlyphNames(glyphNames, workers)]
+            results = {}
+            for chunkResults, chunkProblems in pool.imap_unordered(_makeGlyphInstanceChunk, chunks):
+                results.update(chunkResults)
+                self.problems.extend(chunkProblems)
+            return results
+        finally:
+            if ownPool:
+                pool.close()
+                pool.join()
+
+    def _chunkGlyphNames(self, glyphNames, workers):
+        # Split the glyphnames in chunks of about the same estimated cost,
+        # about four for each worker, with the largest glyphs first.
+        costs = [(self._estimateGlyphCost(glyphName), glyphName) for glyphName in glyphNames]
+        costs.sort(key=lambda item: -item[0])
+        totalCost = sum([cost for cost, glyphName in costs]) or 1
+        chunkCost = totalCost / (workers * 4.0)
+        chunks = []
+        chunk = []
+        currentCost = 0
+        for cost, glyphName in costs:
+            chunk.append(glyphName)
+            currentCost += cost
+            if currentCost >= chunkCost:
+                chunks.append(chunk)
+                chunk = []
+                currentCost = 0
+        if chunk:
+            chunks.append(chunk)
+        return chunks
+
+    def _openGlyphPool(self, workers):
+        # The workers get a forked copy of this processor, so nothing needs to be pickled.
+        # If the masters are shared, the workers get a copy without fonts
+        # and attach to the shared master data instead.
+        if self._sharedMasters is not None:
+            return multiprocessing.Pool(workers, initializer=_initSharedGlyphWorker, initargs=(self._getWorkerCopy(), self._sharedMasters.kind, self._sharedMasters.name))
+        try:
+            context = multiprocessing.get_context("fork")
+        except AttributeError:
+            # py2 multiprocessing always forks
+            context = multiprocessing
+        except ValueError:
+            return None
+        return context.Pool(workers, initializer=_initGlyphWorker, initargs=(self,))
+
+    def _getWorkerCopy(self):
+        # A shallow copy of this processor without fonts, mutators or other
+        # process bound things. Small enough to pickle for a worker process.
+        worker = copy.copy(self)
+        worker.fonts = {}
+        worker._glyphMutators = {}
+        worker._infoMutator = None
+        worker._kerningMutator = None
+        worker._variationModels = {}
+        worker._glyphIndex = None
+        worker._glyphReaders = {}
+        worker._masterData = None
+        worker._sharedMasters = None
+        worker._masterSnapshot = None
+        worker._glyphPool = None
+        worker._glyphInstanceCache = None
+        worker.problems = []
+        worker.messages = []
+        return worker
+
+    def _locationKey(self, location):
+        # a hashable version of this location
+        return tuple(sorted(location.items()))
 
     def isAnisotropic(self, location):
         for v in location.values():
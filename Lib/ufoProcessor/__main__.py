@@ -0,0 +1,4 @@
+import sys
+from ufoProcessor.commandLine import main
+
+sys.exit(main())
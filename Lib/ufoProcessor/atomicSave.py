@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function, division, absolute_import
+
+import os
+import shutil
+import tempfile
+
+"""
+    Save a font to an existing UFO, but only touch the files that changed.
+
+    The font is saved to a temporary UFO next to the destination. Then
+    every file is compared with the file on disk. Changed and new files are
+    moved into place with os.replace, which is atomic on the same file
+    system. Files that are no longer part of the UFO are removed.
+    Unchanged files are not rewritten, so their modification times stay
+    the same and tools that watch them have nothing to rebuild.
+
+    The contents.plist, layercontents.plist and metainfo.plist files are
+    replaced last, so that a crash halfway leaves the old index files that
+    only point to glyphs that exist.
+"""
+
+# replace these after all the other files
+_indexFiles = ["contents.plist", "layercontents.plist", "metainfo.plist"]
+
+try:
+    _replace = os.replace
+except AttributeError:
+    # py2 has no os.replace. os.rename is atomic on posix.
+    _replace = os.rename
+
+
+def _sameContents(path1, path2):
+    if os.path.getsize(path1) != os.path.getsize(path2):
+        return False
+    with open(path1, "rb") as f1:
+        with open(path2, "rb") as f2:
+            return f1.read() == f2.read()
+
+
+def _listFiles(root):
+    # Return the relative paths of all files in root.
+    found = []
+    for folder, folderNames, fileNames in os.walk(root):
+        for fileName in fileNames:
+            found.append(os.path.relpath(os.path.join(folder, fileName), root))
+    return found
+
+
+def _saveOrder(relativePath):
+    fileName = os.path.basename(relativePath)
+    if fileName in _indexFiles:
+        return (1, _indexFiles.index(fileName), relativePath)
+    return (0, 0, relativePath)
+
+
+def saveFontIncremental(font, path, formatVersion=None):
+    """ Save font to the UFO at path, only write the files that changed.
+        Returns a dict with lists of the written, unchanged and removed files,
+        relative to path.
+    """
+    path = os.path.abspath(path)
+    parent = os.path.dirname(path)
+    report = dict(written=[], unchanged=[], removed=[])
+    tempRoot = tempfile.mkdtemp(prefix=".%s-" % os.path.basename(path), dir=parent)
+    try:
+        tempPath = os.path.join(tempRoot, os.path.basename(path))
+        font.save(tempPath, formatVersion)
+        newFiles = _listFiles(tempPath)
+        if not os.path.isdir(path):
+            # nothing to compare with, move the whole UFO in place
+            if os.path.exists(path):
+                os.remove(path)
+            _replace(tempPath, path)
+            report['written'] = sorted(newFiles)
+        else:
+            for relativePath in sorted(newFiles, key=_saveOrder):
+                source = os.path.join(tempPath, relativePath)
+                destination = os.path.join(path, relativePath)
+                if os.path.exists(destination) and _sameContents(source, destination):
+                    report['unchanged'].append(relativePath)
+                    continue
+                folder = os.path.dirname(destination)
+                if not os.path.exists(folder):
+                    os.makedirs(folder)
+                _replace(source, destination)
+                report['written'].append(relativePath)
+            newFiles = set(newFiles)
+            for relativePath in _listFiles(path):
+                if relativePath not in newFiles:
+                    os.remove(os.path.join(path, relativePath))
+                    report['removed'].append(relativePath)
+            # remove the folders that are empty now
+            for folder, folderNames, fileNames in os.walk(path, topdown=False):
+                if folder != path and not os.listdir(folder):
+                    os.rmdir(folder)
+    finally:
+        shutil.rmtree(tempRoot, ignore_errors=True)
+    try:
+        # the font thinks it lives in the temporary UFO
+        font.path = path
+    except (AssertionError, AttributeError):
+        pass
+    return report
@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function, division, absolute_import
+
+import os
+import re
+import sys
+import glob
+import json
+import time
+import argparse
+import traceback
+
+import ufoProcessor
+
+"""
+    Command line interface for generating UFO instances from designspace files.
+
+        ufoprocessor path/to/family.designspace --workers 8 --engine varlib --profile profile.json
+
+    documentPath can also be a folder, then all .designspace files in it are processed.
+    Exit codes:
+        0   all instances were generated without problems
+        1   the instances were generated, but there were problems
+        2   a document could not be generated at all
+"""
+
+def makeParser():
+    parser = argparse.ArgumentParser(prog="ufoprocessor", description="Generate UFO instances from designspace files.")
+    parser.add_argument("documentPath", help="a .designspace file, or a folder with .designspace files")
+    parser.add_argument("-w", "--workers", type=int, default=1, help="number of processes to interpolate glyphs with (default: 1)")
+    parser.add_argument("-i", "--instance", action="append", dest="instanceNames", metavar="NAME", help="only generate the instance with this name, or stylename. Can be used more than once.")
+    parser.add_argument("-g", "--glyphs", help="only generate these glyphs, separated by commas or spaces")
+    parser.add_argument("--glyphs-regex", dest="glyphsRegex", metavar="REGEX", help="only generate the glyphs whose names match this regular expression")
+    parser.add_argument("-e", "--engine", choices=["mutatormath", "varlib"], default="mutatormath", help="the interpolation engine (default: mutatormath)")
+    parser.add_argument("-u", "--ufo-version", dest="ufoVersion", type=int, choices=[2, 3], default=3, help="UFO format of the instances (default: 3)")
+    parser.add_argument("-f", "--format", dest="outputFormat", choices=["ufo", "ttf", "otf"], default="ufo", help="save the instances as UFOs, or compile them to TrueType or CFF fonts (default: ufo)")
+    parser.add_argument("--no-rules", dest="processRules", action="store_false", help="do not process the designspace rules")
+    parser.add_argument("--no-round", dest="roundGeometry", action="store_false", help="do not round the geometry")
+    parser.add_argument("--compact-kerning", dest="compactKerning", action="store_true", help="remove kerning pairs that do not change the instance kerning")
+    parser.add_argument("--incremental-save", dest="incrementalSave", action="store_true", help="only write the files of existing instances that changed")
+    parser.add_argument("--save-workers", dest="saveWorkers", type=int, default=0, metavar="N", help="save the instances on N threads while the next ones are made (default: 0, save in between)")
+    parser.add_argument("--glyph-major", dest="glyphMajor", action="store_true", help="make each glyph for a group of instances at once, then throw its mutator away")
+    parser.add_argument("--glyph-major-group", dest="glyphMajorGroupSize", type=int, default=8, metavar="N", help="with --glyph-major, the number of instances made together and kept in memory (default: 8, 0 for all)")
+    parser.add_argument("--fast-masters", dest="fastMasterReading", action="store_true", help="read the master glyphs straight from the glif files")
+    parser.add_argument("--share-masters", dest="shareMasters", action="store_true", help="give the workers the masters in shared memory")
+    parser.add_argument("--low-memory", dest="lowMemory", action="store_true", help="let go of the parsed masters and build the glyph mutators in batches")
+    parser.add_argument("--memory-target", dest="memoryTarget", type=float, metavar="MB", help="with --low-memory, the peak memory to aim for in megabytes")
+    parser.add_argument("--snapshot-dir", dest="snapshotDir", metavar="DIR", help="keep a snapshot of the masters of each document in DIR, and read them from there while the sources do not change")
+    parser.add_argument("-p", "--profile", metavar="PATH", help="write a json profile with timings, problems and messages to PATH, - for stdout")
+    parser.add_argument("-q", "--quiet", action="store_true", help="do not print the problems")
+    return parser
+
+
+def selectGlyphNames(glyphNames, glyphs=None, glyphsRegex=None):
+    """ Filter the glyphnames with a list and / or a regular expression. Keeps the order."""
+    if glyphs is None and glyphsRegex is None:
+        return None
+    selected = glyphNames
+    if glyphs is not None:
+        wanted = set(re.split(r"[,\s]+", glyphs.strip()))
+        selected = [name for name in selected if name in wanted]
+    if glyphsRegex is not None:
+        pattern = re.compile(glyphsRegex)
+        selected = [name for name in selected if pattern.search(name)]
+    return selected
+
+
+def generateDocument(path, options):
+    """ Generate the instances for one designspace document.
+        Returns a dict with the timings, problems and messages.
+    """
+    profile = dict(path=path, timings={}, instances=[], problems=[], messages=[], error=None, peakMemory=None)
+    start = time.time()
+    document = ufoProcessor.DesignSpaceProcessor(ufoVersion=options.ufoVersion, useVarlib=options.engine == "varlib")
+    document.roundGeometry = options.roundGeometry
+    document.workers = options.workers
+    document.kerningCompaction = options.compactKerning
+    document.incrementalSave = options.incrementalSave
+    document.saveWorkers = options.saveWorkers
+    document.glyphMajor = options.glyphMajor
+    document.glyphMajorGroupSize = options.glyphMajorGroupSize
+    document.outputFormat = options.outputFormat
+    document.fastMasterReading = options.fastMasterReading
+    document.lowMemory = options.lowMemory
+    if options.memoryTarget is not None:
+        document.memoryTarget = int(options.memoryTarget * 2**20)
+    shared = None
+    try:
+        document.read(path)
+        if options.instanceNames:
+            document.instances = [instance for instance in document.instances if instance.name in options.instanceNames or instance.styleName in options.instanceNames]
+        profile['timings']['read'] = time.time() - start
+        start = time.time()
+        document.loadFonts()
+        profile['timings']['loadFonts'] = time.time() - start
+        if options.snapshotDir:
+            start = time.time()
+            if not os.path.isdir(options.snapshotDir):
+                os.makedirs(options.snapshotDir)
+            snapshotName = os.path.splitext(os.path.basename(path))[0] + ".masters"
+            document.useMasterSnapshot(os.path.join(options.snapshotDir, snapshotName))
+            profile['timings']['snapshot'] = time.time() - start
+        elif options.shareMasters:
+            start = time.time()
+            shared = document.shareMasters()
+            profile['timings']['shareMasters'] = time.time() - start
+        glyphNames = selectGlyphNames(document.glyphNames, options.glyphs, options.glyphsRegex)
+        start = time.time()
+        document.generateUFO(processRules=options.processRules, glyphNames=glyphNames)
+        profile['timings']['generate'] = time.time() - start
+        profile['instances'] = document.instanceTimings
+        profile['peakMemory'] = document.peakMemory
+    except Exception:
+        profile['error'] = traceback.format_exc()
+    finally:
+        if shared is not None:
+            shared.unlink()
+        document.closeMasterSnapshot()
+    profile['problems'] = list(document.problems)
+    profile['messages'] = list(document.messages)
+    return profile
+
+
+def main(args=None):
+    options = makeParser().parse_args(args)
+    if os.path.isdir(options.documentPath):
+        todo = sorted(glob.glob(os.path.join(options.documentPath, "*.designspace")))
+    else:
+        todo = [options.documentPath]
+    start = time.time()
+    profiles = []
+    for path in todo:
+        profile = generateDocument(path, options)
+        profiles.append(profile)
+        if not options.quiet:
+            for message in profile['problems']:
+                print("%s: %s" % (os.path.basename(path), message), file=sys.stderr)
+            if profile['error']:
+                print("%s: %s" % (os.path.basename(path), profile['error']), file=sys.stderr)
+    result = dict(documents=profiles, total=time.time() - start, workers=options.workers, engine=options.engine)
+    if options.profile:
+        data = json.dumps(result, indent=2, sort_keys=True)
+        if options.profile == "-":
+            print(data)
+        else:
+            with open(options.profile, "w") as f:
+                f.write(data)
+    if not profiles or [profile for profile in profiles if profile['error']]:
+        return 2
+    if [profile for profile in profiles if profile['problems']]:
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
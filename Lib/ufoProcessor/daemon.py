@@ -0,0 +1,468 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function, division, absolute_import
+
+import os
+import sys
+import json
+import stat
+import time
+import hashlib
+import socket
+import argparse
+import tempfile
+import threading
+import traceback
+
+try:
+    import socketserver
+except ImportError:
+    # py2
+    import SocketServer as socketserver
+
+import ufoProcessor
+from ufoProcessor.glifReader import readUFOPlist, DEFAULT_LAYER_NAME, DEFAULT_GLYPHS_DIRNAME
+from ufoProcessor.commandLine import selectGlyphNames
+
+"""
+    A build server that keeps designspaces loaded between builds.
+
+    Starting a build means importing everything, reading the masters and
+    building the mutators again. The server does that once per designspace
+    and keeps the DesignSpaceProcessor around. Before each request it
+    checks the modification times of the designspace and the source files:
+
+        - a changed designspace is read again from scratch
+        - changed .glif files only reload their source and throw away
+          the mutators of those glyphs
+        - other changed files in a source (fontinfo, kerning, groups,
+          contents.plist...) throw away all the mutators
+
+    Start the server, then send it requests from the command line:
+
+        ufoprocessor-daemon serve --engine varlib --workers 4 &
+        ufoprocessor-daemon build family.designspace -i Bold
+        ufoprocessor-daemon build family.designspace -g a,b,c
+        ufoprocessor-daemon glyph family.designspace a -i Bold
+        ufoprocessor-daemon glyph family.designspace a -l weight=350
+        ufoprocessor-daemon status
+        ufoprocessor-daemon stop
+
+    Requests and responses are one line of json each, over a Unix socket.
+    A request is a dict with a "command" and its arguments:
+
+        {"command": "build", "document": path, "instances": [names], "glyphs": [names]}
+        {"command": "glyph", "document": path, "glyph": name, "instance": name}
+        {"command": "glyph", "document": path, "glyph": name, "location": {axis: value}}
+        {"command": "status"}
+        {"command": "stop"}
+
+    The response has "ok", "problems", "messages", "error", "timings" and "reloaded",
+    and for glyph requests the glyph in "glif".
+"""
+
+
+def defaultSocketPath():
+    """ The socket path that the server and the clients agree on if none is given."""
+    path = os.environ.get("UFOPROCESSOR_SOCKET")
+    if path:
+        return path
+    return os.path.join(tempfile.gettempdir(), "ufoprocessor-%d.sock" % os.getuid())
+
+
+def _digest(filePath):
+    with open(filePath, "rb") as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+def _snapshot(path, previous=None):
+    # relative path: (mtime, size, digest) for the files in a UFO folder.
+    # Saving a font rewrites plists that did not change, so for the files
+    # that are not glifs we look at the contents, but only read them
+    # again if their mtime changed. A .ufoz is just one file.
+    if not os.path.exists(path):
+        return None
+    if os.path.isfile(path):
+        st = os.stat(path)
+        return {"": (st.st_mtime, st.st_size, None)}
+    if previous is None:
+        previous = {}
+    files = {}
+    for root, dirNames, fileNames in os.walk(path):
+        for fileName in fileNames:
+            filePath = os.path.join(root, fileName)
+            relativePath = os.path.relpath(filePath, path)
+            try:
+                st = os.stat(filePath)
+                digest = None
+                if not fileName.endswith(".glif"):
+                    old = previous.get(relativePath)
+                    if old is not None and old[:2] == (st.st_mtime, st.st_size):
+                        digest = old[2]
+                    else:
+                        digest = _digest(filePath)
+            except (OSError, IOError):
+                # removed while we were looking
+                continue
+            files[relativePath] = (st.st_mtime, st.st_size, digest)
+    return files
+
+
+def _changedFiles(old, new):
+    # The relative paths of the files that changed between two snapshots,
+    # None if the source appeared, disappeared, or files were added or removed.
+    if old is None or new is None or set(old.keys()) != set(new.keys()):
+        return None
+    changed = []
+    for relativePath, stamp in new.items():
+        if stamp[2] is None:
+            if stamp[:2] != old[relativePath][:2]:
+                changed.append(relativePath)
+        elif stamp[2] != old[relativePath][2]:
+            changed.append(relativePath)
+    return changed
+
+
+def _changedGlyphNames(path, changed):
+    # The glyphs in all layers whose glif files are in changed,
+    # or None if anything else changed.
+    if changed is None or "" in changed:
+        return None
+    if [relativePath for relativePath in changed if not relativePath.endswith(".glif")]:
+        return None
+    layerContents = readUFOPlist(path, "layercontents.plist", [[DEFAULT_LAYER_NAME, DEFAULT_GLYPHS_DIRNAME]])
+    fileNames = {}
+    for layerName, directory in layerContents:
+        contents = readUFOPlist(path, os.path.join(directory, "contents.plist"), {})
+        for glyphName, fileName in contents.items():
+            fileNames[os.path.join(directory, fileName)] = glyphName
+    glyphNames = set()
+    for relativePath in changed:
+        if relativePath not in fileNames:
+            return None
+        glyphNames.add(fileNames[relativePath])
+    return glyphNames
+
+
+class WarmDocument(object):
+    """ A DesignSpaceProcessor for one designspace that is kept loaded,
+        with the modification times of the files it was loaded from.
+    """
+
+    def __init__(self, path, options):
+        self.path = os.path.abspath(path)
+        self.options = options
+        self.lock = threading.Lock()
+        self.processor = None
+        self._documentStamp = None
+        self._sourceSnapshots = {}
+        self.builds = 0
+
+    def _makeProcessor(self):
+        options = self.options
+        processor = ufoProcessor.DesignSpaceProcessor(ufoVersion=options.ufoVersion, useVarlib=options.engine == "varlib")
+        processor.roundGeometry = options.roundGeometry
+        processor.workers = options.workers
+        processor.kerningCompaction = options.compactKerning
+        processor.incrementalSave = options.incrementalSave
+        processor.fastMasterReading = options.fastMasterReading
+        processor.outputFormat = options.outputFormat
+        processor.read(self.path)
+        processor.loadFonts()
+        processor.findDefault()
+        return processor
+
+    def _sourcePaths(self):
+        return sorted(set([os.path.abspath(sourceDescriptor.path) for sourceDescriptor in self.processor.sources]))
+
+    def refresh(self):
+        """ Reload what changed on disk since the last request.
+            Returns a dict that says what was reloaded.
+        """
+        stamp = os.stat(self.path).st_mtime
+        if self.processor is None or stamp != self._documentStamp:
+            self.processor = self._makeProcessor()
+            self._documentStamp = stamp
+            self._sourceSnapshots = dict([(path, _snapshot(path)) for path in self._sourcePaths()])
+            return dict(document=True, sources=[], glyphs=[])
+        reloaded = dict(document=False, sources=[], glyphs=[])
+        allGlyphs = False
+        changedGlyphNames = set()
+        for path in self._sourcePaths():
+            old = self._sourceSnapshots.get(path)
+            new = _snapshot(path, old)
+            self._sourceSnapshots[path] = new
+            changed = _changedFiles(old, new)
+            if changed == []:
+                continue
+            glyphNames = _changedGlyphNames(path, changed)
+            if glyphNames is None:
+                allGlyphs = True
+            else:
+                changedGlyphNames.update(glyphNames)
+            reloaded['sources'].append(path)
+        if reloaded['sources']:
+            self.processor.reloadSources(reloaded['sources'], glyphNames=None if allGlyphs else changedGlyphNames)
+            self.processor.findDefault()
+            if allGlyphs:
+                reloaded['glyphs'] = None
+            else:
+                reloaded['glyphs'] = sorted(changedGlyphNames)
+        return reloaded
+
+    def _findInstance(self, name):
+        for instanceDescriptor in self.processor.instances:
+            if name in (instanceDescriptor.name, instanceDescriptor.styleName):
+                return instanceDescriptor
+        raise ValueError("No instance named %s in %s" % (name, self.path))
+
+    def build(self, instanceNames=None, glyphNames=None):
+        """ Generate the instances, or some of them, or some glyphs of them."""
+        processor = self.processor
+        if glyphNames is not None:
+            glyphNames = selectGlyphNames(processor.glyphNames, ",".join(glyphNames))
+        instances = processor.instances
+        if instanceNames:
+            processor.instances = [instanceDescriptor for instanceDescriptor in instances if instanceDescriptor.name in instanceNames or instanceDescriptor.styleName in instanceNames]
+        try:
+            processor.generateUFO(processRules=self.options.processRules, glyphNames=glyphNames)
+        finally:
+            processor.instances = instances
+        self.builds += 1
+        return dict(instances=processor.instanceTimings)
+
+    def makeGlyph(self, glyphName, instanceName=None, location=None):
+        """ Return the glif text of one glyph at an instance or a location."""
+        from ufoLib.glifLib import writeGlyphToString
+        processor = self.processor
+        if instanceName is not None:
+            instanceDescriptor = self._findInstance(instanceName)
+        else:
+            instanceDescriptor = ufoProcessor.InstanceDescriptor()
+            if location is None:
+                location = dict(processor.default.location)
+            instanceDescriptor.location = location
+        font = processor.makeInstance(instanceDescriptor, glyphNames=[glyphName], workers=1)
+        if glyphName not in font:
+            raise KeyError("No glyph named %s in %s" % (glyphName, self.path))
+        glyph = font[glyphName]
+        return dict(glif=writeGlyphToString(glyphName, glyph, glyph.drawPoints))
+
+
+def _removeStaleSocket(socketPath):
+    # A socket left behind by a server that died can go. Anything else
+    # at this path is someone else's: a server that still answers,
+    # or a file that is not a socket at all.
+    try:
+        mode = os.stat(socketPath).st_mode
+    except OSError:
+        return
+    if not stat.S_ISSOCK(mode):
+        raise ufoProcessor.UFOProcessorError("Can't start a server at %s: the path exists and is not a socket." % socketPath)
+    s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        s.connect(socketPath)
+    except socket.error:
+        # nothing is listening
+        os.remove(socketPath)
+        return
+    finally:
+        s.close()
+    raise ufoProcessor.UFOProcessorError("Can't start a server at %s: another server is running there." % socketPath)
+
+
+class BuildServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """ Serves build requests for warm documents, one thread per connection.
+        Requests for the same designspace wait for each other.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, socketPath, options):
+        _removeStaleSocket(socketPath)
+        socketserver.UnixStreamServer.__init__(self, socketPath, _RequestHandler)
+        self.socketPath = socketPath
+        self.options = options
+        self.documents = {}
+        self._documentsLock = threading.Lock()
+        self.started = time.time()
+
+    def getDocument(self, path):
+        path = os.path.abspath(path)
+        with self._documentsLock:
+            document = self.documents.get(path)
+            if document is None:
+                document = self.documents[path] = WarmDocument(path, self.options)
+            return document
+
+    def handleRequest(self, request):
+        """ Do what the request asks, return the response dict."""
+        command = request.get("command")
+        response = dict(ok=True, problems=[], messages=[], error=None, timings={})
+        if command == "status":
+            response['documents'] = dict([(path, dict(builds=document.builds, glyphNames=len(document.processor.glyphNames) if document.processor else 0)) for path, document in self.documents.items()])
+            response['uptime'] = time.time() - self.started
+            return response
+        if command == "stop":
+            threading.Thread(target=self.shutdown).start()
+            return response
+        if command not in ("build", "glyph"):
+            response['ok'] = False
+            response['error'] = "Unknown command: %s" % command
+            return response
+        document = self.getDocument(request['document'])
+        with document.lock:
+            try:
+                start = time.time()
+                response['reloaded'] = document.refresh()
+                response['timings']['refresh'] = time.time() - start
+                # hand over the problems and messages of loading, a processor
+                # that lives this long should not keep collecting them
+                response['problems'] = list(document.processor.problems)
+                response['messages'] = list(document.processor.messages)
+                del document.processor.problems[:]
+                del document.processor.messages[:]
+                start = time.time()
+                with document.processor.collectProblems(messages=response['messages']) as problems:
+                    if command == "build":
+                        response.update(document.build(request.get("instances"), request.get("glyphs")))
+                    else:
+                        response.update(document.makeGlyph(request['glyph'], request.get("instance"), request.get("location")))
+                response['timings'][command] = time.time() - start
+                response['problems'] += problems
+            except Exception:
+                response['ok'] = False
+                response['error'] = traceback.format_exc()
+        return response
+
+    def server_close(self):
+        socketserver.UnixStreamServer.server_close(self)
+        if os.path.exists(self.socketPath):
+            os.remove(self.socketPath)
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        line = self.rfile.readline()
+        if not line:
+            # closed without a request, someone checking that the server is up
+            return
+        try:
+            request = json.loads(line.decode("utf-8"))
+        except ValueError:
+            response = dict(ok=False, problems=[], messages=[], error="Not a json request: %r" % line)
+        else:
+            response = self.server.handleRequest(request)
+        self.wfile.write((json.dumps(response) + "\n").encode("utf-8"))
+
+
+def sendRequest(request, socketPath=None, timeout=None):
+    """ Send one request to a running server and return its response."""
+    if socketPath is None:
+        socketPath = defaultSocketPath()
+    s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    s.settimeout(timeout)
+    try:
+        s.connect(socketPath)
+        s.sendall((json.dumps(request) + "\n").encode("utf-8"))
+        f = s.makefile("rb")
+        try:
+            return json.loads(f.readline().decode("utf-8"))
+        finally:
+            f.close()
+    finally:
+        s.close()
+
+
+def serve(socketPath=None, options=None):
+    """ Run a server until it gets a stop request."""
+    if socketPath is None:
+        socketPath = defaultSocketPath()
+    if options is None:
+        options = makeParser().parse_args(["serve"])
+    server = BuildServer(socketPath, options)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+
+
+def _parseLocation(values):
+    location = {}
+    for value in values or []:
+        axisName, axisValue = value.split("=", 1)
+        location[axisName] = float(axisValue)
+    return location
+
+
+def makeParser():
+    parser = argparse.ArgumentParser(prog="ufoprocessor-daemon", description="Keep designspaces loaded and build them on request.")
+    parser.add_argument("-s", "--socket", dest="socketPath", metavar="PATH", help="the Unix socket to serve on or talk to (default: %s)" % defaultSocketPath())
+    commands = parser.add_subparsers(dest="command")
+    serveParser = commands.add_parser("serve", help="run the server")
+    serveParser.add_argument("-w", "--workers", type=int, default=1, help="number of processes to interpolate glyphs with (default: 1)")
+    serveParser.add_argument("-e", "--engine", choices=["mutatormath", "varlib"], default="mutatormath", help="the interpolation engine (default: mutatormath)")
+    serveParser.add_argument("-u", "--ufo-version", dest="ufoVersion", type=int, choices=[2, 3], default=3, help="UFO format of the instances (default: 3)")
+    serveParser.add_argument("-f", "--format", dest="outputFormat", choices=["ufo", "ttf", "otf"], default="ufo", help="save the instances as UFOs, or compile them to TrueType or CFF fonts (default: ufo)")
+    serveParser.add_argument("--no-rules", dest="processRules", action="store_false", help="do not process the designspace rules")
+    serveParser.add_argument("--no-round", dest="roundGeometry", action="store_false", help="do not round the geometry")
+    serveParser.add_argument("--compact-kerning", dest="compactKerning", action="store_true", help="remove kerning pairs that do not change the instance kerning")
+    serveParser.add_argument("--incremental-save", dest="incrementalSave", action="store_true", help="only write the files of existing instances that changed")
+    serveParser.add_argument("--fast-masters", dest="fastMasterReading", action="store_true", help="read the master glyphs straight from the glif files")
+    buildParser = commands.add_parser("build", help="generate the instances of a designspace")
+    buildParser.add_argument("documentPath")
+    buildParser.add_argument("-i", "--instance", action="append", dest="instanceNames", metavar="NAME", help="only generate the instance with this name, or stylename. Can be used more than once.")
+    buildParser.add_argument("-g", "--glyphs", help="only generate these glyphs, separated by commas or spaces")
+    glyphParser = commands.add_parser("glyph", help="print the glif of one glyph at an instance or a location")
+    glyphParser.add_argument("documentPath")
+    glyphParser.add_argument("glyphName")
+    glyphParser.add_argument("-i", "--instance", dest="instanceName", metavar="NAME", help="the instance name, or stylename")
+    glyphParser.add_argument("-l", "--location", action="append", metavar="AXIS=VALUE", help="a location on an axis, can be used more than once")
+    commands.add_parser("status", help="show the documents the server keeps")
+    commands.add_parser("stop", help="stop the server")
+    return parser
+
+
+def main(args=None):
+    options = makeParser().parse_args(args)
+    socketPath = options.socketPath or defaultSocketPath()
+    if options.command == "serve":
+        try:
+            serve(socketPath, options)
+        except ufoProcessor.UFOProcessorError as error:
+            print(error.args[0], file=sys.stderr)
+            return 2
+        return 0
+    if options.command == "build":
+        request = dict(command="build", document=os.path.abspath(options.documentPath), instances=options.instanceNames)
+        if options.glyphs:
+            request['glyphs'] = [name for name in options.glyphs.replace(",", " ").split()]
+    elif options.command == "glyph":
+        request = dict(command="glyph", document=os.path.abspath(options.documentPath), glyph=options.glyphName, instance=options.instanceName, location=_parseLocation(options.location) or None)
+    elif options.command in ("status", "stop"):
+        request = dict(command=options.command)
+    else:
+        makeParser().print_usage(sys.stderr)
+        return 2
+    try:
+        response = sendRequest(request, socketPath)
+    except socket.error as error:
+        print("No ufoprocessor server at %s: %s" % (socketPath, error), file=sys.stderr)
+        return 2
+    for message in response.get("problems", []):
+        print(message, file=sys.stderr)
+    if response.get("error"):
+        print(response['error'], file=sys.stderr)
+        return 2
+    if "glif" in response:
+        print(response['glif'])
+    elif options.command == "status":
+        print(json.dumps(response, indent=2, sort_keys=True))
+    if response.get("problems"):
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,383 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function, division, absolute_import
+
+import re
+import math
+
+from fontTools.fontBuilder import FontBuilder
+from fontTools.ttLib import newTable
+from fontTools.ttLib.tables._c_m_a_p import cmap_format_4
+from fontTools.pens.ttGlyphPen import TTGlyphPen
+from fontTools.pens.t2CharStringPen import T2CharStringPen
+from fontTools.pens.boundsPen import BoundsPen
+
+"""
+    Compile an instance font straight into a binary font with fontTools.
+
+    generateUFO writes the instances as UFOs, and a font compiler reads
+    them back to make the binaries. With DesignSpaceProcessor.outputFormat
+    set to "ttf" or "otf" the UFO is skipped: each instance that
+    makeInstance makes in memory goes through compileInstanceFont:
+
+        - outlines: TrueType glyf with cubics converted to quadratics,
+          or CFF charstrings. Components stay components in glyf
+          and are decomposed in CFF.
+        - metrics: hmtx, hhea, OS/2, head, post from the font info
+        - names: the name table from the font info
+        - cmap from the unicodes
+        - kerning: a kern feature in GPOS, the kerning groups as classes.
+          The features text of the instance is compiled as well.
+
+    The cubic to quadratic conversion needs cu2qu, which is part of
+    fontTools from version 4 on and a separate package before that.
+    It is only imported for TrueType output, without it compiling a ttf
+    raises UFOProcessorError. See canCompileTrueType.
+
+    This makes plain, unhinted fonts for proofing and testing, it is not
+    a replacement for everything a complete font compiler does.
+"""
+
+# the largest distance between the cubic and its quadratic, in units per em
+QUADRATIC_MAX_ERROR = 0.001
+NOTDEF = ".notdef"
+
+
+def _getCu2QuPen():
+    try:
+        from fontTools.pens.cu2quPen import Cu2QuPen
+    except ImportError:
+        try:
+            from cu2qu.pens import Cu2QuPen
+        except ImportError:
+            from ufoProcessor import UFOProcessorError
+            raise UFOProcessorError("TrueType output needs cu2qu: install fontTools 4 or later, or the cu2qu package.")
+    return Cu2QuPen
+
+
+def canCompileTrueType():
+    """ True if the cubic to quadratic conversion for ttf output is available."""
+    try:
+        _getCu2QuPen()
+    except Exception:
+        return False
+    return True
+
+
+def _round(value):
+    return int(math.floor(value + 0.5))
+
+
+def _get(info, attribute, default=None):
+    value = getattr(info, attribute, None)
+    if value is None:
+        return default
+    return value
+
+
+def _getGlyphOrder(font):
+    # the glyph order of the font, with .notdef first.
+    glyphOrder = [glyphName for glyphName in font.lib.get('public.glyphOrder', []) if glyphName in font]
+    inOrder = set(glyphOrder)
+    glyphOrder += sorted([glyphName for glyphName in font.keys() if glyphName not in inOrder])
+    if NOTDEF in glyphOrder:
+        glyphOrder.remove(NOTDEF)
+    return [NOTDEF] + glyphOrder
+
+
+def _getCharacterMap(font, glyphOrder):
+    cmap = {}
+    for glyphName in glyphOrder:
+        if glyphName not in font:
+            continue
+        for unicode in font[glyphName].unicodes:
+            if unicode not in cmap:
+                cmap[unicode] = glyphName
+    return cmap
+
+
+class _GlyphSet(object):
+    # The glyphs of the font for the pens, with an empty .notdef if there is none.
+
+    def __init__(self, font, notdefWidth):
+        self.font = font
+        self.notdefWidth = notdefWidth
+
+    def __contains__(self, glyphName):
+        return glyphName in self.font or glyphName == NOTDEF
+
+    def __getitem__(self, glyphName):
+        if glyphName not in self.font and glyphName == NOTDEF:
+            return _EmptyGlyph(self.notdefWidth)
+        return self.font[glyphName]
+
+    def keys(self):
+        return list(self.font.keys())
+
+
+class _EmptyGlyph(object):
+
+    def __init__(self, width):
+        self.width = width
+        self.unicodes = []
+
+    def draw(self, pen):
+        pass
+
+
+def _emptyCharacterMap():
+    table = newTable("cmap")
+    table.tableVersion = 0
+    subtable = cmap_format_4(4)
+    subtable.platformID = 3
+    subtable.platEncID = 1
+    subtable.language = 0
+    subtable.cmap = {}
+    table.tables = [subtable]
+    return table
+
+
+def _compileGlyf(builder, glyphSet, glyphOrder, unitsPerEm):
+    # glyf with quadratic outlines, returns {glyphName: xMin}
+    Cu2QuPen = _getCu2QuPen()
+    maxError = QUADRATIC_MAX_ERROR * unitsPerEm
+    glyphs = {}
+    for glyphName in glyphOrder:
+        pen = TTGlyphPen(glyphSet)
+        glyphSet[glyphName].draw(Cu2QuPen(pen, maxError, reverse_direction=True))
+        glyphs[glyphName] = pen.glyph()
+    builder.setupGlyf(glyphs)
+    glyf = builder.font['glyf']
+    return dict([(glyphName, getattr(glyf[glyphName], "xMin", 0)) for glyphName in glyphOrder])
+
+
+def _compileCFF(builder, glyphSet, glyphOrder, info, psName):
+    # CFF charstrings, returns {glyphName: xMin}
+    charStrings = {}
+    leftMargins = {}
+    for glyphName in glyphOrder:
+        glyph = glyphSet[glyphName]
+        width = _round(glyph.width)
+        pen = T2CharStringPen(width, glyphSet)
+        glyph.draw(pen)
+        charStrings[glyphName] = pen.getCharString()
+        boundsPen = BoundsPen(glyphSet)
+        glyph.draw(boundsPen)
+        if boundsPen.bounds is None:
+            leftMargins[glyphName] = 0
+        else:
+            leftMargins[glyphName] = _round(boundsPen.bounds[0])
+    fontInfo = dict(
+        FullName=_get(info, "postscriptFullName", psName),
+        FamilyName=_get(info, "familyName", psName),
+        Weight=_get(info, "postscriptWeightName", "Regular"),
+        version="%d.%03d" % (_get(info, "versionMajor", 0), _get(info, "versionMinor", 0)),
+        isFixedPitch=bool(_get(info, "postscriptIsFixedPitch", False)),
+        ItalicAngle=_get(info, "italicAngle", 0),
+        UnderlinePosition=_get(info, "postscriptUnderlinePosition", 0),
+        UnderlineThickness=_get(info, "postscriptUnderlineThickness", 0),
+        )
+    if _get(info, "copyright") is not None:
+        fontInfo['Notice'] = info.copyright
+    privateDict = dict(defaultWidthX=0, nominalWidthX=0)
+    for attribute, key in [
+            ("postscriptBlueValues", "BlueValues"),
+            ("postscriptOtherBlues", "OtherBlues"),
+            ("postscriptFamilyBlues", "FamilyBlues"),
+            ("postscriptFamilyOtherBlues", "FamilyOtherBlues"),
+            ("postscriptStemSnapH", "StemSnapH"),
+            ("postscriptStemSnapV", "StemSnapV"),
+            ]:
+        values = _get(info, attribute)
+        if values:
+            privateDict[key] = [_round(value) for value in values]
+    if privateDict.get("StemSnapH"):
+        privateDict['StdHW'] = privateDict['StemSnapH'][0]
+    if privateDict.get("StemSnapV"):
+        privateDict['StdVW'] = privateDict['StemSnapV'][0]
+    for attribute, key in [("postscriptBlueFuzz", "BlueFuzz"), ("postscriptBlueShift", "BlueShift"), ("postscriptBlueScale", "BlueScale"), ("postscriptForceBold", "ForceBold")]:
+        value = _get(info, attribute)
+        if value is not None:
+            privateDict[key] = value
+    builder.setupCFF(psName, fontInfo, charStrings, privateDict)
+    return leftMargins
+
+
+def _featureName(name):
+    # a glyphname or class name that the feature file syntax accepts
+    return re.sub(r"[^A-Za-z0-9_.]", "_", name)
+
+
+def makeKerningFeature(font, glyphOrder):
+    """ Return feature file text with a kern feature for the kerning of this font.
+        Glyph pairs come first, then pairs with a glyph and a group as enum pairs,
+        then the group pairs.
+    """
+    glyphs = set(glyphOrder)
+    classNames = {}
+    lines = []
+    for groupName in sorted(font.groups.keys()):
+        if not groupName.startswith(("public.kern1.", "public.kern2.", "@MMK_")):
+            continue
+        members = [glyphName for glyphName in font.groups[groupName] if glyphName in glyphs]
+        if not members:
+            continue
+        className = "@" + _featureName(groupName)
+        while className in classNames.values():
+            className += "_"
+        classNames[groupName] = className
+        lines.append("%s = [%s];" % (className, " ".join(["\\" + glyphName for glyphName in members])))
+    glyphPairs = []
+    enumPairs = []
+    classPairs = []
+    for (first, second), value in sorted(font.kerning.items()):
+        firstIsGroup = first in font.groups
+        secondIsGroup = second in font.groups
+        if (firstIsGroup and first not in classNames) or (secondIsGroup and second not in classNames):
+            continue
+        if (not firstIsGroup and first not in glyphs) or (not secondIsGroup and second not in glyphs):
+            continue
+        names = [classNames[first] if firstIsGroup else "\\" + first, classNames[second] if secondIsGroup else "\\" + second]
+        pair = "pos %s %s %d;" % (names[0], names[1], _round(value))
+        if firstIsGroup and secondIsGroup:
+            classPairs.append(pair)
+        elif firstIsGroup or secondIsGroup:
+            enumPairs.append("enum " + pair)
+        else:
+            glyphPairs.append(pair)
+    pairs = glyphPairs + enumPairs + classPairs
+    if not pairs:
+        return ""
+    lines.append("feature kern {")
+    lines += ["    " + pair for pair in pairs]
+    lines.append("} kern;")
+    return "\n".join(lines) + "\n"
+
+
+def _getNames(info, psName):
+    familyName = _get(info, "familyName", "")
+    styleName = _get(info, "styleName", "")
+    styleMapFamilyName = _get(info, "styleMapFamilyName", familyName)
+    styleMapStyleName = _get(info, "styleMapStyleName", "regular")
+    version = "Version %d.%03d" % (_get(info, "versionMajor", 0), _get(info, "versionMinor", 0))
+    names = dict(
+        familyName=styleMapFamilyName or familyName,
+        styleName=(styleMapStyleName or "regular").title(),
+        uniqueFontIdentifier=_get(info, "openTypeNameUniqueID", "%s;%s" % (version[8:], psName)),
+        fullName="%s %s" % (familyName, styleName),
+        version=_get(info, "openTypeNameVersion", version),
+        psName=psName,
+        )
+    if names['familyName'] != familyName or names['styleName'] != styleName:
+        names['typographicFamily'] = _get(info, "openTypeNamePreferredFamilyName", familyName)
+        names['typographicSubfamily'] = _get(info, "openTypeNamePreferredSubfamilyName", styleName)
+    for attribute, nameID in [
+            ("copyright", "copyright"),
+            ("trademark", "trademark"),
+            ("openTypeNameManufacturer", "manufacturer"),
+            ("openTypeNameDesigner", "designer"),
+            ("openTypeNameDescription", "description"),
+            ("openTypeNameManufacturerURL", "vendorURL"),
+            ("openTypeNameDesignerURL", "designerURL"),
+            ("openTypeNameLicense", "licenseDescription"),
+            ("openTypeNameLicenseURL", "licenseInfoURL"),
+            ("openTypeNameSampleText", "sampleText"),
+            ]:
+        value = _get(info, attribute)
+        if value:
+            names[nameID] = value
+    return names
+
+
+def _bits(values):
+    # a list of bit numbers as an integer
+    result = 0
+    for value in values or []:
+        result |= 1 << value
+    return result
+
+
+def compileInstanceFont(font, format="ttf", featuresPath=None, problems=None):
+    """ Compile a font object, for instance one from DesignSpaceProcessor.makeInstance,
+        into a fontTools TTFont. format is "ttf" for TrueType outlines, "otf" for CFF.
+        featuresPath: where the features text would be, for resolving includes.
+        Problems with the features are added to the problems list, the font is
+        then compiled without them.
+    """
+    if format not in ("ttf", "otf"):
+        raise ValueError("Unknown binary format %r, use ttf or otf." % format)
+    if problems is None:
+        problems = []
+    info = font.info
+    unitsPerEm = _round(_get(info, "unitsPerEm", 1000))
+    ascender = _round(_get(info, "ascender", unitsPerEm * 0.8))
+    descender = _round(_get(info, "descender", -unitsPerEm * 0.2))
+    psName = _get(info, "postscriptFontName") or _featureName(("%s-%s" % (_get(info, "familyName", ""), _get(info, "styleName", ""))).replace(" ", ""))
+    glyphOrder = _getGlyphOrder(font)
+    glyphSet = _GlyphSet(font, _round(unitsPerEm * 0.5))
+
+    builder = FontBuilder(unitsPerEm, isTTF=format == "ttf")
+    builder.setupGlyphOrder(glyphOrder)
+    cmap = _getCharacterMap(font, glyphOrder)
+    if cmap:
+        builder.setupCharacterMap(cmap)
+    else:
+        # the builder can't make an empty cmap
+        builder.font['cmap'] = _emptyCharacterMap()
+    if format == "ttf":
+        leftMargins = _compileGlyf(builder, glyphSet, glyphOrder, unitsPerEm)
+    else:
+        leftMargins = _compileCFF(builder, glyphSet, glyphOrder, info, psName)
+    metrics = dict([(glyphName, (max(0, _round(glyphSet[glyphName].width)), leftMargins[glyphName])) for glyphName in glyphOrder])
+    builder.setupHorizontalMetrics(metrics)
+    builder.setupHorizontalHeader(
+        ascent=_round(_get(info, "openTypeHheaAscender", ascender)),
+        descent=_round(_get(info, "openTypeHheaDescender", descender)),
+        lineGap=_round(_get(info, "openTypeHheaLineGap", 0)),
+        caretSlopeRise=_get(info, "openTypeHheaCaretSlopeRise", 1),
+        caretSlopeRun=_get(info, "openTypeHheaCaretSlopeRun", 0),
+        caretOffset=_round(_get(info, "openTypeHheaCaretOffset", 0)),
+        )
+    builder.setupNameTable(_getNames(info, psName))
+    fsSelection = _bits(_get(info, "openTypeOS2Selection", []))
+    styleMapStyleName = _get(info, "styleMapStyleName", "regular")
+    if styleMapStyleName in ("bold", "bold italic"):
+        fsSelection |= 1 << 5
+    if styleMapStyleName in ("italic", "bold italic"):
+        fsSelection |= 1 << 0
+    if styleMapStyleName == "regular":
+        fsSelection |= 1 << 6
+    os2 = dict(
+        usWeightClass=_get(info, "openTypeOS2WeightClass", 400),
+        usWidthClass=_get(info, "openTypeOS2WidthClass", 5),
+        fsSelection=fsSelection,
+        sTypoAscender=_round(_get(info, "openTypeOS2TypoAscender", ascender)),
+        sTypoDescender=_round(_get(info, "openTypeOS2TypoDescender", descender)),
+        sTypoLineGap=_round(_get(info, "openTypeOS2TypoLineGap", 0)),
+        usWinAscent=_round(_get(info, "openTypeOS2WinAscent", ascender)),
+        usWinDescent=abs(_round(_get(info, "openTypeOS2WinDescent", -descender))),
+        sxHeight=_round(_get(info, "xHeight", 0)),
+        sCapHeight=_round(_get(info, "capHeight", 0)),
+        achVendID=(_get(info, "openTypeOS2VendorID", "NONE") + "    ")[:4],
+        )
+    if _get(info, "openTypeOS2Type") is not None:
+        os2['fsType'] = _bits(info.openTypeOS2Type)
+    builder.setupOS2(**os2)
+    builder.setupPost(
+        italicAngle=_get(info, "italicAngle", 0),
+        underlinePosition=_round(_get(info, "postscriptUnderlinePosition", 0)),
+        underlineThickness=_round(_get(info, "postscriptUnderlineThickness", 0)),
+        isFixedPitch=int(bool(_get(info, "postscriptIsFixedPitch", False))),
+        )
+    builder.updateHead(fontRevision=_get(info, "versionMajor", 0) + _get(info, "versionMinor", 0) / 1000)
+    kerningFeature = makeKerningFeature(font, glyphOrder)
+    featuresText = getattr(getattr(font, "features", None), "text", None) or ""
+    if featuresText.strip():
+        try:
+            builder.addOpenTypeFeatures(featuresText + "\n" + kerningFeature, filename=featuresPath)
+            kerningFeature = None
+        except Exception as error:
+            problems.append("Could not compile the features of %s, only the kerning is compiled: %s" % (psName, error))
+    if kerningFeature:
+        builder.addOpenTypeFeatures(kerningFeature)
+    return builder.font
@@ -0,0 +1,396 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function, division, absolute_import
+
+import os
+import zipfile
+import collections
+import plistlib
+import multiprocessing
+
+from ufoLib.glifLib import readGlyphFromString
+from fontMath.mathGlyph import MathGlyph, MathGlyphPen, _expandImage
+from fontMath.mathGuideline import _expandGuideline
+
+"""
+    Read only access to the glyphs of a master UFO, for interpolation.
+
+    The masters are only read to make MathGlyphs. Opening them as defcon
+    glyphs first means building contours, points, anchors and all the
+    notification machinery, only to throw it away again. GlyphReader
+    parses the .glif data straight into MathGlyph objects:
+
+        reader = GlyphReader("master.ufo")
+        mathGlyph = reader.getMathGlyph("a")
+        mathGlyph = reader.getMathGlyph("a", layerName="support")
+
+    Glyphs are parsed when they are asked for. preload() parses a batch
+    of glyphs in worker processes. Both UFO folders and .ufoz files work.
+
+    DesignSpaceProcessor uses this for collectMastersForGlyph when
+    fastMasterReading is True.
+
+    defcon can't open a .ufoz. For those sources the processor uses a
+    ReaderFont: the info, kerning, groups, lib and features are read into a
+    font without glyphs, the glyphnames and layers come from the GlyphReader.
+"""
+
+DEFAULT_LAYER_NAME = "public.default"
+DEFAULT_GLYPHS_DIRNAME = "glyphs"
+
+
+def _loadPlist(data):
+    if hasattr(plistlib, "loads"):
+        return plistlib.loads(data)
+    return plistlib.readPlistFromString(data)
+
+
+class _UFOFiles(object):
+    # The files of a UFO folder, or of a zipped .ufoz.
+
+    def __init__(self, path):
+        self.path = path
+        self._zip = None
+        self._root = ""
+        if os.path.isfile(path):
+            self._openZip()
+            names = self._zip.namelist()
+            if "metainfo.plist" not in names:
+                # the UFO is in a folder in the zip
+                for name in names:
+                    parts = name.split("/")
+                    if len(parts) == 2 and parts[1] == "metainfo.plist":
+                        self._root = parts[0] + "/"
+                        break
+            self._zipInfo = dict([(info.filename, info) for info in self._zip.infolist()])
+
+    def _openZip(self):
+        self._zip = zipfile.ZipFile(self.path, "r")
+        self._pid = os.getpid()
+
+    def _zipName(self, relativePath):
+        return self._root + relativePath.replace(os.sep, "/")
+
+    def exists(self, relativePath):
+        if self._zip is not None:
+            return self._zipName(relativePath) in self._zipInfo
+        return os.path.exists(os.path.join(self.path, relativePath))
+
+    def read(self, relativePath):
+        if self._zip is not None:
+            if self._pid != os.getpid():
+                # a forked process shares the file position with its parent
+                self._openZip()
+            return self._zip.read(self._zipName(relativePath))
+        with open(os.path.join(self.path, relativePath), "rb") as f:
+            return f.read()
+
+    def size(self, relativePath):
+        if self._zip is not None:
+            return self._zipInfo[self._zipName(relativePath)].file_size
+        return os.path.getsize(os.path.join(self.path, relativePath))
+
+    def readPlist(self, relativePath, default=None):
+        if not self.exists(relativePath):
+            return default
+        return _loadPlist(self.read(relativePath))
+
+    def close(self):
+        if self._zip is not None:
+            self._zip.close()
+            self._zip = None
+
+
+def readUFOPlist(ufoPath, fileName, default=None):
+    """ Read a plist file from a UFO folder or a .ufoz file."""
+    files = _UFOFiles(ufoPath)
+    try:
+        return files.readPlist(fileName, default)
+    finally:
+        files.close()
+
+
+class _GlifAttributes(object):
+    # readGlyphFromString sets the glyph attributes on this.
+
+    def __init__(self):
+        self.width = 0
+        self.height = 0
+        self.unicodes = []
+        self.note = None
+        self.lib = {}
+        self.image = None
+        self.guidelines = []
+        self.anchors = []
+
+
+def parseGlif(data, glyphName=None, mathGlyphClass=MathGlyph):
+    """ Parse .glif data into a new MathGlyph.
+        The result is the same as making the MathGlyph from a defcon glyph.
+    """
+    mathGlyph = mathGlyphClass(None)
+    attributes = _GlifAttributes()
+    pen = MathGlyphPen(mathGlyph)
+    readGlyphFromString(data, glyphObject=attributes, pointPen=pen, validate=False)
+    mathGlyph.name = glyphName
+    mathGlyph.width = attributes.width
+    mathGlyph.height = attributes.height
+    mathGlyph.unicodes = list(attributes.unicodes)
+    mathGlyph.note = attributes.note
+    mathGlyph.lib = attributes.lib
+    mathGlyph.image = _expandImage(attributes.image)
+    mathGlyph.guidelines = [_expandGuideline(guideline) for guideline in attributes.guidelines]
+    mathGlyph.anchors = [dict(anchor) for anchor in attributes.anchors]
+    return mathGlyph
+
+
+class GlyphReader(object):
+    """ Read only access to the glyphs in the layers of a UFO folder or .ufoz file."""
+
+    mathGlyphClass = MathGlyph
+
+    def __init__(self, path):
+        self.path = path
+        self._files = _UFOFiles(path)
+        metaInfo = self._files.readPlist("metainfo.plist", {})
+        self.formatVersion = metaInfo.get("formatVersion")
+        layerContents = self._files.readPlist("layercontents.plist")
+        if layerContents is None:
+            # UFO 2 only has the default layer
+            layerContents = [[DEFAULT_LAYER_NAME, DEFAULT_GLYPHS_DIRNAME]]
+        self._layerDirectories = collections.OrderedDict(layerContents)
+        self.defaultLayerName = DEFAULT_LAYER_NAME
+        for layerName, directory in layerContents:
+            if directory == DEFAULT_GLYPHS_DIRNAME:
+                self.defaultLayerName = layerName
+        self._contents = {}
+        self._preloaded = {}
+
+    def _get_layerNames(self):
+        return list(self._layerDirectories.keys())
+
+    layerNames = property(_get_layerNames, doc="list of the layer names, in order")
+
+    def hasLayer(self, layerName):
+        return layerName in self._layerDirectories
+
+    def _getContents(self, layerName):
+        # glyphName: relative path of the glif file, read once per layer
+        if layerName is None:
+            layerName = self.defaultLayerName
+        contents = self._contents.get(layerName)
+        if contents is None:
+            directory = self._layerDirectories[layerName]
+            fileNames = self._files.readPlist(os.path.join(directory, "contents.plist"), {})
+            contents = dict([(glyphName, os.path.join(directory, fileName)) for glyphName, fileName in fileNames.items()])
+            self._contents[layerName] = contents
+        return contents
+
+    def keys(self, layerName=None):
+        """ The glyphnames in this layer, the default layer if layerName is None."""
+        return list(self._getContents(layerName).keys())
+
+    def contains(self, glyphName, layerName=None):
+        return glyphName in self._getContents(layerName)
+
+    def getGlyphCost(self, glyphName, layerName=None):
+        # the size of the glif file is a fair estimate of the work for this glyph
+        relativePath = self._getContents(layerName).get(glyphName)
+        if relativePath is None:
+            return 0
+        return self._files.size(relativePath)
+
+    def getMathGlyph(self, glyphName, layerName=None):
+        """ Return a new MathGlyph for this glyph, None if the layer doesn't have it."""
+        if layerName is None:
+            layerName = self.defaultLayerName
+        key = (glyphName, layerName)
+        if key in self._preloaded:
+            # parsed by preload, hand it over
+            return self._preloaded.pop(key)
+        relativePath = self._getContents(layerName).get(glyphName)
+        if relativePath is None:
+            return None
+        return parseGlif(self._files.read(relativePath), glyphName, self.mathGlyphClass)
+
+    def readPlist(self, fileName, default=None):
+        """ Read a plist file from the UFO, default if it isn't there."""
+        return self._files.readPlist(fileName, default)
+
+    def readText(self, fileName, default=None):
+        """ Read a text file from the UFO as unicode, default if it isn't there."""
+        if not self._files.exists(fileName):
+            return default
+        return self._files.read(fileName).decode("utf-8")
+
+    def getGlyphSet(self, layerName=None):
+        """ Looks enough like a layer for the DecomposePointPen."""
+        return _GlyphReaderGlyphSet(self, layerName)
+
+    def _getPreloadTodo(self, glyphNames, layerName):
+        # (glyphName, layerName, relativePath) for the glyphs that still need parsing
+        if layerName is None:
+            layerName = self.defaultLayerName
+        contents = self._getContents(layerName)
+        if glyphNames is None:
+            glyphNames = list(contents.keys())
+        return [(glyphName, layerName, contents[glyphName]) for glyphName in glyphNames if glyphName in contents and (glyphName, layerName) not in self._preloaded]
+
+    def preload(self, glyphNames=None, layerName=None, workers=None):
+        """ Parse these glyphs in worker processes, ahead of getMathGlyph.
+            Each parsed glyph is handed out once.
+        """
+        preloadGlyphs([(self, glyphNames, layerName)], workers=workers)
+
+    def close(self):
+        self._preloaded = {}
+        self._files.close()
+
+
+def preloadGlyphs(requests, workers=None):
+    """ Parse glyphs of several readers in one pool of worker processes.
+        requests: list of (reader, glyphNames, layerName) tuples.
+        glyphNames None means all glyphs in the layer.
+    """
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+    chunks = []
+    for index, (reader, glyphNames, layerName) in enumerate(requests):
+        todo = reader._getPreloadTodo(glyphNames, layerName)
+        for i in range(workers * 4):
+            if todo[i::workers * 4]:
+                chunks.append((index, reader.path, reader.mathGlyphClass, todo[i::workers * 4]))
+    if not chunks:
+        return
+    pool = None
+    if workers > 1:
+        try:
+            pool = multiprocessing.get_context("fork").Pool(workers)
+        except (AttributeError, ValueError):
+            pool = None
+    if pool is None:
+        results = [_parseGlifChunk(chunk) for chunk in chunks]
+    else:
+        try:
+            results = pool.map(_parseGlifChunk, chunks)
+        finally:
+            pool.close()
+            pool.join()
+    for index, chunkResults in results:
+        reader = requests[index][0]
+        for glyphName, layerName, mathGlyph in chunkResults:
+            reader._preloaded[(glyphName, layerName)] = mathGlyph
+
+
+def _parseGlifChunk(args):
+    # Parse a chunk of glif files in a worker process.
+    index, path, mathGlyphClass, todo = args
+    files = _UFOFiles(path)
+    try:
+        return index, [(glyphName, layerName, parseGlif(files.read(relativePath), glyphName, mathGlyphClass)) for glyphName, layerName, relativePath in todo]
+    finally:
+        files.close()
+
+
+class _GlyphReaderGlyphSet(object):
+    # Looks enough like a layer for the DecomposePointPen.
+
+    def __init__(self, reader, layerName):
+        self._reader = reader
+        self._layerName = layerName
+        self._glyphs = {}
+
+    def __contains__(self, glyphName):
+        return self._reader.contains(glyphName, self._layerName)
+
+    def __getitem__(self, glyphName):
+        if glyphName not in self._glyphs:
+            self._glyphs[glyphName] = self._reader.getMathGlyph(glyphName, self._layerName)
+        return self._glyphs[glyphName]
+
+
+class _ReaderFontLayer(object):
+    # Looks enough like a defcon layer for the glyph index.
+
+    def __init__(self, reader, layerName):
+        self._reader = reader
+        self.name = layerName
+
+    def keys(self):
+        return self._reader.keys(self.name)
+
+    def __contains__(self, glyphName):
+        return self._reader.contains(glyphName, self.name)
+
+    def __getitem__(self, glyphName):
+        if glyphName not in self:
+            raise KeyError(glyphName)
+        return self._reader.getMathGlyph(glyphName, self.name)
+
+
+class _ReaderFontLayers(object):
+
+    def __init__(self, reader):
+        self._reader = reader
+
+    def __contains__(self, layerName):
+        return self._reader.hasLayer(layerName)
+
+    def __getitem__(self, layerName):
+        if layerName not in self:
+            raise KeyError(layerName)
+        return _ReaderFontLayer(self._reader, layerName)
+
+    def __iter__(self):
+        for layerName in self._reader.layerNames:
+            yield _ReaderFontLayer(self._reader, layerName)
+
+
+class ReaderFont(object):
+    """ Looks enough like a defcon font for DesignSpaceProcessor, for a source
+        defcon can't open. font is an empty font object that gets the info,
+        kerning, groups, lib and features. The glyphs are MathGlyphs from the reader.
+    """
+
+    def __init__(self, reader, font):
+        self.reader = reader
+        self.path = reader.path
+        self.info = font.info
+        self.kerning = font.kerning
+        self.groups = font.groups
+        self.lib = font.lib
+        self.features = font.features
+        self.layers = _ReaderFontLayers(reader)
+        self._defaultLayer = _ReaderFontLayer(reader, None)
+        for attr, value in reader.readPlist("fontinfo.plist", {}).items():
+            setattr(self.info, attr, value)
+        kerning = {}
+        for first, seconds in reader.readPlist("kerning.plist", {}).items():
+            for second, value in seconds.items():
+                kerning[first, second] = value
+        self.kerning.update(kerning)
+        self.groups.update(reader.readPlist("groups.plist", {}))
+        self.lib.update(reader.readPlist("lib.plist", {}))
+        self.features.text = reader.readText("features.fea")
+
+    def _get_guidelines(self):
+        return self.info.guidelines
+
+    guidelines = property(_get_guidelines, doc="the font guidelines, like a defcon font")
+
+    def _get_glyphOrder(self):
+        return list(self.lib.get("public.glyphOrder", []))
+
+    glyphOrder = property(_get_glyphOrder)
+
+    def keys(self):
+        return self._defaultLayer.keys()
+
+    def __contains__(self, glyphName):
+        return glyphName in self._defaultLayer
+
+    def __getitem__(self, glyphName):
+        return self._defaultLayer[glyphName]
+
+    def __len__(self):
+        return len(self.keys())
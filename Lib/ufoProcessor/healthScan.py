@@ -0,0 +1,267 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function, division, absolute_import
+
+import math
+import time
+import itertools
+from array import array
+
+"""
+    Check the interpolation of glyphs over a dense grid of locations,
+    not only at the instances.
+
+        report = scanInterpolation(processor, steps=9)
+        for glyphName, score, count in report['glyphs'][:10]:
+            print(glyphName, score, count)
+
+    For each glyph the mutator is evaluated for all locations in one batch.
+    The instances are flattened to coordinate arrays and compared with the
+    glyph at the default location:
+
+        direction       a contour runs the other way
+        kink            a smooth point is no longer smooth
+        intersection    a contour crosses itself where it did not before
+        width           the advance width jumps between neighbouring locations
+
+    Intersections are checked on the control polygon, that is cheap and
+    good enough to find contours that fold over.
+"""
+
+DIRECTION = "direction"
+KINK = "kink"
+INTERSECTION = "intersection"
+WIDTH = "width"
+
+_severity = {
+    DIRECTION: 1.0,
+    INTERSECTION: 0.8,
+    KINK: 0.5,
+    WIDTH: 0.3,
+}
+
+
+def makeLocationGrid(axes, steps=5):
+    """ Return a list of locations with steps values on each axis, from minimum to maximum.
+        axes: list of axis descriptors. The last axis changes fastest.
+    """
+    values = []
+    for axis in axes:
+        if steps < 2 or axis.minimum == axis.maximum:
+            values.append([axis.default])
+            continue
+        step = (axis.maximum - axis.minimum) / (steps - 1)
+        values.append([axis.minimum + i * step for i in range(steps)])
+    names = [axis.name for axis in axes]
+    return [dict(zip(names, combination)) for combination in itertools.product(*values)]
+
+
+def findNeighbours(locations):
+    """ Return (axisName, i, j) for the pairs of locations that differ on
+        this axis only, with no other location in between.
+    """
+    axisNames = set()
+    for location in locations:
+        axisNames.update(location.keys())
+    axisNames = sorted(axisNames)
+    pairs = []
+    for axisName in axisNames:
+        others = [name for name in axisNames if name != axisName]
+        lines = {}
+        for i, location in enumerate(locations):
+            key = tuple([location.get(name) for name in others])
+            lines.setdefault(key, []).append((location.get(axisName), i))
+        for line in lines.values():
+            line.sort()
+            for (value1, i), (value2, j) in zip(line[:-1], line[1:]):
+                if value1 != value2:
+                    pairs.append((axisName, i, j))
+    return pairs
+
+
+class FlatGlyph(object):
+    """ The points of a MathGlyph in flat coordinate arrays. """
+
+    def __init__(self, mathGlyph):
+        self.xs = array("d")
+        self.ys = array("d")
+        self.onCurve = []
+        self.smooth = []
+        self.contours = []  # (start, end) indices for each contour
+        for contour in mathGlyph.contours:
+            start = len(self.xs)
+            for segmentType, (x, y), smooth, name, identifier in contour["points"]:
+                self.xs.append(x)
+                self.ys.append(y)
+                self.onCurve.append(segmentType is not None)
+                self.smooth.append(smooth)
+            self.contours.append((start, len(self.xs)))
+        self.width = mathGlyph.width or 0
+
+    def contourArea(self, index):
+        # signed area of the control polygon, the sign is the direction
+        start, end = self.contours[index]
+        xs = self.xs
+        ys = self.ys
+        area = 0
+        for i in range(start, end):
+            j = i + 1 if i + 1 < end else start
+            area += xs[i] * ys[j] - xs[j] * ys[i]
+        return area / 2
+
+    def pointAngle(self, i, index):
+        # angle in degrees between the incoming and outgoing direction at point i
+        start, end = self.contours[index]
+        count = end - start
+        if count < 3:
+            return None
+        previous = start + (i - start - 1) % count
+        following = start + (i - start + 1) % count
+        ax = self.xs[i] - self.xs[previous]
+        ay = self.ys[i] - self.ys[previous]
+        bx = self.xs[following] - self.xs[i]
+        by = self.ys[following] - self.ys[i]
+        if (ax == 0 and ay == 0) or (bx == 0 and by == 0):
+            return None
+        return abs(math.degrees(math.atan2(ax * by - ay * bx, ax * bx + ay * by)))
+
+    def countIntersections(self, index):
+        # count the crossings of non adjacent segments of the control polygon
+        start, end = self.contours[index]
+        count = end - start
+        if count < 4:
+            return 0
+        xs = self.xs
+        ys = self.ys
+        segments = []
+        for n in range(count):
+            i = start + n
+            j = start + (n + 1) % count
+            segments.append((min(xs[i], xs[j]), max(xs[i], xs[j]), n, i, j))
+        # sweep over x, only compare segments whose x ranges overlap
+        segments.sort()
+        crossings = 0
+        active = []
+        for segment in segments:
+            xMin = segment[0]
+            active = [other for other in active if other[1] >= xMin]
+            for other in active:
+                difference = abs(segment[2] - other[2])
+                if difference <= 1 or difference == count - 1:
+                    # neighbours share a point
+                    continue
+                if _segmentsCross(xs, ys, segment[3], segment[4], other[3], other[4]):
+                    crossings += 1
+            active.append(segment)
+        return crossings
+
+
+def _orientation(ax, ay, bx, by, cx, cy):
+    value = (bx - ax) * (cy - ay) - (by - ay) * (cx - ax)
+    if value > 0:
+        return 1
+    if value < 0:
+        return -1
+    return 0
+
+
+def _segmentsCross(xs, ys, a, b, c, d):
+    o1 = _orientation(xs[a], ys[a], xs[b], ys[b], xs[c], ys[c])
+    o2 = _orientation(xs[a], ys[a], xs[b], ys[b], xs[d], ys[d])
+    o3 = _orientation(xs[c], ys[c], xs[d], ys[d], xs[a], ys[a])
+    o4 = _orientation(xs[c], ys[c], xs[d], ys[d], xs[b], ys[b])
+    return o1 * o2 < 0 and o3 * o4 < 0
+
+
+def checkGlyph(reference, flat, kinkAngle=10):
+    """ Compare the FlatGlyph at one location with the reference FlatGlyph.
+        Returns a list of (check, detail) tuples.
+    """
+    found = []
+    if len(flat.contours) != len(reference.contours):
+        return found
+    for index in range(len(flat.contours)):
+        referenceArea = reference.contourArea(index)
+        area = flat.contourArea(index)
+        if referenceArea * area < 0:
+            found.append((DIRECTION, "contour %d" % index))
+        start, end = flat.contours[index]
+        for i in range(start, end):
+            if not (flat.onCurve[i] and flat.smooth[i]):
+                continue
+            angle = flat.pointAngle(i, index)
+            referenceAngle = reference.pointAngle(i, index)
+            if angle is None or referenceAngle is None:
+                continue
+            if referenceAngle < kinkAngle <= angle:
+                found.append((KINK, "contour %d point %d, %3.1f degrees" % (index, i - start, angle)))
+        crossings = flat.countIntersections(index)
+        if crossings > reference.countIntersections(index):
+            found.append((INTERSECTION, "contour %d, %d crossings" % (index, crossings)))
+    return found
+
+
+def scanInterpolation(processor, locations=None, steps=5, glyphNames=None, kinkAngle=10, widthJumpFactor=4, minimumWidthJump=10):
+    """ Check the glyphs of the processor at many locations.
+        locations: list of location dicts, default is a grid with steps values per axis.
+        glyphNames: the glyphs to check, default is all.
+        kinkAngle: smooth points that bend more than this many degrees are kinks.
+        widthJumpFactor, minimumWidthJump: width changes between neighbouring
+            locations that are more than widthJumpFactor times the median change,
+            on the same axis, and more than minimumWidthJump units, are jumps.
+            Neighbours differ on one axis only, with no other location in between.
+        Returns a dict with:
+            problems: list of dicts with glyphName, location, check, detail and
+                severity, most severe first.
+            glyphs: list of (glyphName, score, problem count), worst first.
+    """
+    start = time.time()
+    processor.loadFonts()
+    processor.findDefault()
+    if locations is None:
+        locations = makeLocationGrid(processor.axes, steps)
+    if glyphNames is None:
+        glyphNames = processor.glyphNames
+    # the reference is the glyph of the default source, at the location the
+    # mutators are built around. Not newDefaultLocation(): that goes through
+    # the axis maps, and can land outside the axes.
+    if processor.default is not None:
+        defaultLocation = dict(processor.default.location)
+    else:
+        defaultLocation = dict(processor.defaultLoc)
+    neighbours = findNeighbours(locations)
+    problems = []
+    for glyphName in glyphNames:
+        try:
+            mutator = processor.getGlyphMutator(glyphName)
+        except Exception:
+            mutator = None
+        if mutator is None:
+            continue
+        todo = [defaultLocation] + list(locations)
+        if hasattr(mutator, "makeInstances"):
+            instances = mutator.makeInstances(todo)
+        else:
+            instances = [mutator.makeInstance(location) for location in todo]
+        flatGlyphs = [FlatGlyph(instance) for instance in instances]
+        reference = flatGlyphs[0]
+        flatGlyphs = flatGlyphs[1:]
+        for location, flat in zip(locations, flatGlyphs):
+            for check, detail in checkGlyph(reference, flat, kinkAngle=kinkAngle):
+                problems.append(dict(glyphName=glyphName, location=location, check=check, detail=detail, severity=_severity[check]))
+        # compare the width changes along each axis with the median change on that axis
+        jumps = {}
+        for axisName, i, j in neighbours:
+            jumps.setdefault(axisName, []).append((abs(flatGlyphs[j].width - flatGlyphs[i].width), j))
+        for axisJumps in jumps.values():
+            median = sorted([jump for jump, j in axisJumps])[len(axisJumps) // 2]
+            for jump, j in axisJumps:
+                if jump > minimumWidthJump and jump > widthJumpFactor * median:
+                    problems.append(dict(glyphName=glyphName, location=locations[j], check=WIDTH, detail="width changes %3.1f" % jump, severity=_severity[WIDTH]))
+    problems.sort(key=lambda problem: (-problem['severity'], problem['glyphName']))
+    scores = {}
+    for problem in problems:
+        score, count = scores.get(problem['glyphName'], (0, 0))
+        scores[problem['glyphName']] = (score + problem['severity'], count + 1)
+    glyphs = sorted([(glyphName, score, count) for glyphName, (score, count) in scores.items()], key=lambda item: (-item[1], item[0]))
+    return dict(problems=problems, glyphs=glyphs, locations=len(locations), glyphsScanned=len(glyphNames), seconds=time.time() - start)
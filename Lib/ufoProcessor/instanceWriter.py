@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function, division, absolute_import
+
+import time
+import threading
+import traceback
+
+try:
+    import queue
+except ImportError:
+    # py2
+    import Queue as queue
+
+"""
+    Save instance fonts on background threads while the next ones are made.
+
+    DesignSpaceProcessor.generateUFO hands each finished instance to an
+    InstanceWriter. One or more writer threads take the fonts from a bounded
+    queue and save them with processor.saveInstanceFont. When the queue is
+    full, put() waits for a writer, so there are never more than
+    queueSize + workers finished fonts waiting to be written.
+
+    If a save fails the error is kept, the fonts that are still queued are
+    not written, and the error is raised in the thread that makes the
+    instances: by the next put(), or by close().
+"""
+
+
+class InstanceWriter(object):
+
+    def __init__(self, processor, workers=1, queueSize=2):
+        self.processor = processor
+        self.error = None
+        self._timings = []
+        # the problems and messages of the thread that makes the instances,
+        # the writers add theirs to the same lists.
+        self._problems = processor.problems
+        self._messages = processor.messages
+        self._queue = queue.Queue(maxsize=max(1, queueSize))
+        self._count = 0
+        self._closed = False
+        self._threads = []
+        for i in range(max(1, workers)):
+            thread = threading.Thread(target=self._work, name="ufoProcessor instance writer %d" % i)
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def _get_timings(self):
+        return [timing for index, timing in sorted(self._timings, key=lambda item: item[0])]
+
+    timings = property(_get_timings, doc="timings of the saved instances, in the order they were put")
+
+    def put(self, instanceDescriptor, font, makeTime=None):
+        """ Queue this font to be saved to instanceDescriptor.path.
+            Waits while the queue is full. Raises the error of a failed save.
+        """
+        self._raiseError()
+        self._queue.put((self._count, instanceDescriptor, font, makeTime))
+        self._count += 1
+
+    def close(self, raiseError=True):
+        """ Wait for the queued fonts to be saved and stop the writers.
+            Raises the first error a writer ran into, unless raiseError is False.
+        """
+        if not self._closed:
+            self._closed = True
+            for thread in self._threads:
+                self._queue.put(None)
+            for thread in self._threads:
+                thread.join()
+        if raiseError:
+            self._raiseError()
+
+    def _raiseError(self):
+        if self.error is not None:
+            raise self.error
+
+    def _work(self):
+        processor = self.processor
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            if self.error is not None:
+                # something went wrong, don't write the rest
+                continue
+            index, instanceDescriptor, font, makeTime = item
+            start = time.time()
+            messages = []
+            with processor.collectProblems(messages=messages) as problems:
+                try:
+                    saved = processor.saveInstanceFont(font, instanceDescriptor.path)
+                except Exception as error:
+                    problems.append("Could not save %s. %s" % (instanceDescriptor.path, traceback.format_exc()))
+                    if self.error is None:
+                        self.error = error
+                    saved = False
+            self._problems.extend(problems)
+            self._messages.extend(messages)
+            if saved:
+                self._timings.append((index, dict(name=instanceDescriptor.name, path=instanceDescriptor.path, makeInstance=makeTime, save=time.time()-start)))
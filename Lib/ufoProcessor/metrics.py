@@ -0,0 +1,261 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function, division, absolute_import
+
+import time
+import traceback
+
+from fontTools.pens.boundsPen import BoundsPen
+from fontMath.mathFunctions import _roundNumber
+
+"""
+    Interpolate only the metrics of the glyphs, the kerning and the font info
+    at many locations, for spacing and text layout proofs.
+
+        tables = makeMetrics(processor, locations)
+        for glyphName in tables['glyphNames']:
+            print(glyphName, tables['widths'][glyphName])
+
+    No outlines are interpolated. For each glyph the advance width and the
+    horizontal bounds of the masters are interpolated as one small vector,
+    with the same engine the processor uses for the glyphs, and evaluated at
+    all locations in one batch. The sidebearings come from the interpolated
+    bounds. These are close to the sidebearings of the interpolated outline,
+    but not always the same: the extremes of a curve can move along it.
+    Components are decomposed to find the bounds.
+
+    The kerning and the vertical metrics come from the kerning and info
+    mutators of the processor.
+"""
+
+infoMetricsAttributes = [
+    "unitsPerEm",
+    "ascender",
+    "descender",
+    "xHeight",
+    "capHeight",
+    "italicAngle",
+    "openTypeHheaAscender",
+    "openTypeHheaDescender",
+    "openTypeHheaLineGap",
+    "openTypeOS2TypoAscender",
+    "openTypeOS2TypoDescender",
+    "openTypeOS2TypoLineGap",
+    "openTypeOS2WinAscent",
+    "openTypeOS2WinDescent",
+    "postscriptUnderlinePosition",
+    "postscriptUnderlineThickness",
+]
+
+
+class MetricsVector(object):
+    """ A few numbers that the mutators can calculate with:
+        the width, and the minimum and maximum x of the bounds.
+    """
+
+    def __init__(self, values):
+        self.values = tuple(values)
+
+    def __repr__(self):
+        return "<MetricsVector %s>" % (self.values,)
+
+    def __add__(self, other):
+        return self.__class__([a + b for a, b in zip(self.values, other.values)])
+
+    def __sub__(self, other):
+        return self.__class__([a - b for a, b in zip(self.values, other.values)])
+
+    def __mul__(self, factor):
+        if isinstance(factor, tuple):
+            # anisotropic factor, these metrics are horizontal
+            factor = factor[0]
+        return self.__class__([a * factor for a in self.values])
+
+    __rmul__ = __mul__
+
+    def __truediv__(self, factor):
+        if isinstance(factor, tuple):
+            factor = factor[0]
+        return self.__class__([a / factor for a in self.values])
+
+    __div__ = __truediv__
+
+    def __eq__(self, other):
+        return isinstance(other, MetricsVector) and self.values == other.values
+
+    def __ne__(self, other):
+        return not self == other
+
+    def copy(self):
+        return self.__class__(self.values)
+
+
+class _MetricsInfo(object):
+    # receives the attributes of an interpolated MathInfo
+    pass
+
+
+def _getBounds(mathGlyph):
+    pen = BoundsPen(None)
+    mathGlyph.draw(pen)
+    return pen.bounds
+
+
+def collectMetricsMasters(processor, glyphName):
+    """ Return a list of (location, width, bounds) for the masters of this glyph.
+        bounds is None for a glyph without outlines.
+        The defcon glyphs have their bounds cached, other masters are drawn.
+    """
+    if processor._masterData is not None:
+        return [(loc, mathGlyph.width, _getBounds(mathGlyph)) for loc, mathGlyph, sourceInfo in processor.collectMastersForGlyph(glyphName, decomposeComponents=True)]
+    items = []
+    for sourceDescriptor, layerName in processor.getGlyphIndex().get(glyphName, []):
+        if sourceDescriptor.name in processor._glyphReaders:
+            loc, mathGlyph, sourceInfo = processor._collectGlyphMaster(sourceDescriptor, layerName, glyphName, decomposeComponents=True)
+            items.append((loc, mathGlyph.width, _getBounds(mathGlyph)))
+            continue
+        with processor._fontsLock:
+            font = processor.fonts[sourceDescriptor.name]
+            if layerName is None:
+                layer = font
+            else:
+                layer = font.layers[layerName]
+            glyph = layer[glyphName]
+            items.append((sourceDescriptor.location, glyph.width, glyph.bounds))
+    return items
+
+
+def getMetricsMutator(processor, glyphName):
+    """ Return a mutator for the metrics of this glyph, and True if it has sidebearings.
+        Returns None, False if there are no masters.
+    """
+    masters = collectMetricsMasters(processor, glyphName)
+    if not masters:
+        return None, False
+    hasBounds = [bounds is not None for loc, width, bounds in masters]
+    withBounds = all(hasBounds)
+    if any(hasBounds) and not withBounds:
+        processor.problems.append("Glyph %s has outlines in some masters and not in others, no sidebearings." % glyphName)
+    items = []
+    for loc, width, bounds in masters:
+        if withBounds:
+            items.append((loc, MetricsVector((width, bounds[0], bounds[2]))))
+        else:
+            items.append((loc, MetricsVector((width,))))
+    if processor._isStatic(items):
+        return processor.getStaticMutator(items[0][1]), withBounds
+    result = processor.getVariationModel(items, axes=processor.serializedAxes, bias=processor.defaultLoc)
+    if result is None:
+        return None, False
+    bias, mutator = result
+    return mutator, withBounds
+
+
+def makeMetrics(processor, locations, glyphNames=None, kerning=True, info=True):
+    """ Interpolate the metrics at all these locations in one go.
+        locations: list of location dicts. Anisotropic locations are split
+            the way makeInstance splits them, so the metrics match the instances.
+        glyphNames: the glyphs, default is all.
+        kerning, info: False to leave out the kerning or the font info.
+        With roundGeometry on the processor, the widths and sidebearings are rounded.
+        Returns a dict with:
+            locations: the locations.
+            glyphNames: the glyphnames.
+            widths, leftMargins, rightMargins: for each glyphname a list of values,
+                one for each location. The sidebearings are None for glyphs without outlines.
+            kerningPairs: the kerning pairs of all locations, sorted.
+            kerning: for each pair a list of values, one for each location.
+                The value is None where the pair is not in the kerning at that
+                location. With kerningCompaction that means the pair falls back
+                to its group kerning, so it is not the same as 0.
+            groups: the kerning groups.
+            info: for each attribute in infoMetricsAttributes a list of values,
+                one for each location.
+        The values are columns like the widths, so the pairs and attributes
+        are stored once and not again for every location.
+            time: the number of seconds it took.
+    """
+    start = time.time()
+    processor.loadFonts()
+    processor.findDefault()
+    if glyphNames is None:
+        glyphNames = processor.glyphNames
+    locations = list(locations)
+    horizontalLocations = []
+    verticalLocations = []
+    for location in locations:
+        if processor.isAnisotropic(location):
+            horizontal, vertical = processor.splitAnisotropic(location)
+        else:
+            horizontal = vertical = location
+        horizontalLocations.append(horizontal)
+        verticalLocations.append(vertical)
+    # makeInstance takes the x of anisotropic glyphs from the second value
+    glyphLocations = verticalLocations
+    tables = dict(locations=locations, glyphNames=list(glyphNames), widths={}, leftMargins={}, rightMargins={}, kerningPairs=[], kerning={}, groups={}, info={})
+    for glyphName in glyphNames:
+        try:
+            mutator, withBounds = getMetricsMutator(processor, glyphName)
+        except:
+            processor.problems.append("Could not make metrics for glyph %s %s" % (glyphName, traceback.format_exc()))
+            continue
+        if mutator is None:
+            continue
+        if hasattr(mutator, "makeInstances"):
+            vectors = mutator.makeInstances(glyphLocations)
+        else:
+            vectors = [mutator.makeInstance(location) for location in glyphLocations]
+        widths = []
+        leftMargins = []
+        rightMargins = []
+        for vector in vectors:
+            values = vector.values
+            if processor.roundGeometry:
+                values = [_roundNumber(value) for value in values]
+            widths.append(values[0])
+            if withBounds:
+                leftMargins.append(values[1])
+                rightMargins.append(values[0] - values[2])
+            else:
+                leftMargins.append(None)
+                rightMargins.append(None)
+        tables['widths'][glyphName] = widths
+        tables['leftMargins'][glyphName] = leftMargins
+        tables['rightMargins'][glyphName] = rightMargins
+    if kerning:
+        from ufoProcessor import compactKerning
+        try:
+            kerningMutator = processor.getKerningMutator()
+            columns = tables['kerning']
+            for index, location in enumerate(horizontalLocations):
+                kerningObject = kerningMutator.makeInstance(location)
+                pairs = dict(kerningObject.items())
+                if processor.kerningCompaction:
+                    compactKerning(pairs, kerningObject.groups(), threshold=processor.kerningThreshold)
+                for pair, value in pairs.items():
+                    if pair not in columns:
+                        columns[pair] = [None] * len(locations)
+                    columns[pair][index] = value
+                tables['groups'] = kerningObject.groups()
+            tables['kerningPairs'] = sorted(columns)
+        except:
+            processor.problems.append("Could not make kerning metrics. %s" % traceback.format_exc())
+    if info:
+        try:
+            infoMutator = processor.getInfoMutator()
+            columns = tables['info']
+            for attr in infoMetricsAttributes:
+                columns[attr] = []
+            for location, horizontal, vertical in zip(locations, horizontalLocations, verticalLocations):
+                if horizontal is vertical:
+                    infoObject = infoMutator.makeInstance(location)
+                else:
+                    infoObject = (1, 0) * infoMutator.makeInstance(horizontal) + (0, 1) * infoMutator.makeInstance(vertical)
+                extracted = _MetricsInfo()
+                infoObject.extractInfo(extracted)
+                for attr in infoMetricsAttributes:
+                    columns[attr].append(getattr(extracted, attr, None))
+        except:
+            processor.problems.append("Could not make info metrics. %s" % traceback.format_exc())
+    tables['time'] = time.time() - start
+    return tables
@@ -0,0 +1,315 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function, division, absolute_import
+
+import os
+import sys
+import json
+import time
+import shutil
+import hashlib
+import tempfile
+import argparse
+import traceback
+
+from defcon import Font
+
+import ufoProcessor
+from ufoProcessor.atomicSave import _listFiles, _sameContents
+
+"""
+    Split the build of one designspace over several machines.
+
+    1.  Make a manifest of the work. A unit is an instance, or a range of
+        glyphs of an instance. The units are spread over the shards by
+        their estimated cost.
+
+            makeManifest("family.designspace", "manifest.json", shardCount=4, glyphChunkSize=500)
+
+    2.  Each machine runs one shard, and writes a partial UFO for every
+        unit to a local folder, plus a shard report.
+
+            runShard("manifest.json", 0, "out/shard0")
+
+    3.  Collect the shard folders in one place and merge them into the
+        instances. The rules are processed after merging, on the complete
+        font. With verify=True the merged instances are compared, file by
+        file, with the instances of a single generateUFO run.
+
+            report = mergeShards("manifest.json", ["out/shard0", "out/shard1", ...], verify=True)
+
+    The same steps are available from the command line:
+
+        python -m ufoProcessor.shards manifest family.designspace manifest.json --shards 4
+        python -m ufoProcessor.shards run manifest.json 0 out/shard0
+        python -m ufoProcessor.shards merge manifest.json out/shard0 out/shard1 --verify
+"""
+
+MANIFEST_FORMAT = 1
+SHARD_LIB_KEY = "com.letterror.ufoProcessor.shard"
+
+
+def _makeProcessor(manifest):
+    processor = ufoProcessor.DesignSpaceProcessor(ufoVersion=manifest['ufoVersion'], useVarlib=manifest['useVarlib'])
+    processor.roundGeometry = manifest['roundGeometry']
+    processor.read(manifest['documentPath'])
+    return processor
+
+
+def readManifest(manifestPath):
+    with open(manifestPath) as f:
+        manifest = json.load(f)
+    if manifest.get('format') != MANIFEST_FORMAT:
+        raise ufoProcessor.UFOProcessorError("Unknown shard manifest format in %s" % manifestPath)
+    return manifest
+
+
+def makeManifest(documentPath, manifestPath=None, shardCount=1, glyphChunkSize=None, useVarlib=False, ufoVersion=3, roundGeometry=True, processRules=True):
+    """ Make a manifest of the work for generating the instances in this designspace.
+        glyphChunkSize: if set, each instance is split in units of this many glyphs.
+        Writes the manifest as json to manifestPath if given, returns the manifest dict.
+    """
+    processor = ufoProcessor.DesignSpaceProcessor(ufoVersion=ufoVersion, useVarlib=useVarlib)
+    processor.read(documentPath)
+    processor.loadFonts()
+    processor.findDefault()
+    glyphNames = processor.glyphNames
+    # glyphs that are muted in every source have no masters, and are not made
+    glyphIndex = processor.getGlyphIndex()
+    mutedGlyphNames = [glyphName for glyphName in glyphNames if glyphName not in glyphIndex]
+    # the instances get their glyph order from a copied lib, or the glyphnames
+    instanceGlyphOrder = glyphNames
+    for sourceDescriptor in processor.sources:
+        f = processor.fonts.get(sourceDescriptor.name)
+        if sourceDescriptor.copyLib and f is not None and 'public.glyphOrder' in f.lib:
+            instanceGlyphOrder = None
+    if glyphChunkSize:
+        chunks = [glyphNames[i:i+glyphChunkSize] for i in range(0, len(glyphNames), glyphChunkSize)]
+    else:
+        chunks = [None]
+    costs = dict([(glyphName, processor._estimateGlyphCost(glyphName)) for glyphName in glyphNames])
+    units = []
+    for instanceIndex, instanceDescriptor in enumerate(processor.instances):
+        if instanceDescriptor.path is None:
+            continue
+        for chunkIndex, chunk in enumerate(chunks):
+            cost = sum([costs[glyphName] for glyphName in (chunk or glyphNames)])
+            units.append(dict(
+                instance=instanceIndex,
+                instanceName=instanceDescriptor.name,
+                chunk=chunkIndex,
+                glyphs=chunk,
+                cost=cost,
+                ))
+    # the most expensive units first, each to the shard with the least work so far
+    shardCosts = [0] * max(1, shardCount)
+    for unit in sorted(units, key=lambda unit: -unit['cost']):
+        shardIndex = shardCosts.index(min(shardCosts))
+        unit['shard'] = shardIndex
+        shardCosts[shardIndex] += unit['cost']
+    # outputs of another manifest in the same folders can't be mistaken for ours
+    manifestId = hashlib.sha1(json.dumps([os.path.abspath(documentPath), useVarlib, ufoVersion, roundGeometry, processRules, glyphNames, units], sort_keys=True).encode("utf-8")).hexdigest()[:12]
+    for index, unit in enumerate(units):
+        unit['name'] = "%s-unit%04d" % (manifestId, index)
+    manifest = dict(
+        format=MANIFEST_FORMAT,
+        manifestId=manifestId,
+        documentPath=os.path.abspath(documentPath),
+        useVarlib=useVarlib,
+        ufoVersion=ufoVersion,
+        roundGeometry=roundGeometry,
+        processRules=processRules,
+        glyphNames=glyphNames,
+        mutedGlyphNames=mutedGlyphNames,
+        instanceGlyphOrder=instanceGlyphOrder,
+        shardCount=len(shardCosts),
+        units=units,
+        )
+    if manifestPath is not None:
+        with open(manifestPath, "w") as f:
+            json.dump(manifest, f, indent=1, sort_keys=True)
+    return manifest
+
+
+def runShard(manifestPath, shardIndex, outputFolder, workers=1):
+    """ Generate the units of this shard as partial UFOs in outputFolder.
+        The rules are not processed yet, that happens when merging.
+        Writes a <manifestId>-shard<index>.json report to outputFolder and returns it.
+    """
+    manifest = readManifest(manifestPath)
+    processor = _makeProcessor(manifest)
+    processor.workers = workers
+    if not os.path.exists(outputFolder):
+        os.makedirs(outputFolder)
+    report = dict(shard=shardIndex, units=[], problems=[], error=None)
+    try:
+        processor.loadFonts()
+        processor.findDefault()
+        for unit in manifest['units']:
+            if unit['shard'] != shardIndex:
+                continue
+            start = time.time()
+            instanceDescriptor = processor.instances[unit['instance']]
+            font = processor.makeInstance(instanceDescriptor, doRules=False, glyphNames=unit['glyphs'])
+            font.lib[SHARD_LIB_KEY] = unit['name']
+            path = os.path.join(outputFolder, unit['name'] + ".ufo")
+            if os.path.exists(path):
+                shutil.rmtree(path)
+            font.save(path, processor.ufoVersion)
+            report['units'].append(dict(name=unit['name'], seconds=time.time() - start))
+    except Exception:
+        report['error'] = traceback.format_exc()
+    report['problems'] = list(processor.problems)
+    with open(os.path.join(outputFolder, "%s-shard%d.json" % (manifest['manifestId'], shardIndex)), "w") as f:
+        json.dump(report, f, indent=1, sort_keys=True)
+    return report
+
+
+def _findUnit(unitName, shardFolders):
+    for folder in shardFolders:
+        path = os.path.join(folder, unitName + ".ufo")
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def mergeShards(manifestPath, shardFolders, verify=False):
+    """ Assemble the partial UFOs in the shard folders into the instances.
+        Raises UFOProcessorError if units are missing.
+        verify: compare the results with a single generateUFO run.
+        Returns a dict with the generated paths, the problems reported by
+        the shards, and with verify, the differences per instance.
+    """
+    manifest = readManifest(manifestPath)
+    missing = [unit['name'] for unit in manifest['units'] if _findUnit(unit['name'], shardFolders) is None]
+    if missing:
+        raise ufoProcessor.UFOProcessorError("Missing shard output for %d units: %s" % (len(missing), ", ".join(missing)))
+    report = dict(generated=[], problems=[], differences=None)
+    for folder in shardFolders:
+        for fileName in sorted(os.listdir(folder)):
+            if fileName.startswith(manifest['manifestId'] + "-shard") and fileName.endswith(".json"):
+                with open(os.path.join(folder, fileName)) as f:
+                    shardReport = json.load(f)
+                report['problems'].extend(shardReport['problems'])
+                if shardReport['error']:
+                    report['problems'].append(shardReport['error'])
+    processor = _makeProcessor(manifest)
+    # the rules apply to all glyphnames, as in a single run
+    processor.glyphNames = manifest['glyphNames']
+    unitsPerInstance = {}
+    for unit in manifest['units']:
+        unitsPerInstance.setdefault(unit['instance'], []).append(unit)
+    for instanceIndex in sorted(unitsPerInstance.keys()):
+        instanceDescriptor = processor.instances[instanceIndex]
+        units = sorted(unitsPerInstance[instanceIndex], key=lambda unit: unit['chunk'])
+        font = Font(_findUnit(units[0]['name'], shardFolders))
+        for unit in units[1:]:
+            part = Font(_findUnit(unit['name'], shardFolders))
+            for glyph in part:
+                font.insertGlyph(glyph, name=glyph.name)
+        # check that every glyph the manifest asks for made it
+        expected = set()
+        for unit in units:
+            if unit['glyphs'] is None:
+                expected.update(manifest['glyphNames'])
+            else:
+                expected.update(unit['glyphs'])
+        expected.difference_update(manifest.get('mutedGlyphNames', []))
+        lost = sorted(expected - set(font.keys()))
+        if lost:
+            raise ufoProcessor.UFOProcessorError("Incomplete merge for %s, %d glyphs missing: %s" % (instanceDescriptor.name, len(lost), ", ".join(lost)))
+        del font.lib[SHARD_LIB_KEY]
+        if manifest['instanceGlyphOrder'] is not None:
+            font.lib['public.glyphOrder'] = manifest['instanceGlyphOrder']
+        if manifest['processRules']:
+            processor.applyRules(font, instanceDescriptor.location)
+        if processor.saveInstanceFont(font, instanceDescriptor.path):
+            report['generated'].append(instanceDescriptor.path)
+    if verify:
+        report['differences'] = verifyShards(manifest, processor)
+    return report
+
+
+def verifyShards(manifest, processor=None):
+    """ Generate the instances in a single run in a temporary folder and compare
+        them with the instances made by the shards. Returns a dict with the
+        instance paths and the files that differ, are missing or are extra.
+        Instances that are identical are not in the dict.
+    """
+    if processor is None:
+        processor = _makeProcessor(manifest)
+    reference = _makeProcessor(manifest)
+    tempRoot = tempfile.mkdtemp(prefix="ufoProcessorVerify-")
+    differences = {}
+    try:
+        paths = {}
+        for instanceIndex, instanceDescriptor in enumerate(reference.instances):
+            if instanceDescriptor.path is None:
+                continue
+            paths[instanceIndex] = instanceDescriptor.path
+            instanceDescriptor.path = os.path.join(tempRoot, "%d-%s" % (instanceIndex, os.path.basename(instanceDescriptor.path)))
+        reference.generateUFO(processRules=manifest['processRules'])
+        for instanceIndex, path in paths.items():
+            referencePath = reference.instances[instanceIndex].path
+            referenceFiles = set(_listFiles(referencePath))
+            files = set(_listFiles(path)) if os.path.exists(path) else set()
+            different = sorted(referenceFiles ^ files)
+            for relativePath in sorted(referenceFiles & files):
+                if not _sameContents(os.path.join(referencePath, relativePath), os.path.join(path, relativePath)):
+                    different.append(relativePath)
+            if different:
+                differences[path] = different
+    finally:
+        shutil.rmtree(tempRoot, ignore_errors=True)
+    return differences
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(prog="ufoprocessor-shards", description="Split the generation of a designspace over several machines.")
+    commands = parser.add_subparsers(dest="command")
+    manifestParser = commands.add_parser("manifest", help="write a manifest of the work")
+    manifestParser.add_argument("documentPath")
+    manifestParser.add_argument("manifestPath")
+    manifestParser.add_argument("-s", "--shards", type=int, default=1, help="number of shards (default: 1)")
+    manifestParser.add_argument("-c", "--glyph-chunk-size", dest="glyphChunkSize", type=int, help="split the instances in units of this many glyphs")
+    manifestParser.add_argument("-e", "--engine", choices=["mutatormath", "varlib"], default="mutatormath")
+    manifestParser.add_argument("-u", "--ufo-version", dest="ufoVersion", type=int, choices=[2, 3], default=3)
+    manifestParser.add_argument("--no-rules", dest="processRules", action="store_false")
+    manifestParser.add_argument("--no-round", dest="roundGeometry", action="store_false")
+    runParser = commands.add_parser("run", help="generate the units of one shard")
+    runParser.add_argument("manifestPath")
+    runParser.add_argument("shard", type=int)
+    runParser.add_argument("outputFolder")
+    runParser.add_argument("-w", "--workers", type=int, default=1)
+    mergeParser = commands.add_parser("merge", help="merge the shard folders into the instances")
+    mergeParser.add_argument("manifestPath")
+    mergeParser.add_argument("shardFolders", nargs="+")
+    mergeParser.add_argument("--verify", action="store_true", help="compare with a single run")
+    options = parser.parse_args(args)
+    if options.command == "manifest":
+        manifest = makeManifest(options.documentPath, options.manifestPath, shardCount=options.shards, glyphChunkSize=options.glyphChunkSize, useVarlib=options.engine == "varlib", ufoVersion=options.ufoVersion, roundGeometry=options.roundGeometry, processRules=options.processRules)
+        print("%d units in %d shards" % (len(manifest['units']), manifest['shardCount']))
+        return 0
+    if options.command == "run":
+        report = runShard(options.manifestPath, options.shard, options.outputFolder, workers=options.workers)
+        if report['error']:
+            print(report['error'], file=sys.stderr)
+            return 2
+        return 0
+    if options.command == "merge":
+        try:
+            report = mergeShards(options.manifestPath, options.shardFolders, verify=options.verify)
+        except ufoProcessor.UFOProcessorError as error:
+            print(error, file=sys.stderr)
+            return 2
+        for path, different in sorted((report['differences'] or {}).items()):
+            print("%s differs from a single run: %s" % (path, ", ".join(different)), file=sys.stderr)
+        if report['differences']:
+            return 1
+        return 0
+    parser.print_help()
+    return 2
+
+
+if __name__ == "__main__":
+    sys.exit(main())
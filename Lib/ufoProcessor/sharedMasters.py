@@ -0,0 +1,350 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function, division, absolute_import
+
+import os
+import mmap
+import hashlib
+import pickle
+import struct
+import tempfile
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:
+    # py < 3.8, use a memory mapped file instead
+    shared_memory = None
+
+try:
+    _replace = os.replace
+except AttributeError:
+    # py2 has no os.replace. os.rename is atomic on posix.
+    _replace = os.rename
+
+"""
+    Master data packed into one flat buffer.
+
+    All glyph masters, the kerning and the font info of a loaded
+    DesignSpaceProcessor are pickled once into a single buffer:
+
+        magic, header length, data length, header, blob, blob, ...
+
+    The header maps each glyphname to the offset and length of its blob.
+    A blob holds the (location, mathObject, sourceInfo) items that
+    DesignSpaceProcessor.collectMastersForGlyph returns.
+
+    The buffer can live in a multiprocessing.shared_memory block, or in a
+    memory mapped file. Worker processes attach to it without copying the
+    whole thing, and only unpickle the blobs of the glyphs they work on.
+
+    A master snapshot is the same buffer saved to a file, with the
+    sources it was made from in the header: the source descriptors, and
+    the modification time, size and sha1 of every file in the source UFOs.
+    A later run maps the file and checks it against the sources. Files with
+    a different mtime but the same size are hashed again, so touching or
+    checking out unchanged files does not spoil the snapshot.
+"""
+
+MAGIC = b"UFOPMST1"
+# with releaseGlyphs, release the parsed glyphs after this many glyphs
+_releaseInterval = 100
+_headerStruct = struct.Struct("<QQ")
+
+
+def packMasterData(processor, glyphNames=None, snapshot=None, releaseGlyphs=False):
+    """ Pack the masters of the loaded fonts in processor into a bytes object.
+        snapshot: a description of the sources to keep in the header, see writeMasterSnapshot.
+        releaseGlyphs: let go of the parsed source glyphs along the way, for the low memory mode.
+    """
+    processor.loadFonts()
+    if glyphNames is None:
+        glyphNames = processor.glyphNames
+    blobs = []
+    offset = 0
+    header = dict(glyphs={}, kerning=None, info=None, glyphOrder=list(glyphNames), snapshot=snapshot)
+    def addBlob(items):
+        data = pickle.dumps(items, pickle.HIGHEST_PROTOCOL)
+        blobs.append(data)
+        position = (offset, len(data))
+        return position, offset + len(data)
+    for index, glyphName in enumerate(glyphNames):
+        header['glyphs'][glyphName], offset = addBlob(processor.collectMastersForGlyph(glyphName))
+        if releaseGlyphs and index % _releaseInterval == _releaseInterval - 1:
+            processor._releaseMasterGlyphs()
+    header['kerning'], offset = addBlob(processor.collectMastersForKerning())
+    header['info'], offset = addBlob(processor.collectMastersForInfo())
+    headerData = pickle.dumps(header, pickle.HIGHEST_PROTOCOL)
+    return MAGIC + _headerStruct.pack(len(headerData), offset) + headerData + b"".join(blobs)
+
+
+def _readSizes(buffer):
+    # Return the header length and the data length in a packed buffer.
+    if bytes(buffer[:len(MAGIC)]) != MAGIC:
+        raise ValueError("Not a packed master data buffer.")
+    start = len(MAGIC)
+    return _headerStruct.unpack(bytes(buffer[start:start+_headerStruct.size]))
+
+
+class MasterData(object):
+    """ Read access to packed master data in a bytes-like buffer.
+        Blobs are unpickled when they are asked for, the buffer is not copied.
+    """
+
+    def __init__(self, buffer):
+        self.buffer = memoryview(buffer)
+        headerLength, dataLength = _readSizes(self.buffer)
+        start = len(MAGIC) + _headerStruct.size
+        self.header = pickle.loads(self.buffer[start:start+headerLength].tobytes())
+        self._dataStart = start + headerLength
+
+    def _loadBlob(self, position):
+        offset, length = position
+        start = self._dataStart + offset
+        return pickle.loads(self.buffer[start:start+length])
+
+    def _get_glyphNames(self):
+        return list(self.header['glyphOrder'])
+
+    glyphNames = property(_get_glyphNames, doc="list of the glyphnames, in order")
+
+    def __contains__(self, glyphName):
+        return glyphName in self.header['glyphs']
+
+    def getGlyphItems(self, glyphName):
+        """ Return a list of (location, mathGlyph, sourceInfo) items for this glyph."""
+        position = self.header['glyphs'].get(glyphName)
+        if position is None:
+            return []
+        return self._loadBlob(position)
+
+    def getGlyphCost(self, glyphName):
+        # the size of the blob is a fair estimate of the work for this glyph
+        position = self.header['glyphs'].get(glyphName)
+        if position is None:
+            return 0
+        return position[1]
+
+    def getKerningItems(self):
+        """ Return a list of (location, mathKerning) items."""
+        return self._loadBlob(self.header['kerning'])
+
+    def getInfoItems(self):
+        """ Return a list of (location, mathInfo) items."""
+        return self._loadBlob(self.header['info'])
+
+    def release(self):
+        try:
+            self.buffer.release()
+        except (AttributeError, BufferError):
+            # py2 memoryviews can't be released,
+            # or there are still unpickled slices around.
+            pass
+
+
+class SharedMasterData(MasterData):
+    """ Packed master data in shared memory, or in a memory mapped file
+        if shared memory is not available. Make one in the parent process with
+        SharedMasterData.create(processor), attach to it in the workers with
+        SharedMasterData.attach(kind, name). kind is "memory" or "file".
+        The creator calls unlink() when done.
+    """
+
+    def __init__(self, name, shm=None, mappedFile=None, mapped=None, size=None):
+        self.name = name
+        if shm is not None:
+            self.kind = "memory"
+        else:
+            self.kind = "file"
+        self._shm = shm
+        self._mappedFile = mappedFile
+        self._mapped = mapped
+        if shm is not None:
+            self._view = shm.buf[:size]
+        else:
+            self._view = memoryview(mapped)
+        super(SharedMasterData, self).__init__(self._view)
+        self.size = size
+
+    @classmethod
+    def create(cls, processor, glyphNames=None, useFile=False, releaseGlyphs=False):
+        data = packMasterData(processor, glyphNames=glyphNames, releaseGlyphs=releaseGlyphs)
+        size = len(data)
+        if shared_memory is not None and not useFile:
+            shm = shared_memory.SharedMemory(create=True, size=size)
+            shm.buf[:size] = data
+            return cls(shm.name, shm=shm, size=size)
+        fd, path = tempfile.mkstemp(suffix=".ufoProcessorMasters")
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        return cls._attachFile(path)
+
+    @classmethod
+    def attach(cls, kind, name):
+        if kind == "file":
+            return cls._attachFile(name)
+        if kind != "memory":
+            raise ValueError("Unknown kind of shared master data: %r" % kind)
+        if shared_memory is None:
+            from ufoProcessor import UFOProcessorError
+            raise UFOProcessorError("Shared memory is not available in this python, can't attach to shared master data %s" % name)
+        try:
+            shm = shared_memory.SharedMemory(name=name, track=False)
+        except TypeError:
+            # py < 3.13 has no track argument
+            shm = shared_memory.SharedMemory(name=name)
+        # the shared block can be rounded up to the page size
+        # so the size is taken from the header.
+        headerLength, dataLength = _readSizes(shm.buf)
+        return cls(name, shm=shm, size=len(MAGIC) + _headerStruct.size + headerLength + dataLength)
+
+    @classmethod
+    def _attachFile(cls, path):
+        mappedFile = open(path, "rb")
+        mapped = mmap.mmap(mappedFile.fileno(), 0, access=mmap.ACCESS_READ)
+        return cls(path, mappedFile=mappedFile, mapped=mapped, size=len(mapped))
+
+    def close(self):
+        """ Detach from the shared data."""
+        self.release()
+        self._view.release()
+        if self._shm is not None:
+            self._shm.close()
+        if self._mapped is not None:
+            self._mapped.close()
+            self._mappedFile.close()
+
+    def unlink(self):
+        """ Close and remove the shared data. Only the creator should do this."""
+        self.close()
+        if self._shm is not None:
+            self._shm.unlink()
+        elif os.path.exists(self.name):
+            os.remove(self.name)
+
+
+def _digest(filePath):
+    with open(filePath, "rb") as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+def _describeSources(processor):
+    # The parts of the source descriptors that end up in the master data.
+    sources = []
+    for sd in processor.sources:
+        sources.append((
+            sd.name,
+            os.path.abspath(sd.path),
+            sorted(sd.location.items()),
+            sd.layerName,
+            sorted(sd.mutedGlyphNames),
+            sd.muteKerning,
+            sd.muteInfo,
+            ))
+    return sources
+
+
+def _fingerprintSource(path):
+    # relative path: (mtime, size, digest) for the files in a UFO folder,
+    # or for the one file of a .ufoz. None if the source is not there.
+    if not os.path.exists(path):
+        return None
+    if os.path.isfile(path):
+        st = os.stat(path)
+        return {"": (st.st_mtime, st.st_size, _digest(path))}
+    files = {}
+    for root, dirNames, fileNames in os.walk(path):
+        for fileName in fileNames:
+            filePath = os.path.join(root, fileName)
+            st = os.stat(filePath)
+            files[os.path.relpath(filePath, path)] = (st.st_mtime, st.st_size, _digest(filePath))
+    return files
+
+
+def _sourceIsUnchanged(path, fingerprint):
+    # Compare the files in the source with the fingerprint.
+    # Only the files with a different mtime are read again.
+    if fingerprint is None or not os.path.exists(path):
+        return fingerprint is None and not os.path.exists(path)
+    if os.path.isfile(path):
+        found = {"": path}
+    else:
+        found = {}
+        for root, dirNames, fileNames in os.walk(path):
+            for fileName in fileNames:
+                filePath = os.path.join(root, fileName)
+                found[os.path.relpath(filePath, path)] = filePath
+    if set(found.keys()) != set(fingerprint.keys()):
+        return False
+    for relativePath, filePath in found.items():
+        mtime, size, digest = fingerprint[relativePath]
+        st = os.stat(filePath)
+        if st.st_size != size:
+            return False
+        if st.st_mtime != mtime and _digest(filePath) != digest:
+            return False
+    return True
+
+
+def fingerprintSources(processor):
+    """ Describe the sources of processor and fingerprint their files,
+        for writeMasterSnapshot. Take it before anything is read from the sources.
+    """
+    snapshot = dict(sources=_describeSources(processor), files={})
+    for sd in processor.sources:
+        sourcePath = os.path.abspath(sd.path)
+        if sourcePath not in snapshot['files']:
+            snapshot['files'][sourcePath] = _fingerprintSource(sourcePath)
+    return snapshot
+
+
+def writeMasterSnapshot(processor, path, fingerprint=None):
+    """ Pack the masters of processor and save them to a snapshot file at path.
+        fingerprint: from fingerprintSources, taken before the fonts were loaded.
+            Without it the sources are fingerprinted now, which is only
+            right if nothing was read from them yet.
+        The file is written next to path first and then moved into place,
+        processes that still map the old snapshot keep reading the old one.
+    """
+    # A source that is edited after the fingerprint and before the masters
+    # are packed makes the snapshot stale, it can't make a snapshot of old
+    # data look fresh.
+    if fingerprint is None:
+        fingerprint = fingerprintSources(processor)
+    snapshot = fingerprint
+    processor.loadFonts()
+    data = packMasterData(processor, snapshot=snapshot)
+    folder = os.path.dirname(os.path.abspath(path))
+    fd, tempPath = tempfile.mkstemp(suffix=".ufoProcessorMasters", dir=folder)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        _replace(tempPath, path)
+    except Exception:
+        if os.path.exists(tempPath):
+            os.remove(tempPath)
+        raise
+
+
+def openMasterSnapshot(path, processor):
+    """ Map the snapshot file at path, if it was made from the sources of processor
+        and the sources have not changed since. Returns a SharedMasterData object,
+        or None if there is no snapshot or it is out of date.
+    """
+    if not os.path.exists(path):
+        return None
+    try:
+        masterData = SharedMasterData.attach("file", path)
+    except (ValueError, EOFError, pickle.UnpicklingError, struct.error):
+        # not a snapshot, or a truncated one
+        return None
+    snapshot = masterData.header.get('snapshot')
+    valid = snapshot is not None and snapshot['sources'] == _describeSources(processor)
+    if valid:
+        for sourcePath, fingerprint in snapshot['files'].items():
+            if not _sourceIsUnchanged(sourcePath, fingerprint):
+                valid = False
+                break
+    if not valid:
+        masterData.close()
+        return None
+    return masterData
@@ -1,7 +1,8 @@
 # -*- coding: utf-8 -*-
 
 from __future__ import print_function, division, absolute_import
-from fontTools.varLib.models import VariationModel, normalizeLocation
+from bisect import bisect_left
+from fontTools.varLib.models import VariationModel, normalizeLocation, supportScalar
 
 # process the axis map values
 class AxisMapper(object):
@@ -58,15 +59,115 @@ class AxisMapper(object):
         return new
 
 
+def _isZero(value):
+    # True if value is a zero delta: a number, or a math object with nothing in it.
+    try:
+        return value == value * 0
+    except Exception:
+        return False
+
+
+def _participates(span):
+    # False if supportScalar ignores this axis of the support,
+    # the same OpenType rules as fontTools.varLib.models.supportScalar
+    lower, peak, upper = span
+    if peak == 0:
+        return False
+    if lower > peak or peak > upper:
+        return False
+    if lower < 0 and upper > 0:
+        return False
+    return True
+
+
+class SupportIndex(object):
+    """ Finds the regions of a variation model that are not zero at a location.
+        On every axis the edges and peaks of the supports cut the axis into
+        pieces. Each piece has a bit mask of the regions that can be nonzero
+        there. For a location it takes a bisect per axis and an and of the
+        masks, only the regions that are left get their scalar calculated.
+    """
+
+    def __init__(self, supports):
+        # supports: the supports of a VariationModel, in model order
+        self.supports = supports
+        self.allRegions = (1 << len(supports)) - 1
+        self.axes = {}
+        axisNames = set()
+        for support in supports:
+            axisNames.update(support.keys())
+        for axisName in sorted(axisNames):
+            free = 0    # the regions that don't depend on this axis
+            spans = []
+            for i, support in enumerate(supports):
+                span = support.get(axisName)
+                if span is None or not _participates(span):
+                    free |= 1 << i
+                else:
+                    spans.append((i, span))
+            if not spans:
+                continue
+            points = sorted(set([value for i, span in spans for value in span]))
+            masks = []
+            for piece in range(2 * len(points) + 1):
+                # even pieces are between the points, odd pieces are on them
+                k = piece // 2
+                if piece % 2:
+                    value = points[k]
+                elif k == 0:
+                    value = points[0] - 1
+                elif k == len(points):
+                    value = points[-1] + 1
+                else:
+                    value = (points[k-1] + points[k]) / 2
+                mask = free
+                for i, (lower, peak, upper) in spans:
+                    if value == peak or lower < value < upper:
+                        mask |= 1 << i
+                masks.append(mask)
+            self.axes[axisName] = (points, masks)
+
+    def getActiveRegions(self, location):
+        """ Return the indices of the regions that can be nonzero at this normalized location."""
+        mask = self.allRegions
+        for axisName, (points, masks) in self.axes.items():
+            value = location.get(axisName, 0.)
+            k = bisect_left(points, value)
+            if k < len(points) and points[k] == value:
+                mask &= masks[2 * k + 1]
+            else:
+                mask &= masks[2 * k]
+            if not mask:
+                break
+        active = []
+        while mask:
+            bit = mask & -mask
+            active.append(bit.bit_length() - 1)
+            mask ^= bit
+        return active
+
+    def getScalars(self, location):
+        """ Return a list of (index, scalar) for the regions that are not zero
+            at this normalized location, in model order.
+        """
+        scalars = []
+        for i in self.getActiveRegions(location):
+            scalar = supportScalar(location, self.supports[i])
+            if scalar:
+                scalars.append((i, scalar))
+        return scalars
+
+
 class VariationModelMutator(object):
     """ a thing that looks like a mutator on the outside,
         but uses the fonttools varlib logic to calculate.
     """
 
-    def __init__(self, items, axes, model=None):
+    def __init__(self, items, axes, model=None, supportIndex=None):
         # items: list of locationdict, value tuples
         # axes: list of axis dictionaried, not axisdescriptor objects.
         # model: a model, if we want to share one
+        # supportIndex: the SupportIndex for that model, if we want to share one
         self.axisOrder = [a.name for a in axes]
         self.axisMapper = AxisMapper(axes)
         self.axes = {}
@@ -76,7 +177,62 @@ class VariationModelMutator(object):
             self.model = VariationModel([self._normalize(a) for a,b in items], axisOrder=self.axisOrder)
         else:
             self.model = model
-        self.masters = [b for a, b in items]
+        if supportIndex is None:
+            supportIndex = SupportIndex(self.model.supports)
+        self.supportIndex = supportIndex
+        self.masters = self._shareDefault([b for a, b in items])
+        self._deltas = None
+        self._deltaMap = None
+
+    def _shareDefault(self, masters):
+        # masters that are the same as the default are replaced by the default
+        # so that only one copy is kept.
+        if not masters or self.model.locations[0] != {}:
+            return masters
+        default = masters[self.model.reverseMapping[0]]
+        return [default if m is not default and m == default else m for m in masters]
+
+    def getSparseDeltas(self):
+        # the deltas only depend on the masters, calculate them once.
+        # Returns a list of (index, delta) for the deltas that are not zero,
+        # the default is always there. Masters that are the same as the
+        # default, or that are on the line between their neighbours,
+        # have a zero delta and don't need to be stored or multiplied.
+        if self._deltas is None:
+            deltas = [(i, delta) for i, delta in enumerate(self.model.getDeltas(self.masters)) if i == 0 or not _isZero(delta)]
+            self._deltaMap = dict(deltas)
+            self._deltas = deltas
+        return self._deltas
+
+    def getDeltas(self):
+        # all the deltas, in model order, zero deltas included.
+        sparse = dict(self.getSparseDeltas())
+        zero = None
+        deltas = []
+        for i in range(len(self.masters)):
+            if i in sparse:
+                deltas.append(sparse[i])
+            else:
+                if zero is None:
+                    zero = sparse[0] * 0
+                deltas.append(zero)
+        return deltas
+
+    def _interpolate(self, scalars):
+        # interpolateFromDeltasAndScalars, but only for the (index, scalar)
+        # pairs from the support index and the deltas we have.
+        self.getSparseDeltas()
+        v = None
+        for i, scalar in scalars:
+            delta = self._deltaMap.get(i)
+            if delta is None:
+                continue
+            contribution = delta * scalar
+            if v is None:
+                v = contribution
+            else:
+                v += contribution
+        return v
 
     def get(self, key):
         if key in self.model.locations:
@@ -93,12 +249,52 @@ class VariationModelMutator(object):
         if bend:
             location = self.axisMapper(location)
         nl = self._normalize(location)
-        return self.model.interpolateFromMasters(nl, self.masters)
+        return self._interpolate(self.supportIndex.getScalars(nl))
+
+    def makeInstances(self, locations, bend=False):
+        # make instances for a list of locations in one go
+        instances = []
+        for location in locations:
+            if bend:
+                location = self.axisMapper(location)
+            nl = self._normalize(location)
+            instances.append(self._interpolate(self.supportIndex.getScalars(nl)))
+        return instances
 
     def _normalize(self, location):
         return normalizeLocation(location, self.axes)
 
 
+class StaticMutator(object):
+    """ a thing that looks like a mutator on the outside,
+        for masters that are all the same. There is nothing to calculate,
+        every instance is a copy of the master.
+    """
+
+    def __init__(self, value, neutral=None):
+        # value: the master value
+        # neutral: what get(()) returns, so that it can look like the
+        # mutator the processor would otherwise make.
+        self.value = value
+        self.neutral = neutral
+
+    def get(self, key):
+        if key == ():
+            return self.neutral
+        return None
+
+    def getFactors(self, location):
+        return [1]
+
+    def makeInstance(self, location, bend=False):
+        if hasattr(self.value, "copy"):
+            return self.value.copy()
+        return self.value
+
+    def makeInstances(self, locations, bend=False):
+        return [self.makeInstance(location) for location in locations]
+
+
 if __name__ == "__main__":
     from fontTools.designspaceLib import AxisDescriptor
     a = AxisDescriptor()
@@ -144,3 +340,22 @@ if __name__ == "__main__":
     assert mm.makeInstance(dict(A=100, B=100)) == 0
     assert mm.makeInstance(dict(A=50, B=0),bend=False) == 5
     assert mm.makeInstance(dict(A=50, B=0),bend=True) == 2.5
+    assert mm.makeInstances([dict(A=0, B=0), dict(A=100, B=0), dict(A=50, B=0)]) == [0, 10, 5]
+
+    # the master at B=100 is the same as the default, it doesn't need a delta
+    sparse = VariationModelMutator([({}, 0), ({'A': 100}, 10), ({'A': 50}, 5), ({'B': 100}, 0)], axes)
+    assert [i for i, delta in sparse.getSparseDeltas()] == [0, 1, 2]
+    assert sparse.getDeltas() == [0, 5, 10, 0]
+    assert sparse.makeInstances([dict(A=25, B=0), dict(A=100, B=100)]) == [2.5, 10]
+
+    # the support index finds the same scalars as the model
+    for location in [dict(A=0, B=0), dict(A=100, B=0), dict(A=60, B=90), dict(A=-50, B=100), dict(A=100, B=100)]:
+        nl = mm._normalize(location)
+        assert mm.supportIndex.getScalars(nl) == [(i, s) for i, s in enumerate(mm.model.getScalars(nl)) if s]
+    assert mm.supportIndex.getActiveRegions(mm._normalize(dict(A=0, B=50))) == [0]
+    shared = VariationModelMutator(items, axes, model=mm.model, supportIndex=mm.supportIndex)
+    assert shared.makeInstance(dict(A=60, B=90)) == mm.makeInstance(dict(A=60, B=90))
+
+    sm = StaticMutator(10)
+    assert sm.makeInstance(dict(A=50, B=0)) == 10
+    assert sm.get(()) is None
@@ -1,6 +1,8 @@
 # standalone test
 import shutil
+import zipfile
 import os
+import sys
 from defcon.objects.font import Font
 import logging
 from ufoProcessor import *
@@ -272,8 +274,810 @@ def testUnicodes(docPath, useVarlib=True):
         else:
             print("Missing test font at %s" % instance.path)
 
+def testGlyphIndex(docPath, useVarlib=True):
+    # the glyph index lists the contributing sources for each glyph
+    # the support layer only has glyphFive.
+    d = DesignSpaceProcessor(useVarlib=useVarlib)
+    d.read(docPath)
+    d.loadFonts()
+    d.findDefault()
+    index = d.getGlyphIndex()
+    assert [sd.name for sd, layerName in index['glyphFive']] == ["test.master.1", "test.master.2", "test.master.support.1"]
+    assert [layerName for sd, layerName in index['glyphFive']] == [None, None, "support"]
+    assert [sd.name for sd, layerName in index['glyphOne']] == ["test.master.1", "test.master.2"]
+    assert len(d.collectMastersForGlyph('glyphFive')) == 3
+    assert d.getGlyphsMissingFromDefault() == []
+    # muted glyphs do not contribute
+    d.sources[1].mutedGlyphNames.append('glyphOne')
+    d._buildGlyphIndex()
+    assert [sd.name for sd, layerName in d.getGlyphIndex()['glyphOne']] == ["test.master.1"]
+
+def testGlyphWorkers(docPath, useVarlib=True):
+    # interpolating the glyphs in worker processes gives the same glyphs
+    d = DesignSpaceProcessor(useVarlib=useVarlib)
+    d.read(docPath)
+    d.loadFonts()
+    d.findDefault()
+    for instance in d.instances:
+        serial = d.makeInstance(instance)
+        parallel = d.makeInstance(instance, workers=2)
+        assert parallel.lib['public.glyphOrder'] == serial.lib['public.glyphOrder']
+        for g in serial:
+            assert g.name in parallel
+            assert g.width == parallel[g.name].width
+            assert [[(p.x, p.y) for p in c] for c in g] == [[(p.x, p.y) for p in c] for c in parallel[g.name]]
+
+def testRoundedExtraction(docPath, useVarlib=True):
+    # rounding while the glyph is written gives the same glyph as MathGlyph.round()
+    d = DesignSpaceProcessor(useVarlib=useVarlib)
+    d.read(docPath)
+    d.loadFonts()
+    d.findDefault()
+    for instance in d.instances:
+        d.roundGeometry = False
+        unrounded = d.makeInstance(instance)
+        d.roundGeometry = True
+        rounded = d.makeInstance(instance)
+        expected = Font()
+        for g in unrounded:
+            e = expected.newGlyph(g.name)
+            MathGlyph(g).round().extractGlyph(e, onlyGeometry=True)
+            r = rounded[g.name]
+            assert r.width == e.width
+            assert [[(p.x, p.y, p.segmentType) for p in c] for c in r] == [[(p.x, p.y, p.segmentType) for p in c] for c in e]
+            assert [(c.baseGlyph, c.transformation) for c in r.components] == [(c.baseGlyph, c.transformation) for c in e.components]
+            assert [(a.x, a.y, a.name) for a in r.anchors] == [(a.x, a.y, a.name) for a in e.anchors]
+
+def testSparseDeltas(docPath):
+    # the varlib mutators only keep the deltas that are not zero
+    d = DesignSpaceProcessor(useVarlib=True)
+    d.read(docPath)
+    d.loadFonts()
+    for glyphName in d.glyphNames:
+        m = d.getGlyphMutator(glyphName)
+        if not hasattr(m, "getSparseDeltas"):
+            continue
+        deltas = m.model.getDeltas(m.masters)
+        assert [i for i, delta in m.getSparseDeltas()] == [i for i, delta in enumerate(deltas) if i == 0 or delta != delta * 0]
+        assert m.getDeltas() == deltas
+
+def testSupportIndex(docPath):
+    # mutators with masters in the same places share the model and the support index,
+    # the index finds the same scalars as the model
+    d = DesignSpaceProcessor(useVarlib=True)
+    d.read(docPath)
+    d.loadFonts()
+    mutators = [m for m in [d.getGlyphMutator(glyphName) for glyphName in d.glyphNames] if hasattr(m, "supportIndex")]
+    for m in mutators:
+        same = [other for other in mutators if other.model.locations == m.model.locations]
+        assert all([other.supportIndex is m.supportIndex for other in same])
+        for instance in d.instances:
+            if d.isAnisotropic(instance.location):
+                continue
+            nl = m._normalize(instance.location)
+            assert m.supportIndex.getScalars(nl) == [(i, s) for i, s in enumerate(m.model.getScalars(nl)) if s]
+
+def testStaticMutator(docPath, useVarlib=True):
+    # a glyph with identical masters gets a StaticMutator that hands out copies
+    from ufoProcessor.varModels import StaticMutator
+    d = DesignSpaceProcessor(useVarlib=useVarlib)
+    d.read(docPath)
+    d.loadFonts()
+    d.findDefault()
+    mutator = d.getGlyphMutator("wide")
+    assert isinstance(mutator, StaticMutator)
+    assert not isinstance(d.getGlyphMutator("glyphOne"), StaticMutator)
+    first = mutator.makeInstance(dict(pop=0))
+    second = mutator.makeInstance(dict(pop=1000))
+    assert first == second
+    assert first is not second
+    assert first is not mutator.value
+    width = mutator.value.width
+    first.width += 100
+    assert second.width == width
+    assert mutator.value.width == width
+    assert d.makeInstance(d.instances[1])["wide"].width == d.fonts[d.default.name]["wide"].width
+
+def testSameLocationInstances(docPath, useVarlib=True):
+    # instances at the same location get the same glyphs, each glyph is interpolated once
+    d = DesignSpaceProcessor(useVarlib=useVarlib)
+    d.read(docPath)
+    d.loadFonts()
+    d.findDefault()
+    original = d.instances[1]
+    twin = InstanceDescriptor()
+    twin.name = original.name + "-twin"
+    twin.familyName = original.familyName
+    twin.styleName = original.styleName + "-twin"
+    twin.location = dict(original.location)
+    calls = {}
+    def countCalls(glyphName, makeInstance):
+        def counted(location, *args, **kwargs):
+            calls[glyphName] = calls.get(glyphName, 0) + 1
+            return makeInstance(location, *args, **kwargs)
+        return counted
+    for glyphName in d.glyphNames:
+        mutator = d.getGlyphMutator(glyphName)
+        mutator.makeInstance = countCalls(glyphName, mutator.makeInstance)
+    fonts = [font for instance, font in d.iterInstances(instances=[original, twin], releaseMemory=False)]
+    assert calls == dict([(glyphName, 1) for glyphName in d.glyphNames])
+    assert sorted(fonts[0].keys()) == sorted(fonts[1].keys())
+    for g in fonts[0]:
+        other = fonts[1][g.name]
+        assert other is not g
+        assert g.width == other.width
+        assert g.unicodes == other.unicodes
+        assert [[(p.x, p.y) for p in c] for c in g] == [[(p.x, p.y) for p in c] for c in other]
+
+def testGlyphMastersCache(docPath, useVarlib=True):
+    # instances that list the same masters for a glyph share one mutator
+    d = DesignSpaceProcessor(useVarlib=useVarlib)
+    d.read(docPath)
+    d.loadFonts()
+    d.findDefault()
+    sources = [s for s in d.sources if s.layerName is None]
+    masters = [dict(font=s.name, glyphName="glyphTwo", location=s.location) for s in sources]
+    for instance in d.instances:
+        instance.glyphs['glyphOne'] = dict(masters=masters)
+    fonts = [d.makeInstance(instance) for instance in d.instances]
+    keys = [key for key in d._glyphMutators.keys() if isinstance(key[1], tuple)]
+    assert len(keys) == 1
+    mutator = d._glyphMutators[keys[0]]
+    assert d.getGlyphMastersMutator("glyphOne", masters) is mutator
+    for instance, font in zip(d.instances, fonts):
+        if d.isAnisotropic(instance.location):
+            continue
+        assert font['glyphOne'].width == mutator.makeInstance(instance.location).width
+    d.reloadSources([sources[0].path], glyphNames=["glyphThree"])
+    assert keys[0] in d._glyphMutators
+    d.reloadSources([sources[0].path], glyphNames=["glyphTwo"])
+    assert keys[0] not in d._glyphMutators
+
+def testIterInstances(docPath, useVarlib=True):
+    # the instances are made one at a time, in memory, and nothing is saved
+    d = DesignSpaceProcessor(useVarlib=useVarlib)
+    d.read(docPath)
+    names = []
+    for instance, font in d.iterInstances(kerning=False, info=False):
+        names.append(instance.name)
+        assert len(font.kerning) == 0
+        assert font.info.unitsPerEm is None
+        assert font.info.familyName == instance.familyName
+        assert font.lib['public.glyphOrder'] == d.glyphNames
+    assert names == [instance.name for instance in d.instances]
+    assert [m for m in d.messages if m.startswith("Generated")] == []
+    # stopping early also stops the workers
+    d.workers = 2
+    instances = d.iterInstances()
+    instance, font = next(instances)
+    assert d._glyphPool is not None
+    instances.close()
+    assert d._glyphPool is None
+    assert d._glyphInstanceCache is None
+
+def testLowMemory(docPath, useVarlib=True):
+    # low memory mode makes the same instances from packed masters,
+    # with the smallest target every glyph is a batch of its own
+    d = DesignSpaceProcessor(useVarlib=useVarlib)
+    d.read(docPath)
+    reference = dict([(instance.name, font) for instance, font in d.iterInstances(releaseMemory=False)])
+    for workers in [1, 2]:
+        d = DesignSpaceProcessor(useVarlib=useVarlib)
+        d.read(docPath)
+        d.lowMemory = True
+        d.memoryTarget = 1
+        d.workers = workers
+        for instance, font in d.iterInstances():
+            assert d._masterData is not None
+            assert len(d._glyphMutators) <= 1
+            expected = reference[instance.name]
+            assert font.kerning.items() == expected.kerning.items()
+            for g in expected:
+                assert g.width == font[g.name].width
+                assert [[(p.x, p.y) for p in c] for c in g] == [[(p.x, p.y) for p in c] for c in font[g.name]]
+        assert d._masterData is None
+        assert d._sharedMasters is None
+        assert [p for p in d.problems if p.startswith("Memory target")]
+        if sys.platform.startswith("linux"):
+            assert d.peakMemory > 0
+
+def testGlyphMajor(docPath, useVarlib=True):
+    # glyph major makes the same instances, and keeps no mutators it made itself
+    d = DesignSpaceProcessor(useVarlib=useVarlib)
+    d.read(docPath)
+    reference = dict([(instance.name, font) for instance, font in d.iterInstances(releaseMemory=False)])
+    for workers, groupSize in [(1, None), (1, 2), (2, 2)]:
+        d = DesignSpaceProcessor(useVarlib=useVarlib)
+        d.read(docPath)
+        d.glyphMajor = True
+        d.glyphMajorGroupSize = groupSize
+        d.workers = workers
+        d.loadFonts()
+        d.findDefault()
+        kept = d.getGlyphMutator("glyphOne")
+        names = []
+        for instance, font in d.iterInstances():
+            names.append(instance.name)
+            expected = reference[instance.name]
+            assert font.kerning.items() == expected.kerning.items()
+            assert font.info.familyName == expected.info.familyName
+            assert font.lib['public.glyphOrder'] == expected.lib['public.glyphOrder']
+            assert font.lib['designspace'] == expected.lib['designspace']
+            assert sorted(font.keys()) == sorted(expected.keys())
+            for g in expected:
+                assert g.width == font[g.name].width
+                assert g.unicodes == font[g.name].unicodes
+                assert [[(p.x, p.y) for p in c] for c in g] == [[(p.x, p.y) for p in c] for c in font[g.name]]
+        assert names == [instance.name for instance in d.instances]
+        assert list(d._glyphMutators.values()) == [kept]
+    # only the instance fonts of one group, and their glyphs, are in memory at a time
+    import weakref
+    for groupSize in [1, 2, None]:
+        d = DesignSpaceProcessor(useVarlib=useVarlib)
+        d.read(docPath)
+        d.glyphMajor = True
+        d.glyphMajorGroupSize = groupSize
+        made = []
+        makeInstanceFont = d._makeInstanceFont
+        def trackInstanceFont(*args, **kwargs):
+            font = makeInstanceFont(*args, **kwargs)
+            made.append(weakref.ref(font))
+            return font
+        d._makeInstanceFont = trackInstanceFont
+        mostFonts = mostGlyphs = 0
+        for instance, font in d.iterInstances():
+            font = None
+            alive = [ref() for ref in made if ref() is not None]
+            mostFonts = max(mostFonts, len(alive))
+            mostGlyphs = max(mostGlyphs, sum([len(aliveFont) for aliveFont in alive]))
+            alive = None
+        assert len(made) == len(d.instances)
+        assert mostFonts == min(groupSize or len(d.instances), len(d.instances))
+        assert mostGlyphs <= mostFonts * len(d.glyphNames)
+
+def testUpdateDesignSpace(docPath, useVarlib=True):
+    # edits to the designspace are applied to the live processor.
+    # It makes the same instances as a processor that reads the edited document,
+    # and only builds the mutators that depend on the edit.
+    def makeAll(d):
+        d.findDefault()
+        return dict([(instance.name, d.makeInstance(instance)) for instance in d.instances])
+    def compare(fonts, expected):
+        assert sorted(fonts.keys()) == sorted(expected.keys())
+        for name, font in fonts.items():
+            assert font.kerning.items() == expected[name].kerning.items()
+            assert font.info.ascender == expected[name].info.ascender
+            for g in expected[name]:
+                assert g.width == font[g.name].width
+                assert [[(p.x, p.y) for p in c] for c in g] == [[(p.x, p.y) for p in c] for c in font[g.name]]
+    removed = {}
+    def move(d):
+        sd = d.sources[-1]
+        sd.location = dict([(name, value * 0.8) for name, value in sd.location.items()])
+    def stretch(d):
+        d.axes[0].maximum += 500
+    def remove(d):
+        removed[id(d)] = d.sources.pop()
+    def addBack(d):
+        d.addSource(removed.pop(id(d)))
+    d = DesignSpaceProcessor(useVarlib=useVarlib)
+    d.read(docPath)
+    d.loadFonts()
+    makeAll(d)
+    d.getGlyphMutator("glyphOne", decomposeComponents=True)
+    lastName = d.sources[-1].name
+    index = d.getGlyphIndex()
+    unaffected = dict([(key, m) for key, m in d._glyphMutators.items() if lastName not in [sd.name for sd, layerName in index.get(key[0], [])]])
+    before = dict([(key, dict([(name, mathObject) for name, location, mathObject in m._sourceMasters])) for key, m in d._glyphMutators.items()])
+    for edit, reportKey in [(move, 'movedSources'), (stretch, 'changedAxes'), (remove, 'removedSources'), (addBack, 'addedSources')]:
+        edit(d)
+        report = d.updateDesignSpace()
+        assert report[reportKey]
+        if edit is move:
+            for key, m in unaffected.items():
+                assert d._glyphMutators[key] is m
+            assert 0 < report['rebuiltMutators'] < len(before) + 2
+        for key, m in d._glyphMutators.items():
+            # the masters of the sources that were there all along are used again
+            for name, location, mathObject in getattr(m, "_sourceMasters", []):
+                if key in before and name in before[key] and name != lastName:
+                    assert mathObject is before[key][name]
+        fresh = DesignSpaceProcessor(useVarlib=useVarlib)
+        fresh.read(docPath)
+        for previous in [move, stretch, remove, addBack]:
+            previous(fresh)
+            if previous is edit:
+                break
+        fresh.loadFonts()
+        compare(makeAll(d), makeAll(fresh))
+    assert d.updateDesignSpace()['rebuiltMutators'] == 0
+
+def testSharedMasters(docPath, useVarlib=True):
+    # workers that attach to shared master data make the same glyphs
+    for useFile in [False, True]:
+        d = DesignSpaceProcessor(useVarlib=useVarlib)
+        d.read(docPath)
+        shared = d.shareMasters(useFile=useFile)
+        try:
+            for instance in d.instances:
+                serial = d.makeInstance(instance)
+                parallel = d.makeInstance(instance, workers=2)
+                for g in serial:
+                    assert g.width == parallel[g.name].width
+                    assert [[(p.x, p.y) for p in c] for c in g] == [[(p.x, p.y) for p in c] for c in parallel[g.name]]
+        finally:
+            shared.unlink()
+    # the kind of backend travels with the name, a file name is not mistaken for a shared block
+    import ufoProcessor.sharedMasters
+    from ufoProcessor.sharedMasters import SharedMasterData
+    d = DesignSpaceProcessor(useVarlib=useVarlib)
+    d.read(docPath)
+    shared = d.shareMasters(useFile=True)
+    try:
+        assert shared.kind == "file"
+        attached = SharedMasterData.attach(shared.kind, shared.name)
+        assert attached.glyphNames == shared.glyphNames
+        attached.close()
+    finally:
+        shared.unlink()
+    # without shared memory attaching to a block is a clear error
+    sharedMemory = ufoProcessor.sharedMasters.shared_memory
+    ufoProcessor.sharedMasters.shared_memory = None
+    try:
+        try:
+            SharedMasterData.attach("memory", "noSuchBlock")
+            assert False, "expected a UFOProcessorError"
+        except UFOProcessorError:
+            pass
+    finally:
+        ufoProcessor.sharedMasters.shared_memory = sharedMemory
+
+def testMasterSnapshot(docPath, useVarlib=True):
+    # the masters from a snapshot make the same instances,
+    # the snapshot is only used while the sources do not change
+    snapshotPath = os.path.join(os.path.dirname(docPath), "masters.snapshot")
+    if os.path.exists(snapshotPath):
+        os.remove(snapshotPath)
+    d = DesignSpaceProcessor(useVarlib=useVarlib)
+    d.read(docPath)
+    assert d.useMasterSnapshot(snapshotPath) == False
+    d.closeMasterSnapshot()
+    assert d._masterData is None
+    d = DesignSpaceProcessor(useVarlib=useVarlib)
+    d.read(docPath)
+    d.loadFonts()
+    d.findDefault()
+    reference = [d.makeInstance(instance) for instance in d.instances]
+    d = DesignSpaceProcessor(useVarlib=useVarlib)
+    d.read(docPath)
+    assert d.useMasterSnapshot(snapshotPath) == True
+    for instance, expected in zip(d.instances, reference):
+        for parallel in [d.makeInstance(instance), d.makeInstance(instance, workers=2)]:
+            assert parallel.kerning.items() == expected.kerning.items()
+            for g in expected:
+                assert g.width == parallel[g.name].width
+                assert [[(p.x, p.y) for p in c] for c in g] == [[(p.x, p.y) for p in c] for c in parallel[g.name]]
+    d.closeMasterSnapshot()
+    # touched, but the same
+    infoPath = os.path.join(d.sources[0].path, "fontinfo.plist")
+    os.utime(infoPath, None)
+    d = DesignSpaceProcessor(useVarlib=useVarlib)
+    d.read(docPath)
+    assert d.useMasterSnapshot(snapshotPath) == True
+    d.closeMasterSnapshot()
+    # changed
+    with open(infoPath, "rb") as f:
+        original = f.read()
+    try:
+        with open(infoPath, "wb") as f:
+            f.write(original.replace(b"</dict>", b"<key>note</key><string>changed</string></dict>"))
+        d = DesignSpaceProcessor(useVarlib=useVarlib)
+        d.read(docPath)
+        assert d.useMasterSnapshot(snapshotPath) == False
+        d.closeMasterSnapshot()
+    finally:
+        with open(infoPath, "wb") as f:
+            f.write(original)
+    # edited while the snapshot is written: the snapshot is stale, it doesn't look fresh
+    from ufoProcessor.sharedMasters import writeMasterSnapshot, openMasterSnapshot
+    d = DesignSpaceProcessor(useVarlib=useVarlib)
+    d.read(docPath)
+    loadFonts = d.loadFonts
+    def loadAndEdit(*args, **kwargs):
+        with open(infoPath, "wb") as f:
+            f.write(original.replace(b"</dict>", b"<key>note</key><string>edited</string></dict>"))
+        return loadFonts(*args, **kwargs)
+    d.loadFonts = loadAndEdit
+    try:
+        writeMasterSnapshot(d, snapshotPath)
+        assert openMasterSnapshot(snapshotPath, d) is None
+    finally:
+        with open(infoPath, "wb") as f:
+            f.write(original)
+    # the same through useMasterSnapshot, edited while the fonts load or the glyphs are preloaded
+    for hookName in ["loadFonts", "preloadMasterGlyphs"]:
+        d = DesignSpaceProcessor(useVarlib=useVarlib)
+        d.read(docPath)
+        d.workers = 2
+        hook = getattr(d, hookName)
+        def editAndCall(*args, **kwargs):
+            with open(infoPath, "wb") as f:
+                f.write(original.replace(b"</dict>", b"<key>note</key><string>edited</string></dict>"))
+            return hook(*args, **kwargs)
+        setattr(d, hookName, editAndCall)
+        try:
+            if os.path.exists(snapshotPath):
+                os.remove(snapshotPath)
+            assert d.useMasterSnapshot(snapshotPath) == False
+            d.closeMasterSnapshot()
+            assert openMasterSnapshot(snapshotPath, d) is None
+        finally:
+            with open(infoPath, "wb") as f:
+                f.write(original)
+
+def testCompactKerning():
+    groups = {"public.kern1.groupA": ['glyphOne', 'glyphTwo'], "public.kern2.groupB": ['glyphThree', 'glyphFour']}
+    kerning = {
+        ('public.kern1.groupA', 'public.kern2.groupB'): -100,
+        ('glyphOne', 'glyphThree'): -100,    # same as the group, redundant
+        ('glyphOne', 'glyphFour'): 0,        # exception, keep
+        ('glyphFive', 'glyphFive'): 0,       # zero pair, no groups
+        ('glyphFive', 'glyphOne'): 2,        # below threshold
+        }
+    report = compactKerning(kerning, groups)
+    assert report['zeroPairs'] == 1
+    assert report['redundantExceptions'] == 1
+    assert ('glyphOne', 'glyphFour') in kerning
+    assert ('glyphOne', 'glyphThree') not in kerning
+    report = compactKerning(kerning, groups, threshold=5)
+    assert report['thresholdPairs'] == 1
+    assert sorted(kerning.keys()) == [('glyphOne', 'glyphFour'), ('public.kern1.groupA', 'public.kern2.groupB')]
+
+def testCommandLine(docPath, useVarlib=True):
+    # generate one instance with a couple of glyphs from the command line
+    from ufoProcessor.commandLine import main
+    import json
+    profilePath = os.path.join(os.path.dirname(docPath), "profile.json")
+    engine = "varlib" if useVarlib else "mutatormath"
+    exitCode = main([docPath, "--engine", engine, "--workers", "2", "--instance", "TestStyle_pop500.000", "--glyphs", "glyphOne,wide", "--profile", profilePath, "--quiet"])
+    with open(profilePath) as f:
+        profile = json.load(f)
+    document = profile['documents'][0]
+    assert document['error'] is None
+    assert [instance['name'] for instance in document['instances']] == ["TestFamily-TestStyle_pop500.000"]
+    assert exitCode == (1 if document['problems'] else 0)
+    # what happened is reported in the messages, it is not a problem
+    assert [m for m in document['messages'] if m.startswith("Generated")]
+    assert [m for m in document['messages'] if m.startswith("loaded master")]
+    assert [p for p in document['problems'] if p.startswith(("Generated", "loaded master"))] == []
+    assert main([os.path.join(os.path.dirname(docPath), "missing.designspace"), "--quiet"]) == 2
+
+def testIncrementalSave(docPath, useVarlib=True):
+    # generating the same instances again does not write any files
+    for counter in range(2):
+        d = DesignSpaceProcessor(useVarlib=useVarlib)
+        d.read(docPath)
+        d.incrementalSave = True
+        d.generateUFO()
+        reports = [m for m in d.messages if m.startswith("Generated")]
+        assert len(reports) == len([i for i in d.instances if i.path is not None])
+        if counter == 1:
+            for report in reports:
+                assert ", 0 files written" in report
+    # the glyph order does not depend on chance
+    assert d.glyphNames[:5] == ['glyphOne', 'glyphTwo', 'glyphThree', 'glyphFour', 'glyphFive']
+
+def testPipelinedSave(docPath, useVarlib=True):
+    # writer threads save the same instances, in the same order
+    for saveWorkers in [0, 2]:
+        d = DesignSpaceProcessor(useVarlib=useVarlib)
+        d.read(docPath)
+        d.incrementalSave = True
+        d.saveWorkers = saveWorkers
+        d.saveQueueSize = 1
+        d.generateUFO()
+    reports = [m for m in d.messages if m.startswith("Generated")]
+    assert len(reports) == len([i for i in d.instances if i.path is not None])
+    for report in reports:
+        assert ", 0 files written" in report
+    assert [timing['name'] for timing in d.instanceTimings] == [i.name for i in d.instances if i.path is not None]
+    # a failed save stops the build with the same error as without writers
+    blocker = os.path.join(os.path.dirname(docPath), "notAFolder")
+    with open(blocker, "w") as f:
+        f.write("")
+    try:
+        for saveWorkers in [0, 2]:
+            d = DesignSpaceProcessor(useVarlib=useVarlib)
+            d.read(docPath)
+            d.saveWorkers = saveWorkers
+            d.instances[1].path = os.path.join(blocker, "instance.ufo")
+            try:
+                d.generateUFO()
+            except OSError:
+                pass
+            else:
+                assert False, "the failed save was not raised"
+            if saveWorkers:
+                assert [p for p in d.problems if p.startswith("Could not save")]
+    finally:
+        os.remove(blocker)
+
+def testFastMasterReading(docPath, useVarlib=True):
+    # the glif reader makes the same master glyphs as defcon
+    masters = []
+    for fast in [False, True]:
+        d = DesignSpaceProcessor(useVarlib=useVarlib)
+        d.read(docPath)
+        d.fastMasterReading = fast
+        d.loadFonts()
+        d.findDefault()
+        masters.append(dict([(glyphName, [(loc, mathGlyph) for loc, mathGlyph, sourceInfo in d.collectMastersForGlyph(glyphName)]) for glyphName in d.glyphNames]))
+    assert masters[0] == masters[1]
+    assert list(d._glyphReaders.values())[0].getMathGlyph('glyphFive', 'support') is not None
+    # the same sources zipped as .ufoz, defcon can't open these
+    reference = DesignSpaceProcessor(useVarlib=useVarlib)
+    reference.read(docPath)
+    reference.loadFonts()
+    reference.findDefault()
+    d = DesignSpaceProcessor(useVarlib=useVarlib)
+    d.read(docPath)
+    zippedPath = os.path.join(os.path.dirname(docPath), "automatic_test_ufoz.designspace")
+    for sourceDescriptor in d.sources:
+        zippedSourcePath = os.path.splitext(sourceDescriptor.path)[0] + ".ufoz"
+        with zipfile.ZipFile(zippedSourcePath, "w") as z:
+            for root, dirs, files in os.walk(sourceDescriptor.path):
+                for fileName in files:
+                    path = os.path.join(root, fileName)
+                    z.write(path, os.path.relpath(path, os.path.dirname(sourceDescriptor.path)))
+        sourceDescriptor.path = zippedSourcePath
+        sourceDescriptor.filename = None
+    for instanceDescriptor in d.instances:
+        instanceDescriptor.filename = None
+    d.write(zippedPath)
+    for fast in [False, True]:
+        zipped = DesignSpaceProcessor(useVarlib=useVarlib)
+        zipped.read(zippedPath)
+        zipped.fastMasterReading = fast
+        zipped.loadFonts()
+        zipped.findDefault()
+        assert [f for f in zipped.fonts.values() if isinstance(f, Font)] == []
+        assert zipped.glyphNames == reference.glyphNames
+        assert dict([(glyphName, [(loc, mathGlyph) for loc, mathGlyph, sourceInfo in zipped.collectMastersForGlyph(glyphName)]) for glyphName in zipped.glyphNames]) == masters[0]
+        for instanceDescriptor, zippedInstanceDescriptor in zip(reference.instances, zipped.instances):
+            expected = reference.makeInstance(instanceDescriptor)
+            font = zipped.makeInstance(zippedInstanceDescriptor)
+            assert font.kerning.items() == expected.kerning.items()
+            assert font.info.unitsPerEm == expected.info.unitsPerEm
+            assert font.features.text == expected.features.text
+            for g in expected:
+                assert g.width == font[g.name].width
+                assert [[(p.x, p.y) for p in c] for c in g] == [[(p.x, p.y) for p in c] for c in font[g.name]]
+
+def testShards(docPath, useVarlib=True):
+    # shards in separate processes, merged, make the same instances as a single run
+    import multiprocessing
+    from ufoProcessor.shards import makeManifest, runShard, main
+    root = os.path.join(os.path.dirname(docPath), "shards")
+    manifestPath = os.path.join(root, "manifest.json")
+    os.makedirs(root)
+    manifest = makeManifest(docPath, manifestPath, shardCount=2, glyphChunkSize=3, useVarlib=useVarlib)
+    assert len(manifest['units']) == 3 * len([i for i in manifest['units'] if i['chunk'] == 0])
+    folders = [os.path.join(root, "shard%d" % i) for i in range(2)]
+    processes = [multiprocessing.Process(target=runShard, args=(manifestPath, i, folders[i])) for i in range(2)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    assert main(["merge", manifestPath] + folders + ["--verify"]) == 0
+    # a shard that lost a glyph doesn't merge
+    from ufoProcessor.shards import mergeShards, _findUnit
+    unit = [unit for unit in manifest['units'] if unit['chunk'] == 1][0]
+    partPath = _findUnit(unit['name'], folders)
+    part = Font(partPath)
+    del part[unit['glyphs'][0]]
+    part.save(partPath)
+    try:
+        mergeShards(manifestPath, folders)
+    except UFOProcessorError as error:
+        assert unit['glyphs'][0] in error.msg
+    else:
+        assert False, "merged a shard with a missing glyph"
+    shutil.rmtree(os.path.join(folders[0], manifest['units'][0]['name'] + ".ufo"), ignore_errors=True)
+    shutil.rmtree(os.path.join(folders[1], manifest['units'][0]['name'] + ".ufo"), ignore_errors=True)
+    assert main(["merge", manifestPath] + folders) == 2
+
+def testDaemon(docPath, useVarlib=True):
+    # a warm server only reloads the glyphs that changed in a source
+    import socket
+    import threading
+    from ufoProcessor.daemon import BuildServer, sendRequest, makeParser, main
+    socketPath = os.path.join(os.path.dirname(docPath), "daemon.sock")
+    engine = "varlib" if useVarlib else "mutatormath"
+    server = BuildServer(socketPath, makeParser().parse_args(["serve", "--engine", engine]))
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    try:
+        # a second server does not take over the socket of a running one
+        try:
+            BuildServer(socketPath, makeParser().parse_args(["serve"]))
+            assert False, "expected a UFOProcessorError"
+        except UFOProcessorError:
+            pass
+        assert main(["--socket", socketPath, "status"]) == 0
+        response = sendRequest(dict(command="build", document=docPath, instances=["TestStyle_pop500.000"]), socketPath)
+        assert response['ok'], response['error']
+        assert response['reloaded']['document']
+        assert [m for m in response['messages'] if m.startswith("loaded master")]
+        assert [p for p in response['problems'] if p.startswith("loaded master")] == []
+        response = sendRequest(dict(command="glyph", document=docPath, glyph="glyphOne", instance="TestStyle_pop500.000"), socketPath)
+        assert response['reloaded'] == dict(document=False, sources=[], glyphs=[])
+        assert '<glyph name="glyphOne"' in response['glif']
+        # edit one glyph in a master
+        d = DesignSpaceProcessor(useVarlib=useVarlib)
+        d.read(docPath)
+        masterPath = d.sources[0].path
+        master = Font(masterPath)
+        width = master['glyphOne'].width
+        master['glyphOne'].width = 1000
+        master.save(masterPath)
+        response = sendRequest(dict(command="glyph", document=docPath, glyph="glyphOne", location=d.sources[0].location), socketPath)
+        assert response['reloaded']['glyphs'] == ['glyphOne'], response['reloaded']
+        assert 'advance width="1000"' in response['glif']
+        master['glyphOne'].width = width
+        master.save(masterPath)
+        assert main(["--socket", socketPath, "build", docPath, "-g", "glyphOne"]) in (0, 1)
+    finally:
+        assert main(["--socket", socketPath, "stop"]) == 0
+        thread.join()
+        server.server_close()
+    assert main(["--socket", socketPath, "status"]) == 2
+    # a file that is not a socket is left alone
+    with open(socketPath, "w") as f:
+        f.write("not a socket")
+    try:
+        assert main(["--socket", socketPath, "serve"]) == 2
+        assert os.path.exists(socketPath)
+    finally:
+        os.remove(socketPath)
+    # a socket nobody listens on is left over from a server that died, it is replaced
+    s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    s.bind(socketPath)
+    s.close()
+    server = BuildServer(socketPath, makeParser().parse_args(["serve"]))
+    server.server_close()
+    assert not os.path.exists(socketPath)
+
+def testBinaryOutput(docPath, useVarlib=True):
+    # the instances compiled to TrueType and CFF have the glyphs, widths and kerning of the UFOs
+    from fontTools.ttLib import TTFont
+    from ufoProcessor.fontCompiler import canCompileTrueType
+    outputFormats = ["otf"]
+    if canCompileTrueType():
+        outputFormats.insert(0, "ttf")
+    else:
+        print("testBinaryOutput: no cu2qu, skipping ttf")
+    for outputFormat in outputFormats:
+        d = DesignSpaceProcessor(useVarlib=useVarlib)
+        d.read(docPath)
+        d.roundGeometry = True
+        d.outputFormat = outputFormat
+        d.generateUFO()
+        assert [p for p in d.problems if p.startswith("Could not")] == []
+        for instance in d.instances:
+            if instance.path is None:
+                continue
+            font = d.makeInstance(instance, doRules=True)
+            ttFont = TTFont(os.path.splitext(instance.path)[0] + "." + outputFormat)
+            assert ttFont.getGlyphOrder()[0] == ".notdef"
+            assert ("glyf" in ttFont) == (outputFormat == "ttf")
+            for g in font:
+                assert ttFont['hmtx'][g.name][0] == g.width
+                for unicode in g.unicodes:
+                    assert ttFont.getBestCmap()[unicode] == g.name
+            if font.kerning:
+                assert 'GPOS' in ttFont
+
+def testThreads(docPath, useVarlib=True):
+    # many threads share one processor, every mutator is built once
+    # and the problems of each thread stay with that thread.
+    import time
+    import threading
+    import traceback
+    import collections
+    class CountingProcessor(DesignSpaceProcessor):
+        def __init__(self, *args, **kwargs):
+            super(CountingProcessor, self).__init__(*args, **kwargs)
+            self.counts = collections.Counter()
+        def collectMastersForGlyph(self, glyphName, decomposeComponents=False):
+            self.counts[glyphName] += 1
+            time.sleep(0.001)
+            return super(CountingProcessor, self).collectMastersForGlyph(glyphName, decomposeComponents=decomposeComponents)
+        def collectMastersForKerning(self):
+            self.counts['kerning'] += 1
+            time.sleep(0.001)
+            return super(CountingProcessor, self).collectMastersForKerning()
+    d = CountingProcessor(useVarlib=useVarlib)
+    d.read(docPath)
+    d.loadFonts()
+    d.findDefault()
+    reference = dict([(instance.name, d.makeInstance(instance)) for instance in d.instances])
+    d._glyphMutators = {}
+    d._kerningMutator = None
+    d._infoMutator = None
+    d.counts.clear()
+    errors = []
+    def serve(instance, index):
+        try:
+            with d.collectProblems() as problems:
+                d.problems.append("request %d" % index)
+                font = d.makeInstance(instance)
+            assert problems[0] == "request %d" % index
+            assert "request %d" % index not in d.problems
+            for g in reference[instance.name]:
+                assert [[(p.x, p.y) for p in c] for c in g] == [[(p.x, p.y) for p in c] for c in font[g.name]]
+        except Exception:
+            errors.append(traceback.format_exc())
+    threads = [threading.Thread(target=serve, args=(instance, index)) for index, instance in enumerate(d.instances * 4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == [], errors[0]
+    # mutators that could not be made are tried again
+    for glyphName, decomposeComponents in d._glyphMutators.keys():
+        assert d.counts[glyphName] == 1
+    if d._kerningMutator is not None:
+        assert d.counts['kerning'] == 1
+
+def testHealthScan(docPath, useVarlib=True):
+    # the test masters interpolate cleanly over the whole designspace
+    d = DesignSpaceProcessor(useVarlib=useVarlib)
+    d.read(docPath)
+    report = d.scanInterpolation(steps=3)
+    assert report['locations'] == 3 ** len(d.axes)
+    assert [p for p in report['problems'] if p['check'] == "direction"] == []
+
+def testMakeMetrics(docPath, useVarlib=True):
+    # the metrics tables match the instances, from defcon glyphs, glif readers and packed masters
+    d = DesignSpaceProcessor(useVarlib=useVarlib)
+    d.read(docPath)
+    d.roundGeometry = True
+    reference = list(d.iterInstances(processRules=False, releaseMemory=False))
+    locations = [instance.location for instance in d.instances]
+    for masters in ["defcon", "glif", "packed"]:
+        d = DesignSpaceProcessor(useVarlib=useVarlib)
+        d.read(docPath)
+        d.roundGeometry = True
+        d.fastMasterReading = masters == "glif"
+        shared = None
+        if masters == "packed":
+            shared = d.shareMasters()
+            d.useMasterData(shared)
+        try:
+            tables = d.makeMetrics(locations)
+        finally:
+            if shared is not None:
+                shared.unlink()
+        assert tables['glyphNames'] == d.glyphNames
+        for index, (instance, font) in enumerate(reference):
+            for g in font:
+                if g.name in instance.glyphs:
+                    # the instance has its own instructions for this glyph
+                    continue
+                assert tables['widths'][g.name][index] == g.width
+                assert tables['leftMargins'][g.name][index] == g.leftMargin
+                assert tables['rightMargins'][g.name][index] == g.rightMargin
+            kerning = dict([(pair, values[index]) for pair, values in tables['kerning'].items() if values[index] is not None])
+            assert kerning == dict(font.kerning.items())
+            assert tables['info']['ascender'][index] == font.info.ascender
+            assert tables['info']['unitsPerEm'][index] == font.info.unitsPerEm
+        assert tables['kerningPairs'] == sorted(tables['kerning'])
+        assert all([len(values) == len(locations) for values in tables['kerning'].values()])
+    assert d._glyphMutators == {}
+
 selfTest = True
 if selfTest:
+    testCompactKerning()
     for extension in ['varlib', 'mutator']:
         print("\n\n", extension)
         USEVARLIBMODEL = extension == 'varlib'
@@ -284,5 +1088,30 @@ if selfTest:
         _makeTestDocument(docPath, useVarlib=USEVARLIBMODEL)
         _testGenerateInstances(docPath, useVarlib=USEVARLIBMODEL)
         testSwap(docPath)
+        testGlyphIndex(docPath, useVarlib=USEVARLIBMODEL)
+        testGlyphWorkers(docPath, useVarlib=USEVARLIBMODEL)
+        testRoundedExtraction(docPath, useVarlib=USEVARLIBMODEL)
+        if USEVARLIBMODEL:
+            testSparseDeltas(docPath)
+            testSupportIndex(docPath)
+        testStaticMutator(docPath, useVarlib=USEVARLIBMODEL)
+        testSameLocationInstances(docPath, useVarlib=USEVARLIBMODEL)
+        testGlyphMastersCache(docPath, useVarlib=USEVARLIBMODEL)
+        testIterInstances(docPath, useVarlib=USEVARLIBMODEL)
+        testSharedMasters(docPath, useVarlib=USEVARLIBMODEL)
+        testLowMemory(docPath, useVarlib=USEVARLIBMODEL)
+        testGlyphMajor(docPath, useVarlib=USEVARLIBMODEL)
+        testUpdateDesignSpace(docPath, useVarlib=USEVARLIBMODEL)
+        testMasterSnapshot(docPath, useVarlib=USEVARLIBMODEL)
+        testCommandLine(docPath, useVarlib=USEVARLIBMODEL)
+        testIncrementalSave(docPath, useVarlib=USEVARLIBMODEL)
+        testPipelinedSave(docPath, useVarlib=USEVARLIBMODEL)
+        testHealthScan(docPath, useVarlib=USEVARLIBMODEL)
+        testMakeMetrics(docPath, useVarlib=USEVARLIBMODEL)
+        testFastMasterReading(docPath, useVarlib=USEVARLIBMODEL)
+        testShards(docPath, useVarlib=USEVARLIBMODEL)
+        testThreads(docPath, useVarlib=USEVARLIBMODEL)
+        testBinaryOutput(docPath, useVarlib=USEVARLIBMODEL)
+        testDaemon(docPath, useVarlib=USEVARLIBMODEL)
         _makeTestDocument(docPath, makeSmallChange=False, useVarlib=USEVARLIBMODEL)
         _testGenerateInstances(docPath, useVarlib=USEVARLIBMODEL)
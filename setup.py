@@ -14,5 +14,12 @@ setup(name = "ufoProcessor",
               "ufoProcessor",
       ],
       package_dir = {"":"Lib"},
+      entry_points = {
+              "console_scripts": [
+                      "ufoprocessor = ufoProcessor.commandLine:main",
+                      "ufoprocessor-shards = ufoProcessor.shards:main",
+                      "ufoprocessor-daemon = ufoProcessor.daemon:main",
+              ],
+      },
       python_requires='>=2.7',
 )